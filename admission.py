@@ -0,0 +1,287 @@
+"""Per-owner admission control for the generation endpoints.
+
+Each request is accounted to an owner (the hashed API key, or the client
+address for anonymous callers) and first charged against that owner's token
+bucket; an empty bucket is refused straight away. An admitted request then
+needs a run slot: at most MAX_CONCURRENT_PER_OWNER per owner and MAX_ACTIVE
+overall. Requests that find no free slot wait in a fair queue, served
+round-robin across owners, for up to QUEUE_TIMEOUT seconds, so one busy key
+cannot starve everyone else. Settings live in config.ADMISSION_CONFIG.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from config import ADMISSION_CONFIG
+
+# drop idle token buckets once this many owners have been seen
+_MAX_BUCKETS = 10000
+
+
+class Rejected(Exception):
+    """The request was not admitted; `body` is the JSON error and `status` the HTTP status."""
+
+    def __init__(self, message, retry_after, queue_position=None):
+        super().__init__(message)
+        self.status = 429
+        self.body = {"success": False, "error": message, "retry_after": max(1, int(math.ceil(retry_after)))}
+        if queue_position is not None:
+            self.body["queue_position"] = queue_position
+
+
+class Ticket:
+    """A run slot held by one request; release() it exactly when the request is done."""
+
+    def __init__(self, controller, owner):
+        self.owner = owner
+        self.started = time.monotonic()
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(self.owner, time.monotonic() - self.started)
+
+
+class _Waiter:
+    def __init__(self, owner, loop=None):
+        self.owner = owner
+        self.granted = False
+        self.event = threading.Event()
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+
+    def grant(self):
+        self.granted = True
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class AdmissionController:
+    def __init__(self, config=None):
+        self.config = config if config is not None else ADMISSION_CONFIG
+        self._lock = threading.Lock()
+        # owner -> (tokens, monotonic time of last refill)
+        self._buckets = {}
+        # owner -> running requests
+        self._active = {}
+        self._active_total = 0
+        # owner -> deque of waiters; key order is the round-robin rotation
+        self._queues = OrderedDict()
+        self._queued_total = 0
+        # moving average of how long a slot is held, for Retry-After hints
+        self._avg_service = 5.0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected_rate = 0
+        self.rejected_queue_full = 0
+        self.queue_timeouts = 0
+
+    def _setting(self, name, default):
+        return self.config.get(name, default)
+
+    def _take_token(self, owner, now):
+        """Charge one request to `owner`; returns 0, or seconds until a token is available."""
+        rate = float(self._setting('RATE', 0))
+        if rate <= 0:
+            return 0
+        burst = max(1.0, float(self._setting('BURST', 1)))
+        if len(self._buckets) > _MAX_BUCKETS:
+            self._buckets = {
+                key: (tokens, updated) for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * rate < burst
+            }
+        tokens, updated = self._buckets.get(owner, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self._buckets[owner] = (tokens, now)
+            return (1 - tokens) / rate
+        self._buckets[owner] = (tokens - 1, now)
+        return 0
+
+    def _refund_token(self, owner):
+        if owner in self._buckets:
+            tokens, updated = self._buckets[owner]
+            self._buckets[owner] = (tokens + 1, updated)
+
+    def _can_run(self, owner):
+        return (
+            self._active_total < self._setting('MAX_ACTIVE', 1)
+            and self._active.get(owner, 0) < self._setting('MAX_CONCURRENT_PER_OWNER', 1)
+        )
+
+    def _start(self, owner):
+        self._active[owner] = self._active.get(owner, 0) + 1
+        self._active_total += 1
+
+    def _position(self, owner, index):
+        """Approximate place in line of the waiter at `index` in `owner`'s queue (1-based)."""
+        ahead = sum(min(len(queue), index + 1) for key, queue in self._queues.items() if key != owner)
+        return ahead + index + 1
+
+    def _retry_hint(self, owner, position):
+        per_owner = max(1, self._setting('MAX_CONCURRENT_PER_OWNER', 1))
+        return max(1.0, self._avg_service * position / per_owner)
+
+    def _arrive(self, owner, loop=None):
+        """Charge the bucket, then take a slot or a queue place; returns (ticket, waiter)."""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._take_token(owner, now)
+            if wait:
+                self.rejected_rate += 1
+                raise Rejected("Too many requests for this API key. Please slow down and try again.", wait)
+            if owner not in self._queues and self._can_run(owner):
+                self._start(owner)
+                self.admitted += 1
+                return Ticket(self, owner), None
+            queue = self._queues.get(owner) or ()
+            if (
+                len(queue) >= self._setting('MAX_QUEUED_PER_OWNER', 0)
+                or self._queued_total >= self._setting('MAX_QUEUED', 0)
+            ):
+                self._refund_token(owner)
+                self.rejected_queue_full += 1
+                position = self._position(owner, len(queue))
+                raise Rejected(
+                    "Too many of your requests are already waiting. Please try again shortly.",
+                    self._retry_hint(owner, position),
+                    queue_position=position,
+                )
+            waiter = _Waiter(owner, loop)
+            self._queues.setdefault(owner, deque()).append(waiter)
+            self._queued_total += 1
+            self.waited += 1
+            return None, waiter
+
+    def _remove_waiter(self, waiter):
+        """Take an ungranted waiter out of line; returns the position it had."""
+        queue = self._queues.get(waiter.owner)
+        if not queue or waiter not in queue:
+            return None
+        position = self._position(waiter.owner, queue.index(waiter))
+        queue.remove(waiter)
+        self._queued_total -= 1
+        if not queue:
+            del self._queues[waiter.owner]
+        return position
+
+    def _settle(self, waiter):
+        """Turn a finished wait into a Ticket, or raise Rejected if it timed out."""
+        with self._lock:
+            if waiter.granted:
+                self.admitted += 1
+                return Ticket(self, waiter.owner)
+            position = self._remove_waiter(waiter)
+            self.queue_timeouts += 1
+            retry_after = self._retry_hint(waiter.owner, position or 1)
+        raise Rejected(
+            "The server is busy with other requests. Please try again shortly.",
+            retry_after,
+            queue_position=position,
+        )
+
+    def _dispatch(self):
+        """Hand free slots to waiters, one owner at a time in rotation (call with the lock held)."""
+        progressed = True
+        while progressed and self._queues:
+            progressed = False
+            for owner in list(self._queues):
+                if not self._can_run(owner):
+                    continue
+                queue = self._queues[owner]
+                waiter = queue.popleft()
+                self._queued_total -= 1
+                if queue:
+                    self._queues.move_to_end(owner)
+                else:
+                    del self._queues[owner]
+                self._start(owner)
+                waiter.grant()
+                progressed = True
+                break
+
+    def _release(self, owner, held_for):
+        with self._lock:
+            remaining = self._active.get(owner, 0) - 1
+            if remaining > 0:
+                self._active[owner] = remaining
+            else:
+                self._active.pop(owner, None)
+            self._active_total -= 1
+            self._avg_service = 0.8 * self._avg_service + 0.2 * held_for
+            self._dispatch()
+
+    def acquire(self, owner):
+        """Block until `owner` may run; returns a Ticket or raises Rejected."""
+        ticket, waiter = self._arrive(owner)
+        if ticket is not None:
+            return ticket
+        waiter.event.wait(self._setting('QUEUE_TIMEOUT', 0))
+        return self._settle(waiter)
+
+    async def acquire_async(self, owner):
+        """Async counterpart of acquire(): waits on the event loop instead of a thread."""
+        ticket, waiter = self._arrive(owner, asyncio.get_running_loop())
+        if ticket is not None:
+            return ticket
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self._setting('QUEUE_TIMEOUT', 0))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # the client went away: give back the queue place, or the slot if it was just granted
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._remove_waiter(waiter)
+            if granted:
+                Ticket(self, waiter.owner).release()
+            raise
+        return self._settle(waiter)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self._active_total,
+                'queued': self._queued_total,
+                'owners_active': len(self._active),
+                'owners_queued': len(self._queues),
+                'admitted': self.admitted,
+                'waited': self.waited,
+                'rejected_rate_limited': self.rejected_rate,
+                'rejected_queue_full': self.rejected_queue_full,
+                'queue_timeouts': self.queue_timeouts,
+                'max_active': self._setting('MAX_ACTIVE', 1),
+                'max_concurrent_per_owner': self._setting('MAX_CONCURRENT_PER_OWNER', 1),
+            }
+
+
+_CONTROLLER = AdmissionController()
+
+
+def enabled():
+    return bool(ADMISSION_CONFIG.get('ENABLED', True))
+
+
+def acquire(owner):
+    return _CONTROLLER.acquire(owner)
+
+
+async def acquire_async(owner):
+    return await _CONTROLLER.acquire_async(owner)
+
+
+def stats():
+    return _CONTROLLER.stats()
@@ -1,8 +1,11 @@
+from functools import wraps
+
 from flask import Flask, render_template, request, jsonify
 from urllib.parse import quote
 from generators import (
     enhance_prompt_api,
     generate_image_api,
+    generate_batch_api,
     estimate_price_api,
     chat_api,
 )
@@ -18,6 +21,14 @@ from generators import (
     save_prompt_api,
     list_prompts_api,
     delete_prompt_api,
+    search_api,
+    suggest_prompts_api,
+    metrics_api,
+    submit_job_api,
+    job_status_api,
+    job_events_api,
+    owner_key,
+    retry_after_headers,
 )
 import os
 
@@ -35,10 +46,54 @@ app = Flask(__name__)
 # Import API configuration
 from config import API_CONFIG
 import logging
+import admission
+import upstream
 
 logger = logging.getLogger(__name__)
 
+# Open pooled keep-alive connections to the upstream API before the first request
+upstream.warm_up()
+
+
+def admission_controlled(view):
+    """Run `view` only once the caller is admitted (rate limit, concurrency cap, fair queue)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not admission.enabled():
+            return view(*args, **kwargs)
+        try:
+            ticket = admission.acquire(owner_key(request))
+        except admission.Rejected as e:
+            return jsonify(e.body), e.status, retry_after_headers(e.body)
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            ticket.release()
+            raise
+        if response.is_streamed:
+            # held until the body has been sent, so a streamed chat reply keeps its slot. The
+            # body releases it itself: ASGI adapters (asgiref's WsgiToAsgi) never call close()
+            response.response = _release_after(response.response, ticket)
+            response.call_on_close(ticket.release)
+        else:
+            ticket.release()
+        return response
+    return wrapper
+
+
+def _release_after(body, ticket):
+    """Yield `body`, releasing `ticket` once it is exhausted or closed."""
+    try:
+        yield from body
+    finally:
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+        ticket.release()
+
+
 @app.route("/enhance_prompt", methods=["POST"])
+@admission_controlled
 def enhance_prompt():
     return enhance_prompt_api(request)
 
@@ -47,10 +102,17 @@ def home():
     return render_template("about.html")
 
 @app.route("/generate", methods=["POST"])
+@admission_controlled
 def generate_image():
     return generate_image_api(request)
 
 
+@app.route("/generate/batch", methods=["POST"])
+# not admission_controlled: each item is admitted on its own (see generate_batch_api)
+def generate_batch():
+    return generate_batch_api(request)
+
+
 @app.route('/api/estimate_price', methods=['POST'])
 def estimate_price():
     return estimate_price_api(request)
@@ -95,6 +157,7 @@ def gallery_page():
 
 
 @app.route('/api/chat', methods=['POST'])
+@admission_controlled
 def api_chat():
     return chat_api(request)
 
@@ -154,6 +217,37 @@ def api_delete_prompt():
     return delete_prompt_api(request)
 
 
+@app.route('/api/prompts/suggest', methods=['GET'])
+def api_suggest_prompts():
+    return suggest_prompts_api(request)
+
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    return search_api(request)
+
+
+@app.route('/api/jobs', methods=['POST'])
+@admission_controlled
+def api_submit_job():
+    return submit_job_api(request)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    return job_status_api(request, job_id)
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def api_job_events(job_id):
+    return job_events_api(request, job_id)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    return metrics_api(request)
+
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,300 @@
+"""ASGI entry point for running the app under an async server, e.g. `uvicorn asgi:app`.
+
+The long-running upstream-bound endpoints (/generate, /api/chat, /enhance_prompt)
+are served directly on the event loop, so a slow image or video generation only
+costs a pending coroutine instead of a blocked worker thread. Every other route
+is handed to the Flask app unchanged.
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from requests.exceptions import RequestException
+from werkzeug.datastructures import Headers, MultiDict
+
+from app import app as flask_app
+from config import MEDIA_CONFIG
+import admission
+import generators
+import upstream
+
+logger = logging.getLogger(__name__)
+
+_flask_asgi = WsgiToAsgi(flask_app)
+
+
+class AsyncRequest:
+    """The parts of a Flask request that the shared generators helpers read."""
+
+    def __init__(self, scope, body):
+        self.method = scope.get('method', 'GET')
+        self.path = scope.get('path', '/')
+        self.headers = Headers([
+            (name.decode('latin-1'), value.decode('latin-1'))
+            for name, value in scope.get('headers', [])
+        ])
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.host = self.headers.get('Host', '')
+        self.host_url = f"{scope.get('scheme', 'http')}://{self.host}/"
+        self.remote_addr = (scope.get('client') or (None,))[0]
+        self.body = body
+
+    @property
+    def is_json(self):
+        mimetype = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        return mimetype == 'application/json' or (
+            mimetype.startswith('application/') and mimetype.endswith('+json')
+        )
+
+    def get_json(self, silent=False):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            if silent:
+                return None
+            raise
+
+
+async def generate_image(request):
+    if not request.is_json:
+        return {"success": False, "error": "Request must be JSON"}, 200
+    data = request.get_json(silent=True) or {}
+    call = generators.prepare_generation_request(data, request)
+    flight_key = generators.generation_flight_key(call, request)
+    if flight_key is None:
+        return await _run_generation(call, request)
+    result, _ = await generators.GENERATION_FLIGHTS.do_async(flight_key, lambda: _run_generation(call, request))
+    return result
+
+
+async def _run_generation(call, request):
+    cached = generators.lookup_generation_cache(call, request)
+    if cached is not None:
+        try:
+            return await asyncio.to_thread(generators.finish_generation_response, cached, call, request)
+        finally:
+            cached.close()
+    try:
+        img_response = await upstream.async_get(call['url'], endpoint=generators.generation_endpoint(call), headers=call['headers'], stream=True)
+        logger.debug("[GENERATE] Pollinations API response: %s", img_response.status_code)
+    except RequestException as e:
+        return generators.generation_request_error(e), generators.request_error_status(e)
+    try:
+        video_filename = None
+        content_type = img_response.headers.get('content-type', '').lower()
+        if img_response.status_code == 200 and content_type.startswith('video'):
+            try:
+                video_filename = await _save_video_stream(img_response, content_type)
+            except generators.MediaTooLarge:
+                return generators.video_too_large_error(), 200
+            except RequestException as e:
+                return generators.generation_request_error(e), generators.request_error_status(e)
+        else:
+            await img_response.aread()
+    finally:
+        await img_response.aclose()
+    # pricing lookups and image re-encoding block, so keep them off the event loop
+    return await asyncio.to_thread(
+        generators.finish_generation_response, img_response, call, request, video_filename,
+    )
+
+
+async def _save_video_stream(img_response, content_type):
+    download = generators.VideoDownload(
+        generators.video_extension(content_type),
+        img_response.headers.get('content-length'),
+    )
+    try:
+        with upstream.requests_errors():
+            async for chunk in img_response.aiter_bytes(MEDIA_CONFIG.get('DOWNLOAD_CHUNK_SIZE', 65536)):
+                download.write(chunk)
+        return download.commit()
+    except Exception:
+        download.abort()
+        raise
+
+
+class EventStream:
+    """Handler result that is sent as a text/event-stream body instead of JSON."""
+
+    def __init__(self, events):
+        self.events = events
+
+
+async def _chat_stream(resp, model, request):
+    reply_parts = []
+    finish_reason = None
+    try:
+        if not generators.is_event_stream(resp):
+            await resp.aread()
+            for event in await asyncio.to_thread(generators.chat_fallback_events, resp, model, request):
+                yield event
+            return
+        async for line in upstream.aiter_lines(resp):
+            parsed = generators.parse_chat_stream_line(line)
+            if parsed is None:
+                continue
+            text, reason, done = parsed
+            if reason:
+                finish_reason = reason
+            if text:
+                reply_parts.append(text)
+                yield generators.sse_event('delta', {'text': text})
+            if done:
+                break
+    except RequestException as e:
+        yield generators.sse_event('error', generators.chat_request_error(e))
+        return
+    finally:
+        await resp.aclose()
+    closing = await asyncio.to_thread(
+        generators.chat_stream_closing_events, ''.join(reply_parts), finish_reason, model, request,
+    )
+    for event in closing:
+        yield event
+
+
+async def chat(request):
+    if not request.is_json:
+        return {"success": False, "error": "Request must be JSON"}, 200
+    data = request.get_json(silent=True) or {}
+    call = generators.prepare_chat_request(data, request)
+    try:
+        resp = await upstream.async_post(
+            call['url'],
+            endpoint='chat',
+            headers=call['headers'],
+            json=call['payload'],
+            stream=call['stream'],
+        )
+    except RequestException as e:
+        return generators.chat_request_error(e), generators.request_error_status(e)
+    if call['stream']:
+        if resp.status_code == 200:
+            return EventStream(_chat_stream(resp, call['model'], request))
+        await resp.aread()
+        await resp.aclose()
+    return await asyncio.to_thread(generators.finish_chat_response, resp, call['model'], request)
+
+
+async def enhance_prompt(request):
+    if not request.is_json:
+        return {"success": False, "error": "Request must be JSON"}, 200
+    data = request.get_json(silent=True) or {}
+    call = generators.prepare_enhance_request(data, request)
+    result, _ = await generators.ENHANCE_FLIGHTS.do_async(
+        generators.enhance_flight_key(call, request),
+        lambda: _run_enhance(call),
+    )
+    return result
+
+
+async def _run_enhance(call):
+    try:
+        response = await upstream.async_get(
+            call['url'],
+            endpoint='enhance',
+            headers=call['headers'],
+            params=call['params'],
+        )
+    except RequestException as e:
+        return generators.enhance_request_error(e), generators.request_error_status(e)
+    return generators.finish_enhance_response(response)
+
+
+_ROUTES = {
+    ('POST', '/generate'): generate_image,
+    ('POST', '/api/chat'): chat,
+    ('POST', '/enhance_prompt'): enhance_prompt,
+}
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def _send_json(send, body, status=200, headers=None):
+    payload = json.dumps(body).encode('utf-8')
+    response_headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(payload)).encode('latin-1')),
+    ]
+    for name, value in (headers or {}).items():
+        response_headers.append((name.lower().encode('latin-1'), str(value).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def _send_event_stream(send, stream):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    async for event in stream.events:
+        await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstream.close_async_client()
+            # starred items and prompts still waiting for the write-behind flusher
+            await asyncio.to_thread(generators.flush_storage)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+
+    handler = _ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if handler is None:
+        await _flask_asgi(scope, receive, send)
+        return
+
+    request = AsyncRequest(scope, await _read_body(receive))
+    # every async route is a generation endpoint, so all of them go through admission control
+    ticket = None
+    if admission.enabled():
+        try:
+            ticket = await admission.acquire_async(generators.owner_key(request))
+        except admission.Rejected as e:
+            await _send_json(send, e.body, e.status, generators.retry_after_headers(e.body))
+            return
+    try:
+        try:
+            result = await handler(request)
+        except generators.ApiError as e:
+            result = e.body, e.status
+        except Exception as e:
+            logger.exception("Unexpected error in async %s", request.path)
+            result = {"success": False, "error": f"Unexpected error: {str(e)}"}, 200
+        if isinstance(result, EventStream):
+            await _send_event_stream(send, result)
+            return
+        body, status = result
+        await _send_json(send, body, status, generators.retry_after_headers(body))
+    finally:
+        if ticket is not None:
+            ticket.release()
@@ -0,0 +1,197 @@
+"""Prompt autocomplete from an owner's saved prompts and starred-item prompts.
+
+Each owner's distinct prompts are kept in a sorted array of normalised keys
+(lowercase, collapsed whitespace), so the prompts starting with what has been
+typed are one bisect away. Candidates are ranked by frequency (the number of
+starred items with that prompt, plus one while it is in the saved history)
+and recency, with the recency bonus halving every RECENCY_HALF_LIFE days.
+
+Owners are indexed from storage on their first request and then updated by
+the prompt and star views (add_saved(), remove_saved(), add_starred(),
+remove_starred()). Indexes of owners not seen recently are evicted (LRU,
+MAX_OWNERS), and an index is rebuilt after REBUILD_AFTER seconds so other
+workers' changes show up.
+"""
+import bisect
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from config import AUTOCOMPLETE_CONFIG
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+def _timestamp(iso):
+    """Seconds since the epoch for a stored created_at string, or 0 when unparseable."""
+    if not iso:
+        return 0.0
+    try:
+        return datetime.fromisoformat(iso.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return 0.0
+
+
+class _OwnerPrompts:
+    def __init__(self):
+        self.built_at = time.monotonic()
+        self.keys = []  # sorted normalised prompts
+        # normalised prompt -> [text as last written, starred count, saved?, last use timestamp, save timestamp]
+        self.entries = {}
+
+    def _entry(self, text, used_at):
+        key = normalize(text)
+        if not key:
+            return None
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [text.strip(), 0, False, used_at, 0.0]
+            bisect.insort(self.keys, key)
+        elif used_at >= entry[3]:
+            entry[0] = text.strip()
+            entry[3] = used_at
+        return entry
+
+    def _drop_if_unused(self, text):
+        key = normalize(text)
+        entry = self.entries.get(key)
+        if entry is None or entry[1] > 0 or entry[2]:
+            return
+        del self.entries[key]
+        position = bisect.bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+
+    def add(self, text, used_at, saved):
+        entry = self._entry(text, used_at)
+        if entry is None:
+            return
+        if saved:
+            entry[2] = True
+            entry[4] = used_at
+        else:
+            entry[1] += 1
+
+    def remove(self, text, saved):
+        entry = self.entries.get(normalize(text))
+        if entry is None:
+            return
+        if saved:
+            entry[2] = False
+        else:
+            entry[1] = max(0, entry[1] - 1)
+        self._drop_if_unused(text)
+
+    def trim_saved(self, limit):
+        """Keep only the newest `limit` saved prompts, as storage does."""
+        saved = sorted((entry for entry in self.entries.values() if entry[2]), key=lambda entry: entry[4], reverse=True)
+        for entry in saved[limit:]:
+            self.remove(entry[0], saved=True)
+
+    def complete(self, prefix, limit, half_life, now):
+        start = bisect.bisect_left(self.keys, prefix)
+        candidates = []
+        for key in self.keys[start:]:
+            if not key.startswith(prefix):
+                break
+            text, starred, saved, used_at, _ = self.entries[key]
+            count = starred + (1 if saved else 0)
+            age_days = max(0.0, now - used_at) / 86400
+            score = math.log1p(count) + 2 ** (-age_days / half_life)
+            candidates.append((score, used_at, text, count))
+        return heapq.nlargest(limit, candidates)
+
+
+class PromptCompleter:
+    def __init__(self, load, config=None):
+        """`load(owner_id)` returns (starred items, saved prompts) from storage."""
+        self._load = load
+        self.config = config if config is not None else AUTOCOMPLETE_CONFIG
+        self._lock = threading.Lock()
+        self._owners = OrderedDict()
+        self.builds = 0
+        self.queries = 0
+        self.evictions = 0
+
+    def _build(self, owner_id):
+        starred, prompts = self._load(owner_id)
+        index = _OwnerPrompts()
+        for item in starred:
+            if isinstance(item, dict) and item.get('prompt'):
+                index.add(str(item['prompt']), _timestamp(item.get('created_at')), saved=False)
+        for prompt in prompts:
+            if isinstance(prompt, dict) and prompt.get('text'):
+                index.add(prompt['text'], _timestamp(prompt.get('created_at')), saved=True)
+        self.builds += 1
+        return index
+
+    def _index(self, owner_id):
+        """The owner's index, built (or rebuilt when too old) as needed; call with the lock held."""
+        index = self._owners.get(owner_id)
+        if index is None or time.monotonic() - index.built_at >= self.config.get('REBUILD_AFTER', 300):
+            index = self._owners[owner_id] = self._build(owner_id)
+            while len(self._owners) > self.config.get('MAX_OWNERS', 1000):
+                self._owners.popitem(last=False)
+                self.evictions += 1
+        self._owners.move_to_end(owner_id)
+        return index
+
+    def _update(self, owner_id, change):
+        """Apply `change(index)` if the owner is indexed; others are built on their next request."""
+        with self._lock:
+            index = self._owners.get(owner_id)
+            if index is not None:
+                change(index)
+
+    def add_saved(self, owner_id, text, created_at=None, limit=None):
+        """Index a saved prompt; with `limit`, only the newest `limit` saved prompts stay, mirroring storage."""
+        def change(index):
+            index.add(text, _timestamp(created_at) or time.time(), saved=True)
+            if limit is not None:
+                index.trim_saved(limit)
+        self._update(owner_id, change)
+
+    def remove_saved(self, owner_id, text):
+        self._update(owner_id, lambda index: index.remove(text, saved=True))
+
+    def add_starred(self, owner_id, text, created_at=None):
+        self._update(owner_id, lambda index: index.add(text, _timestamp(created_at) or time.time(), saved=False))
+
+    def remove_starred(self, owner_id, text):
+        self._update(owner_id, lambda index: index.remove(text, saved=False))
+
+    def complete(self, owner_id, prefix, limit=8):
+        """Up to `limit` prompts starting with `prefix`, best first: [{text, count, last_used}]."""
+        key = normalize(prefix)
+        if not key:
+            return []
+        with self._lock:
+            index = self._index(owner_id)
+            matches = index.complete(key, limit, self.config.get('RECENCY_HALF_LIFE', 30), time.time())
+            self.queries += 1
+        return [
+            {
+                'text': text,
+                'count': count,
+                'last_used': (
+                    datetime.fromtimestamp(used_at, timezone.utc).replace(tzinfo=None).isoformat() + 'Z'
+                    if used_at else None
+                ),
+            }
+            for _, used_at, text, count in matches
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'owners': len(self._owners),
+                'prompts': sum(len(index.keys) for index in self._owners.values()),
+                'builds': self.builds,
+                'queries': self.queries,
+                'evictions': self.evictions,
+            }
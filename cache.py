@@ -0,0 +1,349 @@
+"""Bounded, thread-safe in-memory cache with per-entry TTLs.
+
+TTLCache evicts least-recently-used entries once it holds more than
+`max_entries` entries (or `max_bytes`, when a `sizeof` function is given),
+and drops expired entries lazily. get_or_load() takes a per-key lock, so on a
+miss only one caller runs the loader while concurrent callers for the same
+key wait for its result. Loader errors accepted by `negative` (e.g. upstream
+403/404) are cached for `negative_ttl` and re-raised to later callers instead
+of asking upstream again.
+
+backend() is the cache shared by the worker processes of one host: a
+process-local MemoryBackend by default, or a SQLiteBackend file when
+CACHE_CONFIG['BACKEND'] is 'sqlite'. Its values must be JSON-serialisable and
+expiry uses wall-clock time, so every worker agrees on when an entry expires.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# every cache by name, for metrics
+_CACHES = {}
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ('value', 'error', 'expires_at', 'size')
+
+    def __init__(self, value, error, expires_at, size):
+        self.value = value
+        self.error = error
+        self.expires_at = expires_at
+        self.size = size
+
+
+class TTLCache:
+    def __init__(self, name, ttl, max_entries=1024, max_bytes=None, sizeof=None,
+                 negative=None, negative_ttl=30):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.negative = negative
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # key -> [lock, number of callers using it]
+        self._key_locks = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.expirations = 0
+        _CACHES[name] = self
+
+    def _lookup(self, key, now):
+        """Entry for `key` or None, counting expiry (call with the lock held)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _store(self, key, value, error, ttl):
+        size = self.sizeof(value) if (self.sizeof is not None and error is None) else 0
+        with self._lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = _Entry(value, error, time.monotonic() + ttl, size)
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get(self, key, default=None):
+        """Cached value for `key`, or `default`; re-raises a cached negative result."""
+        with self._lock:
+            entry = self._lookup(key, time.monotonic())
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry.error is not None:
+                self.negative_hits += 1
+                raise entry.error
+            self.hits += 1
+            return entry.value
+
+    def peek(self, key, default=None):
+        """Like get() but without touching LRU order, counters or cached errors."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.error is not None or entry.expires_at <= time.monotonic():
+                return default
+            return entry.value
+
+    def set(self, key, value, ttl=None):
+        """Store `value` for `ttl` seconds (default: the cache's TTL); a ttl <= 0 stores nothing."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl > 0:
+            self._store(key, value, None, ttl)
+
+    def set_error(self, key, error, ttl=None):
+        """Cache `error` as the negative result for `key`."""
+        self._store(key, None, error, self.negative_ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def age(self, key):
+        """Seconds until `key` expires (negative once expired), or None if absent."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry.expires_at - time.monotonic()
+
+    def _key_lock(self, key):
+        with self._lock:
+            holder = self._key_locks.get(key)
+            if holder is None:
+                holder = self._key_locks[key] = [threading.Lock(), 0]
+            holder[1] += 1
+            return holder
+
+    def _release_key_lock(self, key, holder):
+        with self._lock:
+            holder[1] -= 1
+            if holder[1] == 0:
+                self._key_locks.pop(key, None)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Cached value for `key`; on a miss one caller runs `loader()` while others wait for it."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        holder = self._key_lock(key)
+        try:
+            with holder[0]:
+                # another caller may have loaded it while we waited
+                with self._lock:
+                    entry = self._lookup(key, time.monotonic())
+                if entry is not None:
+                    if entry.error is not None:
+                        raise entry.error
+                    return entry.value
+                self.loads += 1
+                try:
+                    value = loader()
+                except Exception as e:
+                    if self.negative is not None and self.negative(e):
+                        self.set_error(key, e)
+                    raise
+                self.set(key, value, ttl)
+                return value
+        finally:
+            self._release_key_lock(key, holder)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes if self.sizeof is not None else None,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_ratio': ((self.hits + self.negative_hits) / lookups) if lookups else None,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+def stats():
+    return {name: cache.stats() for name, cache in _CACHES.items()}
+
+
+class MemoryBackend:
+    """Shared-cache backend local to this process (the default)."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """The stored value, or None when absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class SQLiteBackend:
+    """Shared-cache backend in a SQLite file that every worker on the host opens.
+
+    Errors are logged and treated as a miss, so a locked or broken file only
+    costs an upstream fetch.
+    """
+
+    name = 'sqlite'
+    # delete expired rows every this many writes
+    _PURGE_EVERY = 100
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM cache WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.debug("Shared cache read of %s failed: %s", key, str(e))
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time() + ttl),
+            )
+            self._writes += 1
+            if self._writes % self._PURGE_EVERY == 0:
+                conn.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.debug("Shared cache write of %s failed: %s", key, str(e))
+
+    def delete(self, key):
+        try:
+            self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.debug("Shared cache delete of %s failed: %s", key, str(e))
+
+    def stats(self):
+        try:
+            entries = self._connection().execute(
+                'SELECT COUNT(*) FROM cache WHERE expires_at > ?', (time.time(),)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {
+            'backend': self.name,
+            'path': self.path,
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+        }
+
+
+_BACKEND = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def backend():
+    """The configured shared-cache backend, created on first use."""
+    global _BACKEND
+    if _BACKEND is None:
+        with _BACKEND_LOCK:
+            if _BACKEND is None:
+                kind = (CACHE_CONFIG.get('BACKEND') or 'memory').lower()
+                if kind == 'sqlite':
+                    _BACKEND = SQLiteBackend(CACHE_CONFIG['PATH'])
+                else:
+                    if kind != 'memory':
+                        logger.warning("Unknown CACHE_BACKEND %r, using memory", kind)
+                    _BACKEND = MemoryBackend()
+    return _BACKEND
+
+
+def backend_stats():
+    return backend().stats()
@@ -0,0 +1,219 @@
+"""Upstream model catalogs (image, text and chat model lists) with a name index.
+
+Each catalog keeps the last successfully fetched list as an immutable
+snapshot with a dict index over model names and aliases, so pricing lookups
+are a dictionary hit instead of a download and a linear scan. A snapshot is
+refreshed in the background once it is REFRESH_AHEAD seconds from expiry, and
+a stale snapshot keeps being served (up to MAX_STALE) while a refresh runs or
+when it fails.
+
+Snapshots live in a shared TTLCache. When there is no snapshot at all, one
+caller per API key fetches it while the others wait, and a 403/404 answer is
+cached for NEGATIVE_TTL seconds for that key only. Fetched lists are also
+written to the host-wide cache backend (cache.backend()), and a worker whose
+snapshot is missing or due for refresh first adopts a newer list another
+worker already fetched.
+
+Refreshes are conditional: when the snapshot carries the upstream ETag it is
+sent as If-None-Match, and a 304 renews the snapshot without downloading or
+re-indexing the list. Snapshot.digest is a content hash the API views use as
+their own ETag towards browsers.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import cache
+from config import API_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogError(Exception):
+    """Upstream answered with a non-200 status and no usable snapshot exists."""
+
+    def __init__(self, response):
+        super().__init__(f"Model catalog fetch failed: status {response.status_code}")
+        self.response = response
+
+
+def _is_negative(exc):
+    return isinstance(exc, CatalogError) and exc.response.status_code in (403, 404)
+
+
+_SETTINGS = API_CONFIG.get('MODEL_CATALOG') or {}
+# catalog name -> Snapshot; (catalog name, key hash) -> cached 403/404 for a cold load
+_SNAPSHOTS = cache.TTLCache(
+    'model_catalogs',
+    ttl=_SETTINGS.get('MAX_STALE', 86400),
+    max_entries=_SETTINGS.get('MAX_ENTRIES', 256),
+    negative=_is_negative,
+    negative_ttl=_SETTINGS.get('NEGATIVE_TTL', 30),
+)
+
+
+def _auth_key(headers):
+    """Short hash of the Authorization header, so negative results stay per key."""
+    auth = (headers or {}).get('Authorization') or ''
+    return hashlib.sha256(auth.encode('utf-8')).hexdigest()[:16] if auth else 'anonymous'
+
+
+class Snapshot:
+    def __init__(self, items, fetched_at, etag=None):
+        """`etag` is the upstream ETag of the list, used for conditional refreshes."""
+        self.items = items
+        self.fetched_at = fetched_at
+        self.etag = etag
+        self._digest = None
+        self.index = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            name = item.get('name') or item.get('id')
+            for key in [name] + list(item.get('aliases') or []):
+                if key:
+                    self.index.setdefault(key, item)
+
+    def renewed(self, fetched_at):
+        """A copy confirmed unchanged at `fetched_at`, sharing this snapshot's items and index."""
+        snapshot = Snapshot.__new__(Snapshot)
+        snapshot.__dict__.update(self.__dict__)
+        snapshot.fetched_at = fetched_at
+        return snapshot
+
+    @property
+    def digest(self):
+        """Stable hash of the items, computed once per snapshot."""
+        if self._digest is None:
+            payload = json.dumps(self.items, sort_keys=True, separators=(',', ':'), default=str)
+            self._digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+        return self._digest
+
+    def age(self, now=None):
+        return (now if now is not None else time.time()) - self.fetched_at
+
+
+class ModelCatalog:
+    def __init__(self, name, fetch, parse):
+        """`fetch(headers)` returns an upstream response; `parse(json)` returns the list of model dicts."""
+        self.name = name
+        self._fetch = fetch
+        self._parse = parse
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.fetches = 0
+        self.background_refreshes = 0
+        self.stale_served = 0
+        self.shared_adopted = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def _settings():
+        return API_CONFIG.get('MODEL_CATALOG') or {}
+
+    def _fresh_for(self):
+        """Age below which a snapshot is used without starting a refresh."""
+        settings = self._settings()
+        return settings.get('TTL', 300) - settings.get('REFRESH_AHEAD', 60)
+
+    def _adopt_shared(self, current):
+        """Install the host-wide list if another worker fetched a newer one; returns the snapshot to use."""
+        shared = cache.backend().get(f'catalog:{self.name}')
+        if not isinstance(shared, dict) or not isinstance(shared.get('items'), list):
+            return current
+        fetched_at = shared.get('fetched_at') or 0
+        if current is not None and fetched_at <= current.fetched_at:
+            return current
+        snapshot = Snapshot(shared['items'], fetched_at, shared.get('etag'))
+        _SNAPSHOTS.set(self.name, snapshot)
+        self.shared_adopted += 1
+        return snapshot
+
+    def _load(self, headers):
+        """Fetch and install a new snapshot; raises CatalogError on a non-200 answer."""
+        current = self._adopt_shared(_SNAPSHOTS.peek(self.name))
+        if current is not None and current.age() < self._fresh_for():
+            return current
+        if current is not None and current.etag:
+            headers = dict(headers, **{'If-None-Match': current.etag})
+        response = self._fetch(headers)
+        self.fetches += 1
+        if response.status_code == 304 and current is not None:
+            self.not_modified += 1
+            snapshot = current.renewed(time.time())
+        elif response.status_code != 200:
+            raise CatalogError(response)
+        else:
+            snapshot = Snapshot(self._parse(response.json()), time.time(), response.headers.get('ETag'))
+        _SNAPSHOTS.set(self.name, snapshot)
+        cache.backend().set(
+            f'catalog:{self.name}',
+            {'items': snapshot.items, 'fetched_at': snapshot.fetched_at, 'etag': snapshot.etag},
+            self._settings().get('MAX_STALE', 86400),
+        )
+        return snapshot
+
+    def _refresh_in_background(self, headers):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        self.background_refreshes += 1
+
+        def _run():
+            try:
+                self._load(headers)
+            except Exception as e:
+                logger.debug("Background refresh of %s models failed: %s", self.name, str(e))
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=_run, name=f'catalog-refresh-{self.name}', daemon=True).start()
+
+    def snapshot(self, headers=None):
+        """Return a usable snapshot, fetching synchronously only when there is none."""
+        settings = self._settings()
+        ttl = settings.get('TTL', 300)
+        snapshot = _SNAPSHOTS.get(self.name)
+        if snapshot is None or snapshot.age() >= self._fresh_for():
+            snapshot = self._adopt_shared(snapshot)
+        if snapshot is not None:
+            age = snapshot.age()
+            if age < self._fresh_for():
+                return snapshot
+            if age < settings.get('MAX_STALE', 86400):
+                self._refresh_in_background(dict(headers or {}))
+                if age >= ttl:
+                    self.stale_served += 1
+                return snapshot
+        headers = headers or {}
+        # a waiter finds the snapshot the first caller installed instead of fetching again
+        return _SNAPSHOTS.get_or_load(
+            (self.name, _auth_key(headers)),
+            lambda: _SNAPSHOTS.peek(self.name) or self._load(headers),
+            ttl=0,
+        )
+
+    def lookup(self, name, headers=None):
+        """The model dict whose name or alias is `name`, or None."""
+        if not name:
+            return None
+        return self.snapshot(headers).index.get(name)
+
+    def invalidate(self):
+        _SNAPSHOTS.delete(self.name)
+
+    def stats(self):
+        snapshot = _SNAPSHOTS.peek(self.name)
+        return {
+            'models': len(snapshot.items) if snapshot is not None else None,
+            'age': round(snapshot.age(), 1) if snapshot is not None else None,
+            'fetches': self.fetches,
+            'background_refreshes': self.background_refreshes,
+            'stale_served': self.stale_served,
+            'shared_adopted': self.shared_adopted,
+            'not_modified': self.not_modified,
+        }
@@ -8,8 +8,143 @@ API_CONFIG = {
     'TEXT_MODELS_API': os.getenv('POLLINATIONS_TEXT_MODELS_API', 'https://gen.pollinations.ai/text/models'),
     'CHAT_COMPLETIONS_API': os.getenv('POLLINATIONS_CHAT_API', 'https://gen.pollinations.ai/v1/chat/completions'),
     'CHAT_MODELS_API': os.getenv('POLLINATIONS_CHAT_MODELS_API', 'https://gen.pollinations.ai/v1/models'),
+    'BALANCE_API': os.getenv('POLLINATIONS_BALANCE_API', 'https://gen.pollinations.ai/account/balance'),
     'API_TOKEN': os.getenv('POLLINATIONS_API_TOKEN', ''),  # Optional: Bearer token for authentication
     'REFERRER': os.getenv('POLLINATIONS_REFERRER', 'localhost:5000'),  # Fallback for local development
     'DEFAULT_MODEL': 'gptimage',  # Cheapest model
     'TIMEOUT': 120,  # Increased from 30 to 120 seconds for image generation
+    # Per-endpoint timeouts (seconds); endpoints not listed fall back to TIMEOUT
+    'TIMEOUTS': {
+        'image': 120,
+        'video': 120,
+        'chat': 120,
+        'enhance': 120,
+        'models': 10,
+        'balance': 10,
+        'validate': 10,
+        'warm_up': 5,
+    },
+    'POOL_SIZE': int(os.getenv('POLLINATIONS_POOL_SIZE', '20')),  # keep-alive connections per upstream host
+    'ASYNC_MAX_CONNECTIONS': int(os.getenv('POLLINATIONS_ASYNC_MAX_CONNECTIONS', '1000')),  # in-flight upstream calls on the async path
+    'WARM_UP': os.getenv('POLLINATIONS_WARM_UP', '1') != '0',  # open upstream connections at startup
+    # Idempotent upstream GETs are retried on connection failures and these statuses
+    'RETRY': {
+        'MAX_ATTEMPTS': int(os.getenv('POLLINATIONS_RETRY_ATTEMPTS', '3')),  # including the first try
+        'BACKOFF_BASE': 0.5,  # seconds, doubled per attempt with full jitter
+        'BACKOFF_MAX': 8,
+        'MAX_RETRY_AFTER': 10,  # a longer upstream Retry-After is passed on to the client instead
+        'STATUSES': (429, 502, 503, 504),
+        # endpoints retried on STATUSES and dropped connections; the others (image, video and enhance
+        # bill per call) only retry failed connects and a 429 that carries Retry-After
+        'STATUS_RETRY_ENDPOINTS': ('models', 'balance', 'validate'),
+    },
+    # Adaptive (AIMD) cap on concurrent upstream calls; calls over the cap are shed with a 503
+    'CONCURRENCY_LIMIT': {
+        'INITIAL': int(os.getenv('POLLINATIONS_CONCURRENCY_INITIAL', '32')),
+        'MIN': int(os.getenv('POLLINATIONS_CONCURRENCY_MIN', '4')),
+        'MAX': int(os.getenv('POLLINATIONS_CONCURRENCY_MAX', '256')),
+        'BACKOFF': 0.75,  # multiplicative decrease after a slow or failed call
+        'DECREASE_INTERVAL': 1.0,  # seconds; at most one decrease per interval
+        'RETRY_AFTER': 2,  # seconds suggested to shed requests
+        # calls slower than this (seconds, by endpoint) count as a congestion signal
+        # None: slow successes are not a congestion signal (video generation normally takes 60-120 s)
+        'LATENCY_TARGETS': {
+            'image': 60,
+            'video': None,
+            'chat': 30,
+            'enhance': 30,
+            'models': 3,
+            'balance': 3,
+            'validate': 3,
+        },
+    },
+    # Model lists (and the pricing read from them) are refreshed in the background before they expire
+    'MODEL_CATALOG': {
+        'TTL': int(os.getenv('MODEL_CATALOG_TTL', '300')),  # seconds a fetched list counts as fresh
+        'REFRESH_AHEAD': 60,  # start a background refresh this many seconds before expiry
+        'MAX_STALE': 86400,  # serve an older list while refreshing, up to this age
+        'NEGATIVE_TTL': int(os.getenv('MODEL_CATALOG_NEGATIVE_TTL', '30')),  # seconds a 403/404 is remembered per key
+        'MAX_ENTRIES': 256,  # bound on cached snapshots and negative results
+        'CHAT_PRICING_WAIT': 2,  # seconds /api/chat_models waits for text pricing once the chat list is in
+    },
+    'BALANCE_CACHE_TTL': float(os.getenv('BALANCE_CACHE_TTL', '5')),  # seconds /api/check_balance reuses a balance per key
+    # /api/validate_key results, cached per hashed API key
+    'KEY_VALIDATION': {
+        'TTL': int(os.getenv('KEY_VALIDATION_TTL', '300')),  # seconds a valid key is remembered
+        'NEGATIVE_TTL': int(os.getenv('KEY_VALIDATION_NEGATIVE_TTL', '30')),  # seconds a rejected key is remembered
+        'PROBE': os.getenv('KEY_VALIDATION_PROBE', 'balance'),  # 'balance' (small answer) or 'models' (full model list)
+    },
+    # Per-endpoint circuit breaker: fail fast while upstream keeps failing
+    'CIRCUIT_BREAKER': {
+        'FAILURE_THRESHOLD': int(os.getenv('POLLINATIONS_BREAKER_THRESHOLD', '5')),  # consecutive failures
+        'RESET_TIMEOUT': int(os.getenv('POLLINATIONS_BREAKER_RESET', '30')),  # seconds before a trial request
+        'FAILURE_STATUSES': (500, 502, 503, 504),
+    },
+}
+
+# Generated media handling
+MEDIA_CONFIG = {
+    'MAX_VIDEO_BYTES': int(os.getenv('MAX_VIDEO_MB', '200')) * 1024 * 1024,  # reject larger upstream videos
+    'DOWNLOAD_CHUNK_SIZE': 64 * 1024,  # bytes buffered per write while streaming media to disk
+    # 'original' forwards upstream image bytes unchanged; 'png', 'jpeg' or 'webp' re-encode on the server
+    'IMAGE_OUTPUT_FORMAT': os.getenv('IMAGE_OUTPUT_FORMAT', 'original'),
+    'IMAGE_OUTPUT_QUALITY': int(os.getenv('IMAGE_OUTPUT_QUALITY', '90')),  # jpeg/webp quality (1-100)
+    # Generated images are served from static/generated_images for a limited time
+    'IMAGE_BLOB_TTL': int(os.getenv('IMAGE_BLOB_TTL_HOURS', '24')) * 3600,  # seconds
+    'IMAGE_BLOB_MAX_BYTES': int(os.getenv('IMAGE_BLOB_MAX_MB', '500')) * 1024 * 1024,  # oldest evicted first
+    'IMAGE_BLOB_CLEANUP_INTERVAL': 60,  # seconds between expiry sweeps
+    # Fixed-seed generations are cached on disk and replayed; set GENERATION_CACHE_MB=0 to disable
+    'GENERATION_CACHE_DIR': os.getenv('GENERATION_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'data', 'generation_cache')),
+    'GENERATION_CACHE_MAX_BYTES': int(os.getenv('GENERATION_CACHE_MB', '1024')) * 1024 * 1024,
+    # POST /generate/batch: most items per request, and worker threads shared by all batches
+    'BATCH_MAX_ITEMS': int(os.getenv('GENERATE_BATCH_MAX_ITEMS', '16')),
+    'BATCH_WORKERS': int(os.getenv('GENERATE_BATCH_WORKERS', '4')),
+    # Background generation jobs (/api/jobs), queued on disk so they survive restarts
+    'JOBS_DIR': os.getenv('JOBS_DIR', os.path.join(os.path.dirname(__file__), 'data', 'jobs')),
+    'JOB_WORKERS': int(os.getenv('JOB_WORKERS', '2')),
+    'JOB_MAX_PENDING': int(os.getenv('JOB_MAX_PENDING', '5')),  # unfinished jobs per API key
+    'JOB_RETENTION': int(os.getenv('JOB_RETENTION_HOURS', '24')) * 3600,  # seconds finished jobs are kept
+}
+
+# Per-API-key admission control for /generate, /api/chat and /enhance_prompt (see admission.py)
+ADMISSION_CONFIG = {
+    'ENABLED': os.getenv('ADMISSION_ENABLED', '1') != '0',
+    'RATE': float(os.getenv('ADMISSION_RATE', '1')),  # requests per second per key (token refill rate, 0 = unlimited)
+    'BURST': int(os.getenv('ADMISSION_BURST', '10')),  # requests a key may make back to back
+    'MAX_CONCURRENT_PER_OWNER': int(os.getenv('ADMISSION_MAX_CONCURRENT', '2')),  # running requests per key
+    'MAX_ACTIVE': int(os.getenv('ADMISSION_MAX_ACTIVE', '32')),  # running requests across all keys
+    'MAX_QUEUED_PER_OWNER': int(os.getenv('ADMISSION_MAX_QUEUED', '4')),  # waiting requests per key
+    'MAX_QUEUED': int(os.getenv('ADMISSION_MAX_QUEUED_TOTAL', '128')),  # waiting requests across all keys
+    'QUEUE_TIMEOUT': float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '30')),  # seconds a request may wait for a slot
+}
+
+# Cache shared by the worker processes on one host (see cache.py): 'memory' keeps
+# it per process, 'sqlite' shares one file so one upstream fetch warms every worker
+CACHE_CONFIG = {
+    'BACKEND': os.getenv('CACHE_BACKEND', 'memory'),
+    'PATH': os.getenv('CACHE_PATH', os.path.join(os.path.dirname(__file__), 'data', 'cache.sqlite3')),
+}
+
+# Starred media and saved prompts (see storage.py): 'json' keeps one file per API key
+# under data/starred and data/prompts; 'sqlite' keeps rows in one WAL-mode database
+# (copy existing files over once with `python storage.py migrate`)
+STORAGE_CONFIG = {
+    'BACKEND': os.getenv('STORAGE_BACKEND', 'json'),
+    'PATH': os.getenv('STORAGE_PATH', os.path.join(os.path.dirname(__file__), 'data', 'storage.sqlite3')),
+    # json backend: seconds between write-behind flushes (0 writes on every change)
+    'FLUSH_INTERVAL': float(os.getenv('STORAGE_FLUSH_INTERVAL', '1.0')),
+    'MAX_OWNERS': int(os.getenv('STORAGE_MAX_OWNERS', '1000')),  # owner files kept in memory
+}
+
+# /api/search: per-owner in-memory index over starred items and saved prompts (see search.py)
+SEARCH_CONFIG = {
+    'MAX_OWNERS': int(os.getenv('SEARCH_MAX_OWNERS', '1000')),  # owners whose index is kept in memory
+    'REBUILD_AFTER': int(os.getenv('SEARCH_REBUILD_AFTER', '300')),  # seconds before an index is rebuilt from storage
+}
+
+# /api/prompts/suggest: per-owner prompt autocomplete index (see autocomplete.py)
+AUTOCOMPLETE_CONFIG = {
+    'MAX_OWNERS': int(os.getenv('AUTOCOMPLETE_MAX_OWNERS', '1000')),  # owners whose index is kept in memory
+    'REBUILD_AFTER': int(os.getenv('AUTOCOMPLETE_REBUILD_AFTER', '300')),  # seconds before an index is rebuilt from storage
+    'RECENCY_HALF_LIFE': float(os.getenv('AUTOCOMPLETE_RECENCY_HALF_LIFE', '30')),  # days after which a prompt's recency bonus halves
 }
@@ -0,0 +1,203 @@
+"""On-disk, content-addressed cache for deterministic generations.
+
+A generation with a fixed seed always yields the same media for the same
+normalized parameters, so the raw upstream body is stored under a hash of
+those parameters and replayed instead of paying for the generation again.
+Entries are evicted least-recently-used first once the cache exceeds its byte
+budget.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(normalized):
+    """Hash a normalized request description (any JSON-serializable value)."""
+    raw = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class CachedResponse:
+    """Read-only stand-in for a successful upstream response replayed from the cache.
+    Provides the parts of requests.Response that the generation code uses.
+    """
+
+    status_code = 200
+
+    def __init__(self, fileobj, content_type):
+        self._file = fileobj
+        self.headers = {'content-type': content_type}
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self._file.read()
+        return self._content
+
+    @property
+    def text(self):
+        return ''
+
+    def iter_content(self, chunk_size=65536):
+        while True:
+            chunk = self._file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._file.close()
+
+
+class GenerationCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first; loaded from disk on first use
+        self._index = None
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key[:2], key)
+        return base, f"{base}.json"
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for fname in files:
+                    if '.' in fname:
+                        continue  # metadata sidecars and in-progress writes
+                    path = os.path.join(root, fname)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    # recency lives on the sidecar (see get())
+                    try:
+                        used = os.stat(f"{path}.json").st_mtime
+                    except OSError:
+                        used = stat.st_mtime
+                    entries.append((used, fname, stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._total_bytes = sum(self._index.values())
+
+    def get(self, key):
+        """Return a CachedResponse for `key`, or None on a miss."""
+        if not self.enabled:
+            return None
+        data_path, meta_path = self._paths(key)
+        with self._lock:
+            self._load_index()
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                # open while holding the lock so a concurrent eviction cannot remove it first
+                fileobj = open(data_path, 'rb')
+            except (OSError, ValueError):
+                self.misses += 1
+                self._forget(key)
+                return None
+            try:
+                # keeps LRU order across restarts; the sidecar is touched rather than the data
+                # file, which may be hard-linked to a served video whose mtime drives its expiry
+                os.utime(meta_path)
+            except OSError:
+                pass
+            if key in self._index:
+                self._index.move_to_end(key)
+            self.hits += 1
+        return CachedResponse(fileobj, meta.get('content_type') or 'application/octet-stream')
+
+    def put_bytes(self, key, data, content_type):
+        def _write(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        self._put(key, _write, content_type)
+
+    def put_file(self, key, source_path, content_type):
+        def _write(tmp_path):
+            try:
+                os.link(source_path, tmp_path)
+            except OSError:
+                shutil.copyfile(source_path, tmp_path)
+        self._put(key, _write, content_type)
+
+    def _put(self, key, write, content_type):
+        if not self.enabled:
+            return
+        data_path, meta_path = self._paths(key)
+        tmp_path = f"{data_path}.{uuid.uuid4().hex}.part"
+        try:
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            write(tmp_path)
+            size = os.path.getsize(tmp_path)
+            if size > self.max_bytes:
+                os.remove(tmp_path)
+                return
+            with open(f"{meta_path}.part", 'w', encoding='utf-8') as f:
+                json.dump({'content_type': content_type}, f)
+            with self._lock:
+                self._load_index()
+                os.replace(f"{meta_path}.part", meta_path)
+                os.replace(tmp_path, data_path)
+                self._total_bytes -= self._index.pop(key, 0)
+                self._index[key] = size
+                self._total_bytes += size
+                self.stores += 1
+                self._evict()
+        except Exception:
+            logger.exception("Failed to store generation cache entry")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _forget(self, key):
+        if self._index is not None and key in self._index:
+            self._total_bytes -= self._index.pop(key)
+
+    def _evict(self):
+        while self._index and self._total_bytes > self.max_bytes:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits / lookups) if lookups else None,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'entries': len(self._index) if self._index is not None else None,
+                'bytes': self._total_bytes if self._index is not None else None,
+                'max_bytes': self.max_bytes,
+            }
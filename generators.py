@@ -1,34 +1,130 @@
 import io
 import base64
+import math
 import os
 import uuid
 import json
 import hashlib
 import shutil
-import requests
-from flask import jsonify
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from flask import jsonify, Response
 from PIL import Image
 from urllib.parse import quote, urlparse
-from config import API_CONFIG
+from config import ADMISSION_CONFIG, API_CONFIG, MEDIA_CONFIG
+import upstream
+from generation_cache import GenerationCache, cache_key
+import admission
+import autocomplete
+import cache
+import catalog
+import jobs
+import search
+import singleflight
+import storage
+from singleflight import SingleFlight
 import re
 import time
 from requests.exceptions import Timeout, ConnectionError, RequestException
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 # module logger
 logger = logging.getLogger(__name__)
 
-# simple in-memory cache for model pricing: { model_key: (timestamp, value) }
-_PRICING_CACHE = {}
-_PRICING_CACHE_TTL = 60  # seconds
-# simple in-memory cache for models list
-_MODELS_CACHE = {}
-_MODELS_CACHE_TTL = 300  # seconds
+# upstream model lists, indexed by name and alias (see catalog.py)
+_IMAGE_CATALOG = catalog.ModelCatalog(
+    'image',
+    lambda headers: _coalesced_get(API_CONFIG.get('MODELS_API', f"{API_CONFIG['IMAGE_API']}models"), 'models', headers),
+    lambda payload: _model_list(payload),
+)
+_TEXT_CATALOG = catalog.ModelCatalog(
+    'text',
+    lambda headers: _coalesced_get(API_CONFIG.get('TEXT_MODELS_API', f"{API_CONFIG['TEXT_API']}models"), 'models', headers),
+    lambda payload: _model_list(payload),
+)
+_CHAT_CATALOG = catalog.ModelCatalog(
+    'chat',
+    lambda headers: _coalesced_get(API_CONFIG.get('CHAT_MODELS_API', 'https://gen.pollinations.ai/v1/models'), 'models', headers),
+    lambda payload: _chat_model_list(payload),
+)
 
 _STARRED_MEDIA_DIR = os.path.join(os.path.dirname(__file__), 'static', 'starred_media')
-_STARRED_META_DIR = os.path.join(os.path.dirname(__file__), 'data', 'starred')
-_PROMPTS_META_DIR = os.path.join(os.path.dirname(__file__), 'data', 'prompts')
+_GENERATED_VIDEOS_DIR = os.path.join(os.path.dirname(__file__), 'static', 'generated_videos')
+_GENERATED_IMAGES_DIR = os.path.join(os.path.dirname(__file__), 'static', 'generated_images')
+# time of the last generated_images expiry sweep
+_LAST_BLOB_CLEANUP = 0
+# raw upstream bodies of fixed-seed generations, keyed by a hash of the normalized request
+_GENERATION_CACHE = GenerationCache(
+    MEDIA_CONFIG.get('GENERATION_CACHE_DIR'),
+    MEDIA_CONFIG.get('GENERATION_CACHE_MAX_BYTES', 0),
+)
+# starred media and saved prompts (see storage.py)
+_STORAGE = storage.create_storage()
+# /api/search index, kept current by the star, unstar and prompt views
+_SEARCH = search.SearchIndex(lambda owner_id: (_STORAGE.list_starred(owner_id), _STORAGE.list_prompts(owner_id)))
+# /api/prompts/suggest index, updated by the same views
+_COMPLETER = autocomplete.PromptCompleter(
+    lambda owner_id: (_STORAGE.list_starred(owner_id), _STORAGE.list_prompts(owner_id))
+)
+# worker pool shared by every /generate/batch request; created on first use
+_BATCH_EXECUTOR = None
+_BATCH_EXECUTOR_LOCK = threading.Lock()
+# small pool for fetching model catalogs side by side; created on first use
+_CATALOG_EXECUTOR = None
+# background generation jobs (see jobs.py); the runner is bound below
+_JOBS = jobs.JobQueue(
+    MEDIA_CONFIG.get('JOBS_DIR'),
+    lambda spec, token, host_url: _run_job(spec, token, host_url),
+    workers=MEDIA_CONFIG.get('JOB_WORKERS', 2),
+    max_pending_per_owner=MEDIA_CONFIG.get('JOB_MAX_PENDING', 5),
+    retention_seconds=MEDIA_CONFIG.get('JOB_RETENTION', 86400),
+)
+# concurrent identical upstream requests share one call (see singleflight.py)
+GENERATION_FLIGHTS = SingleFlight('generate')
+ENHANCE_FLIGHTS = SingleFlight('enhance_prompt')
+_CATALOG_FLIGHTS = SingleFlight('models')
+_VALIDATION_FLIGHTS = SingleFlight('validate_key')
+# /api/validate_key outcomes by hashed owner id; the raw key is never stored
+_KEY_VALIDATIONS = cache.TTLCache(
+    'key_validation',
+    ttl=(API_CONFIG.get('KEY_VALIDATION') or {}).get('TTL', 300),
+    max_entries=10000,
+)
+# /api/check_balance answers by hashed owner id, reused for a few seconds
+_BALANCES = cache.TTLCache('balance', ttl=API_CONFIG.get('BALANCE_CACHE_TTL', 5), max_entries=10000)
+_BALANCE_FLIGHTS = SingleFlight('balance')
+# per-owner invalidation counters; a balance fetched under an older count is never cached
+_BALANCE_EPOCHS = {}
+_BALANCE_EPOCHS_LOCK = threading.Lock()
+
+# server-side image conversions offered by /generate (output_format -> mime)
+_IMAGE_OUTPUT_FORMATS = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+# upstream image types browsers display directly, forwarded as-is in 'original' mode
+_PASSTHROUGH_IMAGE_MIMES = {'image/png', 'image/jpeg', 'image/webp', 'image/gif', 'image/avif'}
+_IMAGE_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/webp': 'webp',
+    'image/gif': 'gif',
+    'image/avif': 'avif',
+}
+
+_LENGTH_CUTOFF_MESSAGE = (
+    "Response was cut off due to length. "
+    "Increase Response length and try again."
+)
+
+
+def _token_from_auth(auth):
+    if not auth:
+        return None
+    token = auth.strip()
+    if token.lower().startswith('bearer '):
+        token = token[7:].strip()
+    return token or None
 
 
 def _get_request_token(request_obj):
@@ -36,12 +132,7 @@ def _get_request_token(request_obj):
         auth = request_obj.headers.get('Authorization')
     except Exception:
         auth = None
-    if not auth:
-        return None
-    token = auth.strip()
-    if token.lower().startswith('bearer '):
-        token = token[7:].strip()
-    return token or None
+    return _token_from_auth(auth)
 
 
 def _owner_id_from_token(token):
@@ -49,29 +140,45 @@ def _owner_id_from_token(token):
     return digest[:16]
 
 
-def _owner_meta_path(owner_id):
-    return os.path.join(_STARRED_META_DIR, f"{owner_id}.json")
+def owner_key(request_obj):
+    """Who a request is accounted to: the hashed API key, else the client address."""
+    token = _get_request_token(request_obj)
+    if token:
+        return _owner_id_from_token(token)
+    return f"anon:{getattr(request_obj, 'remote_addr', None) or 'unknown'}"
 
 
-def _load_starred_items(owner_id):
-    try:
-        path = _owner_meta_path(owner_id)
-        if not os.path.exists(path):
-            return []
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data if isinstance(data, list) else []
-    except Exception:
-        return []
+def flush_storage():
+    """Write out pending storage changes; called on server shutdown."""
+    return _STORAGE.flush()
 
 
-def _save_starred_items(owner_id, items):
-    os.makedirs(_STARRED_META_DIR, exist_ok=True)
-    path = _owner_meta_path(owner_id)
-    tmp_path = f"{path}.tmp"
-    with open(tmp_path, 'w', encoding='utf-8') as f:
-        json.dump(items, f, ensure_ascii=True, indent=2)
-    os.replace(tmp_path, path)
+def invalidate_balance(token):
+    """Forget the cached balance of `token`'s owner once a request has spent pollen."""
+    if token:
+        owner_id = _owner_id_from_token(token)
+        with _BALANCE_EPOCHS_LOCK:
+            _BALANCE_EPOCHS[owner_id] = _BALANCE_EPOCHS.get(owner_id, 0) + 1
+        _BALANCES.delete(owner_id)
+
+
+def _balance_epoch(owner_id):
+    """How many times `owner_id`'s balance has been invalidated in this process."""
+    with _BALANCE_EPOCHS_LOCK:
+        return _BALANCE_EPOCHS.get(owner_id, 0)
+
+
+def _auth_owner(auth):
+    """Hashed owner id for an Authorization header value, or None without a key."""
+    token = _token_from_auth(auth)
+    return _owner_id_from_token(token) if token else None
+
+
+def _coalesced_get(url, endpoint, headers):
+    """GET a catalog URL; concurrent identical fetches (same URL, API key and If-None-Match) share one upstream request."""
+    key = (url, _auth_owner(headers.get('Authorization')), headers.get('If-None-Match'))
+    response, _ = _CATALOG_FLIGHTS.do(key, lambda: upstream.get(url, endpoint=endpoint, headers=headers))
+    return response
 
 
 def _strip_internal_fields(item):
@@ -82,164 +189,409 @@ def _strip_internal_fields(item):
     return cleaned
 
 
+class RequestContext:
+    """Minimal stand-in for a Flask request used by the shared endpoint helpers.
+    Carries the incoming headers and host so the same code can run from the
+    async entry point (asgi.py) or from worker threads outside a request.
+    """
+
+    def __init__(self, headers=None, host=None, host_url=None):
+        self.headers = headers if headers is not None else {}
+        self.host = host or ''
+        self.host_url = host_url or (f"http://{host}/" if host else '')
+
+    @classmethod
+    def from_request(cls, request_obj):
+        headers = {}
+        for name in ('Authorization', 'X-Cache-Bypass', 'Cache-Control'):
+            try:
+                value = request_obj.headers.get(name)
+            except Exception:
+                value = None
+            if value:
+                headers[name] = value
+        return cls(headers=headers, host=request_obj.host, host_url=request_obj.host_url)
+
+
+class ApiError(Exception):
+    """Carries a ready-made JSON error body (and HTTP status) out of a shared helper."""
+
+    def __init__(self, body, status=200):
+        super().__init__(body.get('error') if isinstance(body, dict) else str(body))
+        self.body = body
+        self.status = status
+
+
+def upstream_unavailable_error(exc, service):
+    """JSON error body for a call that upstream.py refused to make (see UpstreamUnavailable)."""
+    retry_after = int(math.ceil(exc.retry_after or 1))
+    return {
+        "success": False,
+        "error": f"The {service} is temporarily unavailable. Please try again in {retry_after} seconds.",
+        "retry_after": retry_after,
+    }
+
+
+def request_error_status(exc):
+    return 503 if isinstance(exc, upstream.UpstreamUnavailable) else 200
+
+
+def retry_after_headers(body):
+    """Retry-After header for an error body that carries `retry_after`."""
+    retry_after = body.get('retry_after') if isinstance(body, dict) else None
+    return {'Retry-After': str(retry_after)} if retry_after else {}
+
+
+def _extract_text_from_content(content):
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        blocks = []
+        for block in content:
+            if isinstance(block, dict):
+                if block.get('type') == 'text' and block.get('text'):
+                    blocks.append(block['text'])
+                elif isinstance(block.get('text'), str):
+                    blocks.append(block['text'])
+            elif isinstance(block, str):
+                blocks.append(block)
+        return '\n'.join(blocks) if blocks else None
+    return None
+
+
+def _extract_text_from_choice(choice):
+    if not isinstance(choice, dict):
+        return None
+    msg = choice.get('message')
+    if isinstance(msg, dict):
+        text = _extract_text_from_content(msg.get('content'))
+        if text:
+            return text
+        if isinstance(msg.get('content_blocks'), list):
+            text = _extract_text_from_content(msg.get('content_blocks'))
+            if text:
+                return text
+    delta = choice.get('delta')
+    if isinstance(delta, dict):
+        text = _extract_text_from_content(delta.get('content'))
+        if text:
+            return text
+        if isinstance(delta.get('content_blocks'), list):
+            text = _extract_text_from_content(delta.get('content_blocks'))
+            if text:
+                return text
+    if isinstance(choice.get('text'), str):
+        return choice.get('text')
+    return None
+
+
+def prepare_chat_request(data, request_obj):
+    """Validate chat JSON and build the upstream call.
+    Returns { url, headers, payload, model } or raises ApiError.
+    """
+    # Accept either a single `message`/`prompt` or a `messages` array (chat style).
+    message = data.get('message') or data.get('prompt') or ''
+    messages = data.get('messages')
+    has_messages = isinstance(messages, list) and len(messages) > 0
+    if not message and not has_messages:
+        raise ApiError({"success": False, "error": "No message provided"})
+
+    model = data.get('model') or 'openai'
+    temperature = data.get('temperature')
+    max_tokens = data.get('max_tokens')
+
+    url = API_CONFIG['CHAT_COMPLETIONS_API']
+    headers = {'Content-Type': 'application/json'}
+    # prefer an API key supplied by the browser (localStorage) forwarded in the Authorization header
+    incoming_auth = None
+    try:
+        incoming_auth = request_obj.headers.get('Authorization')
+    except Exception:
+        incoming_auth = None
+    if incoming_auth:
+        headers['Authorization'] = incoming_auth
+
+    if not has_messages:
+        messages = [{'role': 'user', 'content': message}]
+
+    payload = {
+        'messages': messages,
+    }
+    if model:
+        payload['model'] = model
+    if temperature is not None:
+        payload['temperature'] = temperature
+    if max_tokens is not None:
+        payload['max_tokens'] = max_tokens
+    # `stream: true` asks upstream for incremental deltas, relayed to the browser as SSE
+    stream = data.get('stream') is True
+    if stream:
+        payload['stream'] = True
+
+    return {'url': url, 'headers': headers, 'payload': payload, 'model': model, 'stream': stream}
+
+
+def chat_request_error(exc):
+    """Map a transport exception from the chat upstream call to a JSON error body."""
+    if isinstance(exc, upstream.UpstreamUnavailable):
+        return upstream_unavailable_error(exc, 'chat service')
+    if isinstance(exc, Timeout):
+        return {"success": False, "error": "The chat service timed out. Please try again."}
+    if isinstance(exc, ConnectionError):
+        return {"success": False, "error": "Failed to connect to chat service."}
+    return {"success": False, "error": f"Error communicating with chat service: {str(exc)}"}
+
+
+def finish_chat_response(resp, model, request_obj):
+    """Turn the upstream chat completion response into (body, status)."""
+    invalidate_balance(_get_request_token(request_obj))
+    if resp.status_code != 200:
+        # surface 403 messages clearly and return 403 status
+        if resp.status_code == 403:
+            msg = _parse_api_error(resp)
+            return {"success": False, "error": f"API Error 403: {msg}"}, 403
+        # handle payment required (402) to display helpful message
+        if resp.status_code == 402:
+            msg = _parse_api_error(resp)
+            return {"success": False, "error": f"API Error 402: {msg}"}, 402
+        return {"success": False, "error": f"Chat service returned status {resp.status_code}"}, resp.status_code
+
+    # attempt to parse JSON reply; otherwise use text
+    reply_text = None
+    finish_reason = None
+    try:
+        j = resp.json()
+        # common shapes: { reply: "..." } or { choices: [...] }
+        if isinstance(j, dict):
+            if 'reply' in j:
+                reply_text = j['reply']
+            elif 'choices' in j and isinstance(j['choices'], list) and j['choices']:
+                # could be chat completion style
+                c = j['choices'][0]
+                if isinstance(c, dict):
+                    finish_reason = c.get('finish_reason')
+                extracted = _extract_text_from_choice(c)
+                reply_text = extracted if extracted is not None else str(c)
+            else:
+                # fallback to full JSON string
+                reply_text = j.get('text') or str(j)
+        else:
+            reply_text = str(j)
+    except Exception:
+        reply_text = resp.text or ''
+
+    if not reply_text and finish_reason == 'length':
+        reply_text = _LENGTH_CUTOFF_MESSAGE
+
+    # Include pricing info for the chosen model (best-effort)
+    pricing = get_text_model_pricing(model, request_obj)
+    if isinstance(pricing, dict) and pricing.get('__api_forbidden'):
+        return {"success": False, "error": f"API Error 403: {pricing.get('message')}"}, 403
+
+    return {
+        "success": True,
+        "reply": reply_text,
+        "pricing": pricing,
+        "finish_reason": finish_reason,
+    }, 200
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Events frame carrying a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def is_event_stream(resp):
+    content_type = (resp.headers.get('content-type') or '').lower()
+    return content_type.startswith('text/event-stream')
+
+
+def parse_chat_stream_line(line):
+    """Parse one line of an upstream chat completion stream.
+    Returns (text, finish_reason, done) for `data:` lines and None for anything else.
+    """
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    line = (line or '').strip()
+    if not line.startswith('data:'):
+        return None
+    raw = line[5:].strip()
+    if raw == '[DONE]':
+        return None, None, True
+    try:
+        chunk = json.loads(raw)
+    except ValueError:
+        return None
+    text = None
+    finish_reason = None
+    if isinstance(chunk, dict) and isinstance(chunk.get('choices'), list) and chunk['choices']:
+        choice = chunk['choices'][0]
+        if isinstance(choice, dict):
+            finish_reason = choice.get('finish_reason')
+        text = _extract_text_from_choice(choice)
+    return text, finish_reason, False
+
+
+def chat_stream_closing_events(reply_text, finish_reason, model, request_obj):
+    """SSE frames sent after the last delta: finish_reason and pricing, or an error."""
+    invalidate_balance(_get_request_token(request_obj))
+    events = []
+    if not reply_text and finish_reason == 'length':
+        events.append(sse_event('delta', {'text': _LENGTH_CUTOFF_MESSAGE}))
+    pricing = get_text_model_pricing(model, request_obj)
+    if isinstance(pricing, dict) and pricing.get('__api_forbidden'):
+        events.append(sse_event('error', {"success": False, "error": f"API Error 403: {pricing.get('message')}"}))
+        return events
+    events.append(sse_event('done', {"success": True, "finish_reason": finish_reason, "pricing": pricing}))
+    return events
+
+
+def chat_fallback_events(resp, model, request_obj):
+    """SSE frames for an upstream that answered a stream request with one JSON body."""
+    body, _ = finish_chat_response(resp, model, request_obj)
+    if not body.get('success'):
+        return [sse_event('error', body)]
+    return [
+        sse_event('delta', {'text': body.get('reply') or ''}),
+        sse_event('done', {"success": True, "finish_reason": body.get('finish_reason'), "pricing": body.get('pricing')}),
+    ]
+
+
+def _chat_stream(resp, model, request_obj):
+    reply_parts = []
+    finish_reason = None
+    try:
+        if not is_event_stream(resp):
+            for event in chat_fallback_events(resp, model, request_obj):
+                yield event
+            return
+        # SSE is UTF-8 by definition; requests would otherwise guess from headers
+        resp.encoding = 'utf-8'
+        for line in resp.iter_lines(decode_unicode=True):
+            parsed = parse_chat_stream_line(line)
+            if parsed is None:
+                continue
+            text, reason, done = parsed
+            if reason:
+                finish_reason = reason
+            if text:
+                reply_parts.append(text)
+                yield sse_event('delta', {'text': text})
+            if done:
+                break
+    except RequestException as e:
+        yield sse_event('error', chat_request_error(e))
+        return
+    finally:
+        resp.close()
+    for event in chat_stream_closing_events(''.join(reply_parts), finish_reason, model, request_obj):
+        yield event
+
+
 def chat_api(request):
-    """Simple proxy for text/chat interactions. Accepts JSON { message, model, temperature, max_tokens }.
+    """Simple proxy for text/chat interactions. Accepts JSON { message, model, temperature, max_tokens, stream }.
     Sends a POST request to the configured chat completions endpoint with messages.
     Returns JSON: { success: True, reply: "..." } or { success: False, error: "..." }.
+    With `stream: true` it returns text/event-stream instead: `delta` events ({ text }) as tokens
+    arrive, then a `done` event ({ finish_reason, pricing }) or an `error` event.
     """
     try:
         if not request.is_json:
             return jsonify({"success": False, "error": "Request must be JSON"})
         data = request.get_json(silent=True) or {}
-        # Accept either a single `message`/`prompt` or a `messages` array (chat style).
-        message = data.get('message') or data.get('prompt') or ''
-        messages = data.get('messages')
-        has_messages = isinstance(messages, list) and len(messages) > 0
-        if not message and not has_messages:
-            return jsonify({"success": False, "error": "No message provided"})
+        call = prepare_chat_request(data, request)
 
-        model = data.get('model') or 'openai'
-        temperature = data.get('temperature')
-        max_tokens = data.get('max_tokens')
-
-        url = API_CONFIG['CHAT_COMPLETIONS_API']
-        headers = {'Content-Type': 'application/json'}
-        # prefer an API key supplied by the browser (localStorage) forwarded in the Authorization header
-        incoming_auth = None
         try:
-            incoming_auth = request.headers.get('Authorization')
-        except Exception:
-            incoming_auth = None
-        if incoming_auth:
-            headers['Authorization'] = incoming_auth
+            logger.debug("Chat request_url: %s", call['url'])
+            resp = upstream.post(
+                call['url'],
+                endpoint='chat',
+                headers=call['headers'],
+                json=call['payload'],
+                stream=call['stream'],
+            )
+        except RequestException as e:
+            body = chat_request_error(e)
+            return jsonify(body), request_error_status(e), retry_after_headers(body)
+
+        if call['stream'] and resp.status_code == 200:
+            # the generator outlives the request context, so hand it a detached copy
+            context = RequestContext.from_request(request)
+            return Response(
+                _chat_stream(resp, call['model'], context),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+            )
 
-        messages = data.get('messages')
-        if not isinstance(messages, list) or not messages:
-            messages = [{'role': 'user', 'content': message}]
+        body, status = finish_chat_response(resp, call['model'], request)
+        return jsonify(body), status, retry_after_headers(body)
+    except ApiError as e:
+        return jsonify(e.body), e.status
+    except Exception as e:
+        return jsonify({"success": False, "error": f"Unexpected error: {str(e)}"})
 
-        payload = {
-            'messages': messages,
-        }
-        if model:
-            payload['model'] = model
-        if temperature is not None:
-            payload['temperature'] = temperature
-        if max_tokens is not None:
-            payload['max_tokens'] = max_tokens
 
-        try:
-            logger.debug("Chat request_url: %s", url)
-            resp = requests.post(url, headers=headers, json=payload, timeout=API_CONFIG.get('TIMEOUT', 30))
-        except Timeout:
-            return jsonify({"success": False, "error": "The chat service timed out. Please try again."})
-        except ConnectionError as e:
-            return jsonify({"success": False, "error": "Failed to connect to chat service."})
-        except RequestException as e:
-            return jsonify({"success": False, "error": f"Error communicating with chat service: {str(e)}"})
-
-        if resp.status_code != 200:
-            # surface 403 messages clearly and return 403 status
-            if resp.status_code == 403:
-                msg = _parse_api_error(resp)
-                return jsonify({"success": False, "error": f"API Error 403: {msg}"}), 403
-            # handle payment required (402) to display helpful message
-            if resp.status_code == 402:
-                msg = _parse_api_error(resp)
-                return jsonify({"success": False, "error": f"API Error 402: {msg}"}), 402
-            return jsonify({"success": False, "error": f"Chat service returned status {resp.status_code}"}), resp.status_code
-
-        def _extract_text_from_content(content):
-            if isinstance(content, str):
-                return content
-            if isinstance(content, list):
-                blocks = []
-                for block in content:
-                    if isinstance(block, dict):
-                        if block.get('type') == 'text' and block.get('text'):
-                            blocks.append(block['text'])
-                        elif isinstance(block.get('text'), str):
-                            blocks.append(block['text'])
-                    elif isinstance(block, str):
-                        blocks.append(block)
-                return '\n'.join(blocks) if blocks else None
-            return None
+def _probe_key_with_models(headers):
+    """(body, status) from downloading the image models list with the caller's key."""
+    models_url = API_CONFIG.get('MODELS_API', f"{API_CONFIG['IMAGE_API']}models")
+    r = upstream.get(models_url, endpoint='validate', headers=headers)
+    if r.status_code == 200:
+        return {"success": True, "message": "Key valid (models fetched)"}, 200
+    if r.status_code == 403:
+        return {"success": False, "error": _parse_api_error(r)}, 403
+    return {"success": False, "error": f"Validation failed: status {r.status_code}"}, r.status_code
 
-        def _extract_text_from_choice(choice):
-            if not isinstance(choice, dict):
-                return None
-            msg = choice.get('message')
-            if isinstance(msg, dict):
-                text = _extract_text_from_content(msg.get('content'))
-                if text:
-                    return text
-                if isinstance(msg.get('content_blocks'), list):
-                    text = _extract_text_from_content(msg.get('content_blocks'))
-                    if text:
-                        return text
-            delta = choice.get('delta')
-            if isinstance(delta, dict):
-                text = _extract_text_from_content(delta.get('content'))
-                if text:
-                    return text
-                if isinstance(delta.get('content_blocks'), list):
-                    text = _extract_text_from_content(delta.get('content_blocks'))
-                    if text:
-                        return text
-            if isinstance(choice.get('text'), str):
-                return choice.get('text')
-            return None
 
-        # attempt to parse JSON reply; otherwise use text
-        reply_text = None
-        finish_reason = None
-        try:
-            j = resp.json()
-            # common shapes: { reply: "..." } or { choices: [...] }
-            if isinstance(j, dict):
-                if 'reply' in j:
-                    reply_text = j['reply']
-                elif 'choices' in j and isinstance(j['choices'], list) and j['choices']:
-                    # could be chat completion style
-                    c = j['choices'][0]
-                    if isinstance(c, dict):
-                        finish_reason = c.get('finish_reason')
-                    extracted = _extract_text_from_choice(c)
-                    reply_text = extracted if extracted is not None else str(c)
-                else:
-                    # fallback to full JSON string
-                    reply_text = j.get('text') or str(j)
-            else:
-                reply_text = str(j)
-        except Exception:
-            reply_text = resp.text or ''
+def _probe_key(headers):
+    """(body, status) for the key in `headers`, asking the balance endpoint first: its answer
+    is a few bytes instead of the whole models list. Answers other than 200/401 fall back to
+    the models probe, which tells "forbidden" apart from "invalid".
+    """
+    if (API_CONFIG.get('KEY_VALIDATION') or {}).get('PROBE', 'balance') == 'balance':
+        r = upstream.get(API_CONFIG['BALANCE_API'], endpoint='validate', headers=headers)
+        if r.status_code == 200:
+            return {"success": True, "message": "Key valid"}, 200
+        if r.status_code == 401:
+            return {"success": False, "error": f"Unauthorized: {_parse_api_error(r)}"}, 401
+    return _probe_key_with_models(headers)
 
-        if not reply_text and finish_reason == 'length':
-            reply_text = (
-                "Response was cut off due to length. "
-                "Increase Response length and try again."
-            )
 
-        # Include pricing info for the chosen model (best-effort)
-        pricing = get_text_model_pricing(model, request)
-        if isinstance(pricing, dict) and pricing.get('__api_forbidden'):
-            return jsonify({"success": False, "error": f"API Error 403: {pricing.get('message')}"}), 403
+def _validation_for_owner(owner_id, headers):
+    """Cached (body, status) for a hashed owner id; concurrent misses share one probe.
+    Valid keys are kept for TTL and rejected ones (401/403) for NEGATIVE_TTL, in this
+    process and in the host-wide cache backend. Other outcomes are not cached.
+    """
+    cached = _KEY_VALIDATIONS.get(owner_id)
+    if cached is not None:
+        return cached['body'], cached['status']
+
+    def _load():
+        shared_key = f"key_validation:{owner_id}"
+        result = cache.backend().get(shared_key)
+        if result is None:
+            body, status = _probe_key(headers)
+            settings = API_CONFIG.get('KEY_VALIDATION') or {}
+            if status == 200:
+                ttl = settings.get('TTL', 300)
+            elif status in (401, 403):
+                ttl = settings.get('NEGATIVE_TTL', 30)
+            else:
+                return {'body': body, 'status': status}
+            result = {'body': body, 'status': status, 'expires_at': time.time() + ttl}
+            cache.backend().set(shared_key, result, ttl)
+        _KEY_VALIDATIONS.set(owner_id, result, ttl=result['expires_at'] - time.time())
+        return result
 
-        return jsonify({
-            "success": True,
-            "reply": reply_text,
-            "pricing": pricing,
-            "finish_reason": finish_reason,
-        })
-    except Exception as e:
-        return jsonify({"success": False, "error": f"Unexpected error: {str(e)}"})
+    result, _ = _VALIDATION_FLIGHTS.do(owner_id, _load)
+    return result['body'], result['status']
 
 
 def validate_api_key(request):
-    """Validate an API key by calling the models endpoint with provided Authorization header.
-    Expects an Authorization header to be forwarded by the client. Returns 200/403 with parsed message.
+    """Validate the API key in the forwarded Authorization header.
+    Results are cached per hashed key (see _validation_for_owner). Returns 200, or
+    401/403 with the parsed upstream message.
     """
     try:
-        models_url = API_CONFIG.get('MODELS_API', f"{API_CONFIG['IMAGE_API']}models")
         headers = {}
         try:
             incoming_auth = request.headers.get('Authorization')
@@ -248,24 +600,44 @@ def validate_api_key(request):
         if incoming_auth:
             headers['Authorization'] = incoming_auth
 
-        r = requests.get(models_url, headers=headers, timeout=10)
-        if r.status_code == 200:
-            return jsonify({"success": True, "message": "Key valid (models fetched)"})
-        elif r.status_code == 403:
-            msg = _parse_api_error(r)
-            return jsonify({"success": False, "error": msg}), 403
+        token = _token_from_auth(incoming_auth)
+        if token:
+            body, status = _validation_for_owner(_owner_id_from_token(token), headers)
         else:
-            return jsonify({"success": False, "error": f"Validation failed: status {r.status_code}"}), r.status_code
+            body, status = _probe_key_with_models(headers)
+        if status == 200:
+            return jsonify(body)
+        return jsonify(body), status
+    except upstream.UpstreamUnavailable as e:
+        body = upstream_unavailable_error(e, 'validation service')
+        return jsonify(body), 503, retry_after_headers(body)
     except Exception as e:
         return jsonify({"success": False, "error": f"Validation error: {str(e)}"})
 
 
+def _fetch_balance(balance_url, headers, owner_id, epoch=0):
+    """Ask upstream for the balance; returns (response, cache entry or None).
+    The entry is only cached if `owner_id` was not invalidated while the request was out.
+    """
+    r = upstream.get(balance_url, endpoint='balance', headers=headers)
+    logger.debug("[CHECK_BALANCE] Pollinations API response: %s", r.status_code)
+    if r.status_code != 200:
+        logger.debug("[CHECK_BALANCE] Response text: %s", (r.text or '')[:200])
+        return r, None
+    entry = {'balance': r.json(), 'fetched_at': time.time()}
+    if owner_id and _balance_epoch(owner_id) == epoch:
+        _BALANCES.set(owner_id, entry)
+    return r, entry
+
+
 def check_balance_api(request):
     """Check user's pollen balance using the /account/balance endpoint.
-    Requires Authorization header with Bearer token.
+    Requires Authorization header with Bearer token. Balances are reused per key for
+    BALANCE_CACHE_TTL seconds (dropped once the key spends pollen here) and concurrent
+    checks share one upstream request; `cached` and `age` say how fresh the answer is.
     """
     try:
-        balance_url = "https://gen.pollinations.ai/account/balance"
+        balance_url = API_CONFIG['BALANCE_API']
         headers = {}
         try:
             incoming_auth = request.headers.get('Authorization')
@@ -287,14 +659,26 @@ def check_balance_api(request):
         else:
             return jsonify({"success": False, "error": "No API key provided"}), 401
 
-        r = requests.get(balance_url, headers=headers, timeout=10)
-        logger.debug("[CHECK_BALANCE] Pollinations API response: %s", r.status_code)
-        if r.status_code != 200:
-            logger.debug("[CHECK_BALANCE] Response text: %s", (r.text or '')[:200])
-        
-        if r.status_code == 200:
-            data = r.json()
-            return jsonify({"success": True, "balance": data})
+        token = _token_from_auth(incoming_auth)
+        owner_id = _owner_id_from_token(token) if token else None
+        entry = _BALANCES.get(owner_id) if owner_id else None
+        cached = entry is not None
+        if entry is None:
+            if owner_id:
+                # the epoch is part of the key so checks after a spend don't join an older fetch
+                epoch = _balance_epoch(owner_id)
+                (r, entry), _ = _BALANCE_FLIGHTS.do(
+                    (owner_id, epoch), lambda: _fetch_balance(balance_url, headers, owner_id, epoch))
+            else:
+                r, entry = _fetch_balance(balance_url, headers, owner_id)
+
+        if entry is not None:
+            return jsonify({
+                "success": True,
+                "balance": entry['balance'],
+                "cached": cached,
+                "age": round(time.time() - entry['fetched_at'], 1),
+            })
         elif r.status_code == 401:
             msg = _parse_api_error(r)
             return jsonify({"success": False, "error": f"Unauthorized: {msg}"}), 401
@@ -303,291 +687,256 @@ def check_balance_api(request):
             return jsonify({"success": False, "error": msg}), 403
         else:
             return jsonify({"success": False, "error": f"Balance check failed: status {r.status_code}"}), r.status_code
+    except upstream.UpstreamUnavailable as e:
+        body = upstream_unavailable_error(e, 'balance service')
+        return jsonify(body), 503, retry_after_headers(body)
     except Exception as e:
         logger.exception("[CHECK_BALANCE] Exception checking balance")
         return jsonify({"success": False, "error": f"Balance check error: {str(e)}"})
 
 
 
+def _model_list(payload):
+    return payload if isinstance(payload, list) else []
+
+
+def _chat_model_list(payload):
+    """Model dicts from an OpenAI-style { data: [ { id } ] } payload (or a raw list of ids)."""
+    if isinstance(payload, dict) and isinstance(payload.get('data'), list):
+        return [item for item in payload['data'] if isinstance(item, dict) and item.get('id')]
+    if isinstance(payload, list):
+        return [item if isinstance(item, dict) else {'id': item} for item in payload if item]
+    return []
+
+
+def _catalog_headers(request_obj):
+    """Headers for a catalog fetch: the caller's Authorization, so BYOP keys are forwarded."""
+    incoming_auth = None
+    try:
+        if request_obj is not None:
+            incoming_auth = request_obj.headers.get('Authorization')
+    except Exception:
+        incoming_auth = None
+    return {'Authorization': incoming_auth} if incoming_auth else {}
+
+
 def get_model_pricing(model_name, request_obj=None):
-    """Fetch model pricing from the API (best-effort). Returns pricing dict or None.
-    If `request_obj` is provided, prefer an Authorization header from it (so user's API key can be forwarded).
+    """Look up image model pricing in the image model catalog (best-effort). Returns pricing dict or None.
+    If `request_obj` is provided, its Authorization header is forwarded when the catalog has to be fetched.
     """
     try:
-        models_url = API_CONFIG.get('MODELS_API', f"{API_CONFIG['IMAGE_API']}models")
-        h = {}
-        # prefer an Authorization header supplied in the incoming request (client-side API key)
-        incoming_auth = None
-        try:
-            if request_obj is not None:
-                incoming_auth = request_obj.headers.get('Authorization')
-        except Exception:
-            incoming_auth = None
-        if incoming_auth:
-            h['Authorization'] = incoming_auth
-        # use a cached value when available
-        cache_key = f"models::{model_name}"
-        now = time.time()
-        cached = _PRICING_CACHE.get(cache_key)
-        if cached and (now - cached[0]) < _PRICING_CACHE_TTL:
-            return cached[1]
-
-        r = requests.get(models_url, headers=h, timeout=10)
-        # handle success
-        if r.status_code == 200:
-            items = r.json()
-            for it in items:
-                name = it.get('name', '')
-                aliases = it.get('aliases', []) or []
-                if model_name == name or model_name in aliases:
-                    pricing = it.get('pricing')
-                    _PRICING_CACHE[cache_key] = (now, pricing)
-                    return pricing
+        item = _IMAGE_CATALOG.lookup(model_name, _catalog_headers(request_obj))
+        if item is not None:
+            pricing = item.get('pricing')
+            # callers annotate the result, so never hand out the catalog's own dict
+            return dict(pricing) if isinstance(pricing, dict) else pricing
+    except catalog.CatalogError as e:
         # handle forbidden / insufficient balance explicitly
-        if r.status_code == 403:
-            try:
-                body = r.json()
-                # try to extract helpful message
-                msg = None
-                if isinstance(body, dict):
-                    err = body.get('error') or body.get('message')
-                    if isinstance(err, dict):
-                        msg = err.get('message')
-                    elif isinstance(err, str):
-                        msg = err
-                    else:
-                        msg = str(body)
-                else:
-                    msg = str(body)
-            except Exception:
-                msg = r.text
-            return {'__api_forbidden': True, 'message': msg}
+        if e.response.status_code == 403:
+            return {'__api_forbidden': True, 'message': _parse_api_error(e.response)}
     except Exception:
         pass
     return None
 
 
 def get_text_model_pricing(model_name, request_obj=None):
-    """Fetch text model pricing from /text/models (best-effort). Returns pricing dict or None."""
+    """Look up text model pricing in the text model catalog (best-effort). Returns pricing dict or None."""
     try:
         if not model_name:
             return None
-
-        models_url = API_CONFIG.get('TEXT_MODELS_API', f"{API_CONFIG['TEXT_API']}models")
-        headers = {}
-        incoming_auth = None
-        try:
-            if request_obj is not None:
-                incoming_auth = request_obj.headers.get('Authorization')
-        except Exception:
-            incoming_auth = None
-        if incoming_auth:
-            headers['Authorization'] = incoming_auth
-
-        cache_key = f"text_models::{model_name}"
-        now = time.time()
-        cached = _PRICING_CACHE.get(cache_key)
-        if cached and (now - cached[0]) < _PRICING_CACHE_TTL:
-            return cached[1]
-
-        r = requests.get(models_url, headers=headers, timeout=10)
-        if r.status_code == 200:
-            items = r.json()
-            for it in items:
-                name = it.get('name') or it.get('id') or ''
-                aliases = it.get('aliases', []) or []
-                if model_name == name or model_name in aliases:
-                    pricing = it.get('pricing') or it.get('price')
-                    _PRICING_CACHE[cache_key] = (now, pricing)
-                    return pricing
-        if r.status_code == 403:
-            msg = _parse_api_error(r)
-            return {'__api_forbidden': True, 'message': msg}
+        item = _TEXT_CATALOG.lookup(model_name, _catalog_headers(request_obj))
+        if item is not None:
+            pricing = item.get('pricing') or item.get('price')
+            return dict(pricing) if isinstance(pricing, dict) else pricing
+    except catalog.CatalogError as e:
+        if e.response.status_code == 403:
+            return {'__api_forbidden': True, 'message': _parse_api_error(e.response)}
     except Exception:
         pass
     return None
 
 
-def get_models_api(request_obj=None):
-    """Fetch the models list from the upstream API and return a JSON response.
-    If `request_obj` is provided, prefer its Authorization header so BYOP works.
-    Caches the models list for a short TTL to avoid frequent upstream calls.
+def _conditional_json(request_obj, etag, build_body):
+    """JSON response tagged with `etag`, or an empty 304 when the browser already has that version.
+    `build_body()` is only called when the body is actually sent.
     """
-    try:
-        now = time.time()
-        cached = _MODELS_CACHE.get('models')
-        if cached and (now - cached[0]) < _MODELS_CACHE_TTL:
-            return jsonify({"success": True, "models": cached[1]})
+    if_none_match = getattr(request_obj, 'if_none_match', None)
+    if if_none_match is not None and if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build_body())
+    response.set_etag(etag)
+    # revalidate on every use; the list may depend on the caller's key
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Authorization'
+    return response
 
-        models_url = f"{API_CONFIG['IMAGE_API']}models"
-        headers = {"Content-Type": "application/json"}
-        incoming_auth = None
-        try:
-            if request_obj is not None:
-                incoming_auth = request_obj.headers.get('Authorization')
-        except Exception:
-            incoming_auth = None
-        if incoming_auth:
-            headers['Authorization'] = incoming_auth
 
-        r = requests.get(models_url, headers=headers, timeout=10)
-        if r.status_code == 200:
-            items = r.json()
-            # cache the raw list
-            _MODELS_CACHE['models'] = (now, items)
-            return jsonify({"success": True, "models": items})
-        elif r.status_code == 403:
+def get_models_api(request_obj=None):
+    """Return the image models list from the image model catalog as a JSON response.
+    If `request_obj` is provided, its Authorization header is forwarded so BYOP works.
+    Answers 304 when the caller's If-None-Match matches the current list.
+    """
+    try:
+        snapshot = _IMAGE_CATALOG.snapshot(_catalog_headers(request_obj))
+        return _conditional_json(
+            request_obj,
+            f"image-{snapshot.digest}",
+            lambda: {"success": True, "models": snapshot.items},
+        )
+    except catalog.CatalogError as e:
+        r = e.response
+        if r.status_code == 403:
             msg = _parse_api_error(r)
             return jsonify({"success": False, "error": msg}), 403
-        else:
-            return jsonify({"success": False, "error": f"Models fetch failed: status {r.status_code}"}), r.status_code
+        return jsonify({"success": False, "error": f"Models fetch failed: status {r.status_code}"}), r.status_code
+    except upstream.UpstreamUnavailable as e:
+        body = upstream_unavailable_error(e, 'model list')
+        return jsonify(body), 503, retry_after_headers(body)
     except Exception as e:
         logger.exception("Error fetching models list")
         return jsonify({"success": False, "error": f"Error fetching models: {str(e)}"})
 
 
-def get_chat_models_api(request_obj=None):
-    """Fetch the chat models list from the upstream /v1/models endpoint."""
+def _cost_indicator_from_pricing(pricing):
+    if not isinstance(pricing, dict):
+        return None
+    cost_per_1k = None
     try:
-        now = time.time()
-        cached = _MODELS_CACHE.get('chat_models')
-        if cached and (now - cached[0]) < _MODELS_CACHE_TTL:
-            cached_models = cached[1]
-            if isinstance(cached_models, list):
-                return jsonify({"success": True, "models": cached_models})
-
-        models_url = API_CONFIG.get('CHAT_MODELS_API', 'https://gen.pollinations.ai/v1/models')
-        text_models_url = API_CONFIG.get('TEXT_MODELS_API', f"{API_CONFIG['TEXT_API']}models")
-        headers = {"Content-Type": "application/json"}
-        incoming_auth = None
-        try:
-            if request_obj is not None:
-                incoming_auth = request_obj.headers.get('Authorization')
-        except Exception:
-            incoming_auth = None
-        if incoming_auth:
-            headers['Authorization'] = incoming_auth
+        if pricing.get('pollen_per_1k_tokens') is not None:
+            cost_per_1k = float(pricing.get('pollen_per_1k_tokens'))
+        elif pricing.get('pollen_per_token') is not None:
+            cost_per_1k = float(pricing.get('pollen_per_token')) * 1000.0
+    except Exception:
+        cost_per_1k = None
+    if cost_per_1k is None:
+        return None
+    if cost_per_1k <= 0.0005:
+        return '$'
+    if cost_per_1k <= 0.002:
+        return '$$'
+    if cost_per_1k <= 0.01:
+        return '$$$'
+    return '$$$$'
 
-        def _cost_indicator_from_pricing(pricing):
-            if not isinstance(pricing, dict):
-                return None
-            cost_per_1k = None
-            try:
-                if pricing.get('pollen_per_1k_tokens') is not None:
-                    cost_per_1k = float(pricing.get('pollen_per_1k_tokens'))
-                elif pricing.get('pollen_per_token') is not None:
-                    cost_per_1k = float(pricing.get('pollen_per_token')) * 1000.0
-            except Exception:
-                cost_per_1k = None
-            if cost_per_1k is None:
-                return None
-            if cost_per_1k <= 0.0005:
-                return '$'
-            if cost_per_1k <= 0.002:
-                return '$$'
-            if cost_per_1k <= 0.01:
-                return '$$$'
-            return '$$$$'
-
-        def _normalize_text_model(item):
-            if not isinstance(item, dict):
-                return None
-            model_id = item.get('name') or item.get('id') or ''
-            if not model_id:
-                return None
-            pricing = item.get('pricing') or item.get('price')
-            aliases = item.get('aliases', []) or []
-            paid_only = item.get('paid_only')
-            return {
-                "id": model_id,
-                "name": model_id,
-                "pricing": pricing,
-                "paid_only": bool(paid_only) if isinstance(paid_only, bool) else False,
-                "cost": _cost_indicator_from_pricing(pricing),
-                "aliases": aliases,
-            }
 
-        text_models_normalized = []
+def _normalize_text_model(item):
+    if not isinstance(item, dict):
+        return None
+    model_id = item.get('name') or item.get('id') or ''
+    if not model_id:
+        return None
+    pricing = item.get('pricing') or item.get('price')
+    aliases = item.get('aliases', []) or []
+    paid_only = item.get('paid_only')
+    return {
+        "id": model_id,
+        "name": model_id,
+        "pricing": pricing,
+        "paid_only": bool(paid_only) if isinstance(paid_only, bool) else False,
+        "cost": _cost_indicator_from_pricing(pricing),
+        "aliases": aliases,
+    }
+
+
+def _text_pricing_map(text_snapshot):
+    """{ name or alias: pricing } over the text catalog."""
+    pricing_map = {}
+    for item in text_snapshot.items if text_snapshot is not None else []:
+        if not isinstance(item, dict):
+            continue
+        name = item.get('name') or item.get('id') or ''
+        pricing = item.get('pricing') or item.get('price')
+        if name:
+            pricing_map[name] = pricing
+        for alias in item.get('aliases', []) or []:
+            if alias and alias not in pricing_map:
+                pricing_map[alias] = pricing
+    return pricing_map
+
+
+def _chat_models_from_catalogs(text_snapshot, chat_snapshot):
+    """The /api/chat_models list: the text catalog when available, else /v1/models ids
+    annotated with whatever text pricing is known.
+    """
+    text_models = [m for m in map(_normalize_text_model, text_snapshot.items if text_snapshot else []) if m]
+    if text_models:
+        return text_models
+    pricing_map = _text_pricing_map(text_snapshot)
+    models = [item['id'] for item in chat_snapshot.items] if chat_snapshot is not None else []
+    return [
+        {
+            "id": model_id,
+            "name": model_id,
+            "pricing": pricing_map.get(model_id),
+            "paid_only": False,
+            "cost": _cost_indicator_from_pricing(pricing_map.get(model_id)),
+        }
+        for model_id in models
+    ]
 
-        pricing_map = {}
-        text_model_ids = []
-        try:
-            pricing_resp = requests.get(text_models_url, headers=headers, timeout=10)
-            if pricing_resp.status_code == 200:
-                pricing_items = pricing_resp.json()
-                if isinstance(pricing_items, list):
-                    for item in pricing_items:
-                        if not isinstance(item, dict):
-                            continue
-                        normalized = _normalize_text_model(item)
-                        if normalized:
-                            text_models_normalized.append(normalized)
-                        name = item.get('name') or item.get('id') or ''
-                        pricing = item.get('pricing') or item.get('price')
-                        if name:
-                            pricing_map[name] = pricing
-                            text_model_ids.append(name)
-                        aliases = item.get('aliases', []) or []
-                        for alias in aliases:
-                            if alias and alias not in pricing_map:
-                                pricing_map[alias] = pricing
-        except Exception:
-            pricing_map = {}
-            text_model_ids = []
 
-        r = requests.get(models_url, headers=headers, timeout=10)
-        if r.status_code == 200:
-            if text_models_normalized:
-                _MODELS_CACHE['chat_models'] = (now, text_models_normalized)
-                return jsonify({"success": True, "models": text_models_normalized})
-
-            payload = r.json()
-            models = []
-            if isinstance(payload, dict) and isinstance(payload.get('data'), list):
-                for item in payload['data']:
-                    if isinstance(item, dict) and item.get('id'):
-                        models.append(item['id'])
-            elif isinstance(payload, list):
-                # fallback: some APIs return a raw list
-                models = payload
-            models_out = []
-            if pricing_map:
-                for model_id in models:
-                    pricing = pricing_map.get(model_id)
-                    cost_indicator = _cost_indicator_from_pricing(pricing)
-                    models_out.append({
-                        "id": model_id,
-                        "name": model_id,
-                        "pricing": pricing,
-                        "paid_only": False,
-                        "cost": cost_indicator,
-                    })
-            if not models_out and text_model_ids:
-                for name in sorted(set(text_model_ids)):
-                    cost_indicator = _cost_indicator_from_pricing(pricing_map.get(name))
-                    models_out.append({
-                        "id": name,
-                        "name": name,
-                        "pricing": pricing_map.get(name),
-                        "paid_only": False,
-                        "cost": cost_indicator,
-                    })
-            if not models_out:
-                for model_id in models:
-                    models_out.append({
-                        "id": model_id,
-                        "name": model_id,
-                        "pricing": None,
-                        "paid_only": False,
-                        "cost": None,
-                    })
-            _MODELS_CACHE['chat_models'] = (now, models_out)
-            return jsonify({"success": True, "models": models_out})
-        elif r.status_code == 403:
-            msg = _parse_api_error(r)
-            return jsonify({"success": False, "error": msg}), 403
+def _catalog_executor():
+    global _CATALOG_EXECUTOR
+    if _CATALOG_EXECUTOR is None:
+        with _BATCH_EXECUTOR_LOCK:
+            if _CATALOG_EXECUTOR is None:
+                _CATALOG_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='catalog-fetch')
+    return _CATALOG_EXECUTOR
+
+
+def _snapshot_or_none(future, timeout=None):
+    try:
+        return future.result(timeout=timeout)
+    except Exception:
+        return None
+
+
+def get_chat_models_api(request_obj=None):
+    """Return the chat models list, built from the text and chat (/v1/models) model catalogs.
+    Both catalogs are fetched concurrently; the answer uses whichever is available first
+    (the text catalog is preferred because it carries pricing). Answers 304 when the
+    caller's If-None-Match matches the list that would be built.
+    """
+    try:
+        headers = _catalog_headers(request_obj)
+        executor = _catalog_executor()
+        text_future = executor.submit(_TEXT_CATALOG.snapshot, headers)
+        chat_future = executor.submit(_CHAT_CATALOG.snapshot, headers)
+
+        wait([text_future, chat_future], return_when=FIRST_COMPLETED)
+        if text_future.done() or chat_future.exception() is not None:
+            text_snapshot = _snapshot_or_none(text_future)
         else:
+            # the id list is in; give the text catalog a moment to add pricing
+            grace = (API_CONFIG.get('MODEL_CATALOG') or {}).get('CHAT_PRICING_WAIT', 2)
+            text_snapshot = _snapshot_or_none(text_future, timeout=grace)
+        if text_snapshot is not None and text_snapshot.items:
+            return _conditional_json(
+                request_obj,
+                f"text-{text_snapshot.digest}",
+                lambda: {"success": True, "models": _chat_models_from_catalogs(text_snapshot, None)},
+            )
+
+        try:
+            chat_snapshot = chat_future.result()
+        except catalog.CatalogError as e:
+            r = e.response
+            if r.status_code == 403:
+                msg = _parse_api_error(r)
+                return jsonify({"success": False, "error": msg}), 403
             return jsonify({"success": False, "error": f"Models fetch failed: status {r.status_code}"}), r.status_code
+        etag = f"chat-{chat_snapshot.digest}"
+        if text_snapshot is not None:
+            etag = f"{etag}-{text_snapshot.digest}"
+        return _conditional_json(
+            request_obj,
+            etag,
+            lambda: {"success": True, "models": _chat_models_from_catalogs(text_snapshot, chat_snapshot)},
+        )
+    except upstream.UpstreamUnavailable as e:
+        body = upstream_unavailable_error(e, 'chat model list')
+        return jsonify(body), 503, retry_after_headers(body)
     except Exception as e:
         logger.exception("Error fetching chat models list")
         return jsonify({"success": False, "error": f"Error fetching chat models: {str(e)}"})
@@ -610,339 +959,879 @@ def _parse_api_error(resp):
         # fallback to raw text
         return resp.text or f"HTTP {resp.status_code}"
 
+def prepare_enhance_request(data, request_obj):
+    """Validate enhance-prompt JSON and build the upstream call.
+    Returns { url, headers, params } or raises ApiError.
+    """
+    prompt = data.get("prompt")
+    style = data.get("style", "photographic")
+    if not prompt:
+        raise ApiError({"success": False, "error": "No prompt provided"})
+    # Request multiple options in a consistent format
+    enhancement_prompt = f"Generate 3 enhanced versions of this prompt for an AI image generator in {style} style. Format your response EXACTLY as shown, with no other text:\n\nOption 1: [short title]\n[the enhanced prompt text here]\n\nOption 2: [short title]\n[the enhanced prompt text here]\n\nOption 3: [short title]\n[the enhanced prompt text here]\n\nOriginal prompt: {prompt}"
+    # Encode all special characters, including '/', to keep the prompt in a single path segment.
+    encoded_prompt = quote(enhancement_prompt, safe="")
+    # Build enhancement URL without referrer initially
+    enhancement_url = f"{API_CONFIG['TEXT_API']}{encoded_prompt}"
+
+    # Add referrer if not localhost or an IP address (API doesn't accept IPs as referrer)
+    host = request_obj.host or API_CONFIG['REFERRER']
+    host_base = host.split(':')[0] if host else None
+    is_ip = bool(host_base and re.match(r"^\d{1,3}(?:\.\d{1,3}){3}$", host_base))
+    params = {}
+    if host_base and not is_ip and host_base not in {'localhost', '127.0.0.1', '0.0.0.0'}:
+        params['referrer'] = host_base
+
+    # Prepare headers with Bearer token if available, prefer incoming Authorization header
+    headers = {}
+    incoming_auth = None
+    try:
+        incoming_auth = request_obj.headers.get('Authorization')
+    except Exception:
+        incoming_auth = None
+    if incoming_auth:
+        headers['Authorization'] = incoming_auth
+
+    return {'url': enhancement_url, 'headers': headers, 'params': params if params else None}
+
+
+def enhance_request_error(exc):
+    """Map a transport exception from the enhancement upstream call to a JSON error body."""
+    if isinstance(exc, upstream.UpstreamUnavailable):
+        return upstream_unavailable_error(exc, 'enhancement service')
+    if isinstance(exc, Timeout):
+        logger.debug("Timeout connecting to enhancement API")
+        return {"success": False, "error": "The AI enhancement service took too long to respond. Please try again."}
+    if isinstance(exc, ConnectionError):
+        logger.debug("Connection error: %s", str(exc))
+        return {"success": False, "error": "Failed to connect to the enhancement service. Please check your internet connection."}
+    logger.debug("Request error: %s", str(exc))
+    return {"success": False, "error": f"Error communicating with enhancement service: {str(exc)}"}
+
+
+def finish_enhance_response(response):
+    """Turn the upstream enhancement response into (body, status)."""
+    if response.status_code != 200:
+        logger.debug("API Error %s: %s", response.status_code, response.text)
+        # If forbidden, surface the API message clearly
+        if response.status_code == 403:
+            msg = _parse_api_error(response)
+            return {"success": False, "error": f"API Error 403: {msg}"}, 200
+        # handle payment required (402) to display helpful message
+        if response.status_code == 402:
+            msg = _parse_api_error(response)
+            return {"success": False, "error": f"API Error 402: {msg}"}, 200
+        return {"success": False, "error": f"Enhancement service returned error {response.status_code}. Please try again."}, 200
+
+    # Return the full enhanced text for modal display
+    enhanced_prompt = response.text.strip()
+
+    return {
+        "success": True,
+        "enhanced_prompt": enhanced_prompt
+    }, 200
+
+
+def enhance_flight_key(call, request_obj):
+    return (_auth_owner(call['headers'].get('Authorization')), call['url'], tuple(sorted((call['params'] or {}).items())))
+
+
+def run_enhance(call):
+    """Send a prepared enhancement request; returns (body, status)."""
+    # Request is being made to enhancement API (URL redacted in logs)
+    try:
+        response = upstream.get(
+            call['url'],
+            endpoint='enhance',
+            headers=call['headers'],
+            params=call['params'],
+        )
+    except RequestException as e:
+        return enhance_request_error(e), request_error_status(e)
+    return finish_enhance_response(response)
+
+
 def enhance_prompt_api(request):
     try:
         if not request.is_json:
             return jsonify({"success": False, "error": "Request must be JSON"})
         data = request.get_json(silent=True) or {}
-        prompt = data.get("prompt")
-        style = data.get("style", "photographic")
-        if not prompt:
-            return jsonify({"success": False, "error": "No prompt provided"})
-        # Request multiple options in a consistent format
-        enhancement_prompt = f"Generate 3 enhanced versions of this prompt for an AI image generator in {style} style. Format your response EXACTLY as shown, with no other text:\n\nOption 1: [short title]\n[the enhanced prompt text here]\n\nOption 2: [short title]\n[the enhanced prompt text here]\n\nOption 3: [short title]\n[the enhanced prompt text here]\n\nOriginal prompt: {prompt}"
-        # Encode all special characters, including '/', to keep the prompt in a single path segment.
-        encoded_prompt = quote(enhancement_prompt, safe="")
-        # Build enhancement URL without referrer initially
-        enhancement_url = f"{API_CONFIG['TEXT_API']}{encoded_prompt}"
-
-        # Add referrer if not localhost or an IP address (API doesn't accept IPs as referrer)
-        host = request.host or API_CONFIG['REFERRER']
-        host_base = host.split(':')[0] if host else None
-        is_ip = bool(host_base and re.match(r"^\d{1,3}(?:\.\d{1,3}){3}$", host_base))
-        params = {}
-        if host_base and not is_ip and host_base not in {'localhost', '127.0.0.1', '0.0.0.0'}:
-            params['referrer'] = host_base
-        
-        # Request is being made to enhancement API (URL redacted in logs)
-        
-        # Prepare headers with Bearer token if available, prefer incoming Authorization header
-        headers = {}
-        incoming_auth = None
-        try:
-            incoming_auth = request.headers.get('Authorization')
-        except Exception:
-            incoming_auth = None
-        if incoming_auth:
-            headers['Authorization'] = incoming_auth
-        
-        try:
-            response = requests.get(
-                enhancement_url,
-                headers=headers,
-                params=params if params else None,
-                timeout=API_CONFIG['TIMEOUT'],
-            )
-        except Timeout:
-            logger.debug("Timeout connecting to enhancement API")
-            return jsonify({"success": False, "error": "The AI enhancement service took too long to respond. Please try again."})
-        except ConnectionError as e:
-            logger.debug("Connection error: %s", str(e))
-            return jsonify({"success": False, "error": "Failed to connect to the enhancement service. Please check your internet connection."})
-        except RequestException as e:
-            logger.debug("Request error: %s", str(e))
-            return jsonify({"success": False, "error": f"Error communicating with enhancement service: {str(e)}"})
-        
-        if response.status_code != 200:
-            logger.debug("API Error %s: %s", response.status_code, response.text)
-            # If forbidden, surface the API message clearly
-            if response.status_code == 403:
-                msg = _parse_api_error(response)
-                return jsonify({"success": False, "error": f"API Error 403: {msg}"})
-            # handle payment required (402) to display helpful message
-            if response.status_code == 402:
-                msg = _parse_api_error(response)
-                return jsonify({"success": False, "error": f"API Error 402: {msg}"})
-            return jsonify({"success": False, "error": f"Enhancement service returned error {response.status_code}. Please try again."})
-        
-        # Return the full enhanced text for modal display
-        enhanced_prompt = response.text.strip()
-        
-        return jsonify({
-            "success": True,
-            "enhanced_prompt": enhanced_prompt
-        })
+        call = prepare_enhance_request(data, request)
+
+        # identical concurrent enhancements for the same key share one upstream call
+        (body, status), _ = ENHANCE_FLIGHTS.do(
+            enhance_flight_key(call, request),
+            lambda: run_enhance(call),
+        )
+        return jsonify(body), status, retry_after_headers(body)
+    except ApiError as e:
+        return jsonify(e.body), e.status
     except Exception as e:
         logger.exception("Error enhancing prompt")
         return jsonify({"success": False, "error": f"Unexpected error: {str(e)}"})
 
-def generate_image_api(request):
+
+def generation_endpoint(call):
+    """Upstream endpoint name (timeout, breaker, latency target) for a prepared generation."""
+    return 'video' if call.get('is_video') else 'image'
+
+
+def prepare_generation_request(data, request_obj):
+    """Validate generation JSON and build the upstream image/video call.
+    Returns { url, headers, model, is_video } or raises ApiError.
+    """
+    prompt = data.get("prompt")
+    if not prompt:
+        raise ApiError({"success": False, "error": "No prompt provided"})
+    style = data.get("style", "photographic")
+    model = data.get("model", "flux")
+    size = data.get("size", "1024x1024")
+    # new: read quality from client so we can forward it (gptimage only)
+    quality = data.get("quality", None)
+    negative_prompt = data.get("negative_prompt", "")
+    seed = data.get("seed", None)
+    # Normalize seed: accept integers only, ignore empty strings or invalid values
     try:
-        if not request.is_json:
-            return jsonify({"success": False, "error": "Request must be JSON"})
-        data = request.get_json(silent=True) or {}
-        prompt = data.get("prompt")
-        if not prompt:
-            return jsonify({"success": False, "error": "No prompt provided"})
-        style = data.get("style", "photographic")
-        model = data.get("model", "flux")
-        size = data.get("size", "1024x1024")
-        # new: read quality from client so we can forward it (gptimage only)
-        quality = data.get("quality", None)
-        negative_prompt = data.get("negative_prompt", "")
-        seed = data.get("seed", None)
-        # Normalize seed: accept integers only, ignore empty strings or invalid values
-        try:
-            if seed is None:
-                seed = None
-            elif isinstance(seed, str) and seed.strip() == "":
-                seed = None
-            else:
-                # coerce to int when possible
-                seed = int(seed)
-        except Exception:
+        if seed is None:
             seed = None
-        if seed is not None:
-            logger.debug("Using fixed seed: %s", seed)
-        
-        logger.debug("[GENERATE] Received request - prompt: %s, style: %s, model: %s", prompt[:50], style, model)
-        
-        # Model-specific size requirements
-        MODEL_MIN_SIZES = {
-            'gptimage': {'min_width': 1024, 'min_height': 1024, 'allowed': ['1024x1024', '1024x1536', '1536x1024']},
-            'seedream': {'min_pixels': 921600},  # minimum 1024x900
-            'seedream-pro': {'min_pixels': 921600},
-        }
-        
-        try:
-            width, height = map(int, size.split('x'))
-        except Exception:
-            # fallback to a safe default if size parsing fails
-            logger.debug("Invalid size format '%s', defaulting to 1024x1024", size)
+        elif isinstance(seed, str) and seed.strip() == "":
+            seed = None
+        else:
+            # coerce to int when possible
+            seed = int(seed)
+    except Exception:
+        seed = None
+    if seed is not None:
+        logger.debug("Using fixed seed: %s", seed)
+    
+    logger.debug("[GENERATE] Received request - prompt: %s, style: %s, model: %s", prompt[:50], style, model)
+    
+    # Model-specific size requirements
+    MODEL_MIN_SIZES = {
+        'gptimage': {'min_width': 1024, 'min_height': 1024, 'allowed': ['1024x1024', '1024x1536', '1536x1024']},
+        'seedream': {'min_pixels': 921600},  # minimum 1024x900
+        'seedream-pro': {'min_pixels': 921600},
+    }
+    
+    try:
+        width, height = map(int, size.split('x'))
+    except Exception:
+        # fallback to a safe default if size parsing fails
+        logger.debug("Invalid size format '%s', defaulting to 1024x1024", size)
+        width, height = 1024, 1024
+
+    # Apply model-specific constraints
+    if model in MODEL_MIN_SIZES:
+        constraints = MODEL_MIN_SIZES[model]
+        # GPT Image has specific allowed sizes
+        if 'allowed' in constraints and size not in constraints['allowed']:
+            # Default to 1024x1024 for gptimage
             width, height = 1024, 1024
-
-        # Apply model-specific constraints
-        if model in MODEL_MIN_SIZES:
-            constraints = MODEL_MIN_SIZES[model]
-            # GPT Image has specific allowed sizes
-            if 'allowed' in constraints and size not in constraints['allowed']:
-                # Default to 1024x1024 for gptimage
-                width, height = 1024, 1024
-            # Seedream requires minimum pixel count
-            elif 'min_pixels' in constraints and (width * height) < constraints['min_pixels']:
-                # Default to 1024x1024 (meets minimum)
-                width, height = 1024, 1024
-        
-        # Format the prompt with style for better API recognition
-        complete_prompt = f"{prompt}, {style} style, high quality"
-        encoded_prompt = quote(complete_prompt)
-        # Build URL with model parameter (required for new endpoint)
-        image_url = (f"{API_CONFIG['IMAGE_API']}{encoded_prompt}?"
-                    f"width={width}&"
-                    f"height={height}&"
-                    f"model={model}")
-        
-        logger.debug("[GENERATE] Complete prompt: %s", complete_prompt)
-        logger.debug("[GENERATE] URL (without auth): %s...", image_url[:150])
-        
-        # Add seed if provided
-        if seed is not None:
-            image_url += f"&seed={seed}"
-
-        # Add negative prompt if provided (documented API param)
-        if isinstance(negative_prompt, str) and negative_prompt.strip():
-            image_url += f"&negative_prompt={quote(negative_prompt)}"
-
-        # Include quality and guidance. Map UI quality labels to upstream enum when appropriate.
-        if quality:
-            q = str(quality).lower()
-            # If caller already provided API enum (low/medium/high/hd), pass through
-            if q in {'low', 'medium', 'high', 'hd'}:
-                image_url += f"&quality={quote(q)}"
+        # Seedream requires minimum pixel count
+        elif 'min_pixels' in constraints and (width * height) < constraints['min_pixels']:
+            # Default to 1024x1024 (meets minimum)
+            width, height = 1024, 1024
+    
+    # Format the prompt with style for better API recognition
+    complete_prompt = f"{prompt}, {style} style, high quality"
+    encoded_prompt = quote(complete_prompt)
+    # Build URL with model parameter (required for new endpoint)
+    image_url = (f"{API_CONFIG['IMAGE_API']}{encoded_prompt}?"
+                f"width={width}&"
+                f"height={height}&"
+                f"model={model}")
+    
+    logger.debug("[GENERATE] Complete prompt: %s", complete_prompt)
+    logger.debug("[GENERATE] URL (without auth): %s...", image_url[:150])
+    
+    # Add seed if provided
+    if seed is not None:
+        image_url += f"&seed={seed}"
+
+    # Add negative prompt if provided (documented API param)
+    if isinstance(negative_prompt, str) and negative_prompt.strip():
+        image_url += f"&negative_prompt={quote(negative_prompt)}"
+
+    # Include quality and guidance. Map UI quality labels to upstream enum when appropriate.
+    if quality:
+        q = str(quality).lower()
+        # If caller already provided API enum (low/medium/high/hd), pass through
+        if q in {'low', 'medium', 'high', 'hd'}:
+            image_url += f"&quality={quote(q)}"
+        else:
+            # Map our UI labels to API enum values for gptimage compatibility
+            ui_to_api = {'fast': 'low', 'balanced': 'medium', 'detailed': 'high', 'maximum': 'hd'}
+            mapped = ui_to_api.get(q)
+            if mapped:
+                image_url += f"&quality={quote(mapped)}"
             else:
-                # Map our UI labels to API enum values for gptimage compatibility
-                ui_to_api = {'fast': 'low', 'balanced': 'medium', 'detailed': 'high', 'maximum': 'hd'}
-                mapped = ui_to_api.get(q)
-                if mapped:
-                    image_url += f"&quality={quote(mapped)}"
-                else:
-                    # If a numeric step count was provided, pass it through (some models accept numeric quality)
-                    try:
-                        _ = int(quality)
-                        image_url += f"&quality={quote(str(quality))}"
-                    except Exception:
-                        # unknown quality string — do not forward
-                        logger.debug("Unknown quality value skipped: %s", quality)
-        # Video-specific params (optional)
-        duration = data.get("duration", None)
-        aspectRatio = data.get("aspectRatio", "")
-        audio = data.get("audio", False)
-
-        # normalize duration and fps values
+                # If a numeric step count was provided, pass it through (some models accept numeric quality)
+                try:
+                    _ = int(quality)
+                    image_url += f"&quality={quote(str(quality))}"
+                except Exception:
+                    # unknown quality string — do not forward
+                    logger.debug("Unknown quality value skipped: %s", quality)
+    # Video-specific params (optional)
+    duration = data.get("duration", None)
+    aspectRatio = data.get("aspectRatio", "")
+    audio = data.get("audio", False)
+
+    # normalize duration and fps values
+    try:
+        dur_val = int(duration) if duration is not None else None
+    except Exception:
+        dur_val = None
+
+    # If duration provided or model is a known video model, include video params
+    VIDEO_MODELS = {"veo", "seedance", "seedance-pro"}
+    is_video_request = False
+    try:
+        if dur_val is not None and dur_val > 0:
+            is_video_request = True
+    except Exception:
+        is_video_request = is_video_request
+
+    if model and model.lower() in VIDEO_MODELS:
+        is_video_request = True
+
+    # Include only supported query params. Forward aspectRatio for both image/video when provided.
+    if aspectRatio:
+        image_url += f"&aspectRatio={quote(str(aspectRatio))}"
+
+    if is_video_request:
+        # duration in seconds (already normalized to dur_val)
+        if dur_val is not None:
+            image_url += f"&duration={dur_val}"
+        if audio:
+            image_url += "&audio=true"
+    
+    # Generation request initiated (URL redacted to avoid leaking sensitive params)
+    logger.debug("Generation request initiated. timeout: %s seconds", API_CONFIG.get('TIMEOUT'))
+    
+    # Prepare headers with Bearer token if available, prefer incoming Authorization header
+    headers = {}
+    incoming_auth = None
+    try:
+        incoming_auth = request_obj.headers.get('Authorization')
+    except Exception:
+        incoming_auth = None
+    
+    # Debug logging
+    logger.debug("[GENERATE] Incoming auth header present: %s", bool(incoming_auth))
+    if incoming_auth:
         try:
-            dur_val = int(duration) if duration is not None else None
+            prefix = (incoming_auth[:8] + '...') if len(incoming_auth) > 8 else incoming_auth
         except Exception:
-            dur_val = None
+            prefix = "(masked)"
+        logger.debug("[GENERATE] Auth header prefix: %s", prefix)
+    
+    if incoming_auth:
+        headers['Authorization'] = incoming_auth
+
+    # How the image is returned to the browser: upstream bytes as-is, or re-encoded
+    output_format = str(data.get("output_format") or MEDIA_CONFIG.get('IMAGE_OUTPUT_FORMAT') or 'original').lower()
+    if output_format == 'jpg':
+        output_format = 'jpeg'
+    if output_format not in _IMAGE_OUTPUT_FORMATS and output_format != 'original':
+        raise ApiError({"success": False, "error": f"Unsupported output_format: {output_format}"})
+    output_quality = data.get("output_quality")
+    try:
+        output_quality = max(1, min(100, int(output_quality))) if output_quality is not None else None
+    except Exception:
+        output_quality = None
+    # Images are served by URL from the blob store; `?inline=1` (or "inline": true) keeps the data: URL
+    inline = bool(data.get("inline"))
+    try:
+        inline = inline or str(request_obj.args.get('inline', '')).lower() in {'1', 'true', 'yes'}
+    except Exception:
+        pass
+
+    return {
+        'url': image_url,
+        'headers': headers,
+        'model': model,
+        'is_video': is_video_request,
+        'output_format': output_format,
+        'output_quality': output_quality,
+        'inline': inline,
+        # the upstream URL is the normalized form of every generation parameter; only
+        # fixed seeds are deterministic (the UI sends -1 for a random seed)
+        'cache_key': cache_key({'upstream': image_url}) if seed is not None and seed >= 0 else None,
+        'cache_hit': False,
+    }
+
+
+def lookup_generation_cache(call, request_obj):
+    """Return a CachedResponse replaying an earlier identical fixed-seed generation, or None.
+    Sending `X-Cache-Bypass: 1` (or `Cache-Control: no-cache`) skips the lookup; the
+    fresh result still refreshes the cache.
+    """
+    if not call.get('cache_key'):
+        return None
+    try:
+        bypass = request_obj.headers.get('X-Cache-Bypass', '').lower() in {'1', 'true', 'yes'}
+        cache_control = (request_obj.headers.get('Cache-Control') or '').lower()
+        bypass = bypass or 'no-cache' in cache_control or 'no-store' in cache_control
+    except Exception:
+        bypass = False
+    # BYOP: only callers with their own API key are served, as upstream would require
+    if bypass or not call['headers'].get('Authorization'):
+        return None
+    cached = _GENERATION_CACHE.get(call['cache_key'])
+    if cached is not None:
+        call['cache_hit'] = True
+        logger.debug("[GENERATE] Serving fixed-seed generation from cache")
+    return cached
 
-        # If duration provided or model is a known video model, include video params
-        VIDEO_MODELS = {"veo", "seedance", "seedance-pro"}
-        is_video_request = False
+
+def video_too_large_error():
+    limit_mb = MEDIA_CONFIG.get('MAX_VIDEO_BYTES', 0) // (1024 * 1024)
+    return {"success": False, "error": f"The generated video is larger than the {limit_mb} MB limit."}
+
+
+def generation_request_error(exc):
+    """Map a transport exception from the generation upstream call to a JSON error body."""
+    if isinstance(exc, upstream.UpstreamUnavailable):
+        return upstream_unavailable_error(exc, 'image generation service')
+    if isinstance(exc, Timeout):
+        logger.debug("Timeout generating image")
+        return {"success": False, "error": "Image generation took too long (timeout). The API may be experiencing high load. Please try again in a moment."}
+    if isinstance(exc, ConnectionError):
+        logger.debug("Connection error: %s", str(exc))
+        return {"success": False, "error": "Failed to connect to the image generation service. Please check your internet connection."}
+    logger.debug("Request error: %s", str(exc))
+    return {"success": False, "error": f"Error communicating with image service: {str(exc)}"}
+
+
+class MediaTooLarge(Exception):
+    """Raised when an upstream media body exceeds the configured size limit."""
+
+
+class VideoDownload:
+    """Streams a video body into static/generated_videos.
+    Chunks go to a `.part` temp file that is atomically renamed into place on
+    commit(), so a partial download is never served.
+    """
+
+    def __init__(self, ext, content_length=None):
+        self.max_bytes = MEDIA_CONFIG.get('MAX_VIDEO_BYTES')
+        try:
+            expected = int(content_length) if content_length is not None else None
+        except (TypeError, ValueError):
+            expected = None
+        if self.max_bytes and expected is not None and expected > self.max_bytes:
+            raise MediaTooLarge(expected)
+        os.makedirs(_GENERATED_VIDEOS_DIR, exist_ok=True)
+        self.filename = f"{uuid.uuid4().hex}.{ext}"
+        self.path = os.path.join(_GENERATED_VIDEOS_DIR, self.filename)
+        self.tmp_path = f"{self.path}.part"
+        self.size = 0
+        self._file = open(self.tmp_path, 'wb')
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise MediaTooLarge(self.size)
+        self._file.write(chunk)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        return self.filename
+
+    def abort(self):
         try:
-            if dur_val is not None and dur_val > 0:
-                is_video_request = True
+            self._file.close()
+            os.remove(self.tmp_path)
         except Exception:
-            is_video_request = is_video_request
+            pass
 
-        if model and model.lower() in VIDEO_MODELS:
-            is_video_request = True
 
-        # Include only supported query params. Forward aspectRatio for both image/video when provided.
-        if aspectRatio:
-            image_url += f"&aspectRatio={quote(str(aspectRatio))}"
+def video_extension(content_type):
+    subtype = content_type.split('/')[-1].split(';')[0]
+    return subtype if subtype.isalnum() else 'mp4'
 
-        if is_video_request:
-            # duration in seconds (already normalized to dur_val)
-            if dur_val is not None:
-                image_url += f"&duration={dur_val}"
-            if audio:
-                image_url += "&audio=true"
-        
-        # Generation request initiated (URL redacted to avoid leaking sensitive params)
-        logger.debug("Generation request initiated. timeout: %s seconds", API_CONFIG.get('TIMEOUT'))
-        
-        # Prepare headers with Bearer token if available, prefer incoming Authorization header
-        headers = {}
-        incoming_auth = None
+
+def save_video_stream(img_response):
+    """Write a streamed (`stream=True`) upstream video body to disk; returns the filename."""
+    download = VideoDownload(
+        video_extension(img_response.headers.get('content-type', '').lower()),
+        img_response.headers.get('content-length'),
+    )
+    try:
+        for chunk in img_response.iter_content(chunk_size=MEDIA_CONFIG.get('DOWNLOAD_CHUNK_SIZE', 65536)):
+            if chunk:
+                download.write(chunk)
+        return download.commit()
+    except Exception:
+        download.abort()
+        raise
+
+
+def store_image_blob(image_bytes, mime):
+    """Write a generated image to the short-lived blob store; returns its filename.
+    Blobs expire after MEDIA_CONFIG['IMAGE_BLOB_TTL'] and the directory is capped at
+    IMAGE_BLOB_MAX_BYTES, see cleanup_image_blobs().
+    """
+    global _LAST_BLOB_CLEANUP
+    os.makedirs(_GENERATED_IMAGES_DIR, exist_ok=True)
+    ext = _IMAGE_EXTENSIONS.get(mime, 'png')
+    filename = f"{uuid.uuid4().hex}.{ext}"
+    path = os.path.join(_GENERATED_IMAGES_DIR, filename)
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(image_bytes)
+    os.replace(tmp_path, path)
+
+    now = time.time()
+    if now - _LAST_BLOB_CLEANUP >= MEDIA_CONFIG.get('IMAGE_BLOB_CLEANUP_INTERVAL', 60):
+        _LAST_BLOB_CLEANUP = now
+        cleanup_image_blobs(_GENERATED_IMAGES_DIR)
+    return filename
+
+
+def encode_image_output(raw, content_type, output_format='original', quality=None):
+    """Return (bytes, mime) for an upstream image in the requested output format.
+    'original' forwards browser-displayable upstream bytes untouched (no decode);
+    other formats, or unknown upstream types, are re-encoded with PIL.
+    """
+    mime = content_type.split(';')[0].strip().lower()
+    if mime == 'image/jpg':
+        mime = 'image/jpeg'
+    if output_format == 'original':
+        if mime in _PASSTHROUGH_IMAGE_MIMES:
+            return raw, mime
+        output_format = 'png'
+    if mime == _IMAGE_OUTPUT_FORMATS[output_format] and quality is None:
+        return raw, mime
+
+    img = Image.open(io.BytesIO(raw))
+    save_kwargs = {}
+    if output_format in {'jpeg', 'webp'}:
+        save_kwargs['quality'] = quality or MEDIA_CONFIG.get('IMAGE_OUTPUT_QUALITY', 90)
+    if output_format == 'jpeg' and img.mode not in {'RGB', 'L'}:
+        # JPEG has no alpha channel
+        img = img.convert('RGB')
+    img_io = io.BytesIO()
+    img.save(img_io, output_format.upper(), **save_kwargs)
+    return img_io.getvalue(), _IMAGE_OUTPUT_FORMATS[output_format]
+
+
+def finish_generation_response(img_response, call, request_obj, video_filename=None):
+    """Turn the upstream image/video response into (body, status).
+    A video body is streamed to disk here unless the caller already saved it
+    and passes `video_filename`.
+    """
+    invalidate_balance(_token_from_auth(call['headers'].get('Authorization')))
+    model = call['model']
+    if img_response.status_code != 200:
+        logger.debug("API Error %s: %s", img_response.status_code, (img_response.text or '')[:500])
+        # handle forbidden specifically and try to surface API error
+        if img_response.status_code == 403:
+            msg = _parse_api_error(img_response)
+            return {"success": False, "error": f"API Error 403: {msg}"}, 200
+        # handle payment required (402) to display helpful message
+        if img_response.status_code == 402:
+            msg = _parse_api_error(img_response)
+            return {"success": False, "error": f"API Error 402: {msg}"}, 200
+        error_msg = f"Image generation failed with status {img_response.status_code}"
+        if img_response.status_code == 400:
+            error_msg = "Invalid request parameters. Please check your settings."
+        elif img_response.status_code == 429:
+            error_msg = "Too many requests. Please wait a moment and try again."
+        elif img_response.status_code == 503:
+            error_msg = "The image generation service is temporarily unavailable. Please try again later."
+        if img_response.status_code in (429, 503):
+            # still failing after upstream.py's retries: pass the status and Retry-After on
+            body = {"success": False, "error": error_msg}
+            retry_after = upstream.parse_retry_after(img_response.headers.get('Retry-After'))
+            if retry_after:
+                body["retry_after"] = int(math.ceil(retry_after))
+            return body, img_response.status_code
+        return {"success": False, "error": error_msg}, 200
+    
+    try:
+        # Determine content type
+        content_type = img_response.headers.get('content-type', '').lower()
+
+        # Helper: fetch model pricing (best-effort)
+        pricing = get_model_pricing(model, request_obj)
+
+        # attach a simple human-friendly estimate string if possible
         try:
-            incoming_auth = request.headers.get('Authorization')
+            if isinstance(pricing, dict):
+                token_cost = None
+                if isinstance(pricing.get('completionImageTokens'), (int, float)):
+                    token_cost = pricing.get('completionImageTokens')
+                elif isinstance(pricing.get('promptImageTokens'), (int, float)):
+                    token_cost = pricing.get('promptImageTokens')
+                elif isinstance(pricing.get('estimated_total'), (int, float)):
+                    token_cost = pricing.get('estimated_total')
+
+                if token_cost is not None:
+                    pricing['estimated_total'] = token_cost
+                    pricing['estimate_text'] = (
+                        f"Estimated: {token_cost} "
+                        f"{pricing.get('currency','pollen')}"
+                    )
+                else:
+                    pricing['estimate_text'] = None
         except Exception:
-            incoming_auth = None
-        
-        # Debug logging
-        logger.debug("[GENERATE] Incoming auth header present: %s", bool(incoming_auth))
-        if incoming_auth:
+            pass
+
+        # If it's a video response, stream it to static/generated_videos and return URL
+        if content_type.startswith('video'):
+            filename = video_filename
+            if filename is None:
+                try:
+                    filename = save_video_stream(img_response)
+                except MediaTooLarge:
+                    return video_too_large_error(), 200
+
+            if call.get('cache_key') and not call.get('cache_hit'):
+                _GENERATION_CACHE.put_file(call['cache_key'], os.path.join(_GENERATED_VIDEOS_DIR, filename), content_type)
+
+            # Build external URL
+            host_url = request_obj.host_url.rstrip('/')
+            video_url = f"{host_url}/static/generated_videos/{filename}"
+
+            # cleanup old videos asynchronously (best-effort): remove files older than 7 days
             try:
-                prefix = (incoming_auth[:8] + '...') if len(incoming_auth) > 8 else incoming_auth
+                cleanup_old_videos(_GENERATED_VIDEOS_DIR, max_age_days=7)
             except Exception:
-                prefix = "(masked)"
-            logger.debug("[GENERATE] Auth header prefix: %s", prefix)
-        
-        if incoming_auth:
-            headers['Authorization'] = incoming_auth
-        
+                pass
+
+            return {"success": True, "url": video_url, "type": "video", "pricing": pricing, "cached": call.get('cache_hit', False)}, 200
+
+        # Otherwise assume it's an image
+        if call.get('cache_key') and not call.get('cache_hit'):
+            _GENERATION_CACHE.put_bytes(call['cache_key'], img_response.content, content_type)
+        image_bytes, mime = encode_image_output(
+            img_response.content,
+            content_type,
+            call.get('output_format', 'original'),
+            call.get('output_quality'),
+        )
+        if call.get('inline'):
+            img_str = base64.b64encode(image_bytes).decode()
+            data_url = f"data:{mime};base64,{img_str}"
+            return {"success": True, "url": data_url, "pricing": pricing, "cached": call.get('cache_hit', False)}, 200
+
+        filename = store_image_blob(image_bytes, mime)
+        host_url = request_obj.host_url.rstrip('/')
+        image_url = f"{host_url}/static/generated_images/{filename}"
+        return {"success": True, "url": image_url, "type": "image", "pricing": pricing, "cached": call.get('cache_hit', False)}, 200
+    except Exception as e:
+        logger.exception("Error processing media")
+        return {"success": False, "error": f"Error processing the generated media: {str(e)}"}, 200
+
+
+def generation_flight_key(call, request_obj):
+    """Key for coalescing identical in-flight generations; None unless the request is deterministic."""
+    if not call.get('cache_key'):
+        return None
+    return (
+        _auth_owner(call['headers'].get('Authorization')),
+        call['cache_key'],
+        call.get('output_format'),
+        call.get('output_quality'),
+        call.get('inline'),
+        request_obj.host_url,
+    )
+
+
+def run_generation(call, request_obj):
+    """Replay from the cache or fetch one prepared generation; returns (body, status)."""
+    img_response = lookup_generation_cache(call, request_obj)
+    if img_response is None:
         try:
-            img_response = requests.get(image_url, headers=headers, timeout=API_CONFIG['TIMEOUT'])
+            # stream so video bodies can be written to disk without buffering them in memory
+            img_response = upstream.get(call['url'], endpoint=generation_endpoint(call), headers=call['headers'], stream=True)
             logger.debug("[GENERATE] Pollinations API response: %s", img_response.status_code)
-        except Timeout:
-            logger.debug("Timeout generating image")
-            return jsonify({"success": False, "error": "Image generation took too long (timeout). The API may be experiencing high load. Please try again in a moment."})
-        except ConnectionError as e:
-            logger.debug("Connection error: %s", str(e))
-            return jsonify({"success": False, "error": "Failed to connect to the image generation service. Please check your internet connection."})
         except RequestException as e:
-            logger.debug("Request error: %s", str(e))
-            return jsonify({"success": False, "error": f"Error communicating with image service: {str(e)}"})
-        
-        if img_response.status_code != 200:
-            logger.debug("API Error %s: %s", img_response.status_code, (img_response.text or '')[:500])
-            # handle forbidden specifically and try to surface API error
-            if img_response.status_code == 403:
-                msg = _parse_api_error(img_response)
-                return jsonify({"success": False, "error": f"API Error 403: {msg}"})
-            # handle payment required (402) to display helpful message
-            if img_response.status_code == 402:
-                msg = _parse_api_error(img_response)
-                return jsonify({"success": False, "error": f"API Error 402: {msg}"})
-            error_msg = f"Image generation failed with status {img_response.status_code}"
-            if img_response.status_code == 400:
-                error_msg = "Invalid request parameters. Please check your settings."
-            elif img_response.status_code == 429:
-                error_msg = "Too many requests. Please wait a moment and try again."
-            elif img_response.status_code == 503:
-                error_msg = "The image generation service is temporarily unavailable. Please try again later."
-            return jsonify({"success": False, "error": error_msg})
-        
-        try:
-            # Determine content type
-            content_type = img_response.headers.get('content-type', '').lower()
+            return generation_request_error(e), request_error_status(e)
 
-            # Helper: fetch model pricing (best-effort)
-            pricing = get_model_pricing(model, request)
+    try:
+        return finish_generation_response(img_response, call, request_obj)
+    finally:
+        img_response.close()
 
-            # attach a simple human-friendly estimate string if possible
-            try:
-                if isinstance(pricing, dict):
-                    token_cost = None
-                    if isinstance(pricing.get('completionImageTokens'), (int, float)):
-                        token_cost = pricing.get('completionImageTokens')
-                    elif isinstance(pricing.get('promptImageTokens'), (int, float)):
-                        token_cost = pricing.get('promptImageTokens')
-                    elif isinstance(pricing.get('estimated_total'), (int, float)):
-                        token_cost = pricing.get('estimated_total')
 
-                    if token_cost is not None:
-                        pricing['estimated_total'] = token_cost
-                        pricing['estimate_text'] = (
-                            f"Estimated: {token_cost} "
-                            f"{pricing.get('currency','pollen')}"
-                        )
-                    else:
-                        pricing['estimate_text'] = None
-            except Exception:
-                pass
+def generate(data, request_obj):
+    """Run one generation described by a /generate JSON body; returns (body, status)."""
+    try:
+        call = prepare_generation_request(data, request_obj)
+    except ApiError as e:
+        return e.body, e.status
 
-            # If it's a video response, save to static folder and return URL
-            if content_type.startswith('video'):
-                # Determine extension
-                subtype = content_type.split('/')[-1].split(';')[0]
-                ext = subtype if subtype.isalnum() else 'mp4'
-
-                # Save file to static/generated_videos
-                videos_dir = os.path.join(os.path.dirname(__file__), 'static', 'generated_videos')
-                os.makedirs(videos_dir, exist_ok=True)
-                filename = f"{uuid.uuid4().hex}.{ext}"
-                filepath = os.path.join(videos_dir, filename)
-                with open(filepath, 'wb') as f:
-                    f.write(img_response.content)
-
-                # Build external URL
-                host_url = request.host_url.rstrip('/')
-                video_url = f"{host_url}/static/generated_videos/{filename}"
-
-                # cleanup old videos asynchronously (best-effort): remove files older than 7 days
-                try:
-                    cleanup_old_videos(videos_dir, max_age_days=7)
-                except Exception:
-                    pass
-
-                return jsonify({"success": True, "url": video_url, "type": "video", "pricing": pricing})
-
-            # Otherwise assume it's an image
-            img = Image.open(io.BytesIO(img_response.content))
-            img_io = io.BytesIO()
-            img.save(img_io, 'PNG')
-            img_io.seek(0)
-            img_str = base64.b64encode(img_io.getvalue()).decode()
-            data_url = f"data:image/png;base64,{img_str}"
-            return jsonify({"success": True, "url": data_url, "pricing": pricing})
-        except Exception as e:
-            logger.exception("Error processing media")
-            return jsonify({"success": False, "error": f"Error processing the generated media: {str(e)}"})
+    flight_key = generation_flight_key(call, request_obj)
+    if flight_key is None:
+        return run_generation(call, request_obj)
+    (body, status), _ = GENERATION_FLIGHTS.do(flight_key, lambda: run_generation(call, request_obj))
+    return body, status
+
+
+def generate_image_api(request):
+    try:
+        if not request.is_json:
+            return jsonify({"success": False, "error": "Request must be JSON"})
+        data = request.get_json(silent=True) or {}
+        body, status = generate(data, request)
+        return jsonify(body), status, retry_after_headers(body)
     except Exception as e:
         logger.exception("Unexpected error in generate_image_api")
         return jsonify({"success": False, "error": f"Unexpected error: {str(e)}"}) 
 
 
+class _FairBatchPool:
+    """Worker threads for /generate/batch items. Workers take the next item from each owner in
+    turn and run at most `per_owner` of one owner's items at once, so one key's large batch
+    cannot hold up everyone else's.
+    """
+
+    def __init__(self, workers, per_owner):
+        self._per_owner = max(1, per_owner)
+        self._cond = threading.Condition()
+        # owner -> deque of (future, fn, args); key order is the round-robin rotation
+        self._queues = OrderedDict()
+        self._running = {}
+        for number in range(max(1, workers)):
+            threading.Thread(target=self._work, name=f'generate-batch-{number}', daemon=True).start()
+
+    def submit(self, owner, fn, *args):
+        future = Future()
+        with self._cond:
+            self._queues.setdefault(owner, deque()).append((future, fn, args))
+            self._cond.notify()
+        return future
+
+    def _next(self):
+        """Pop the next item of the first owner in rotation below its cap (call with the lock held)."""
+        for owner in list(self._queues):
+            if self._running.get(owner, 0) >= self._per_owner:
+                continue
+            queue = self._queues[owner]
+            item = queue.popleft()
+            if queue:
+                self._queues.move_to_end(owner)
+            else:
+                del self._queues[owner]
+            self._running[owner] = self._running.get(owner, 0) + 1
+            return owner, item
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                picked = self._next()
+                while picked is None:
+                    self._cond.wait()
+                    picked = self._next()
+            owner, (future, fn, args) = picked
+            try:
+                # False when the client went away and the item was cancelled
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    remaining = self._running[owner] - 1
+                    if remaining > 0:
+                        self._running[owner] = remaining
+                    else:
+                        del self._running[owner]
+                    self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'running': sum(self._running.values()),
+                'owners': len(set(self._queues) | set(self._running)),
+            }
+
+
+def _batch_executor():
+    global _BATCH_EXECUTOR
+    if _BATCH_EXECUTOR is None:
+        with _BATCH_EXECUTOR_LOCK:
+            if _BATCH_EXECUTOR is None:
+                _BATCH_EXECUTOR = _FairBatchPool(
+                    MEDIA_CONFIG.get('BATCH_WORKERS', 4),
+                    ADMISSION_CONFIG.get('MAX_CONCURRENT_PER_OWNER', 2),
+                )
+    return _BATCH_EXECUTOR
+
+
+def _batch_item(index, spec, context, owner):
+    """Run one batch item; each item is admitted on its own, like a separate /generate."""
+    ticket = None
+    try:
+        if not isinstance(spec, dict):
+            body, status = {"success": False, "error": "Each item must be a JSON object"}, 200
+        else:
+            if admission.enabled():
+                ticket = admission.acquire(owner)
+            body, status = generate(spec, context)
+    except admission.Rejected as e:
+        body, status = e.body, e.status
+    except Exception as e:
+        logger.exception("Unexpected error in batch item %s", index)
+        body, status = {"success": False, "error": f"Unexpected error: {str(e)}"}, 200
+    finally:
+        if ticket is not None:
+            ticket.release()
+    return {"index": index, "status": status, **body}
+
+
+def _batch_lines(futures):
+    try:
+        for future in as_completed(futures):
+            yield json.dumps(future.result()) + "\n"
+    finally:
+        # the client went away: skip the items that have not started yet
+        for future in futures:
+            future.cancel()
+
+
+def generate_batch_api(request):
+    """Run several generations concurrently and stream each result as soon as it finishes.
+    Accepts JSON { items: [ {...}, ... ], ...defaults }: each item takes /generate's parameters,
+    and any other top-level field is a default for every item (e.g. one prompt, several seeds).
+    Returns application/x-ndjson with one { index, status, ...generate result } line per item,
+    in completion order. Each item is charged to the caller's admission limits like a separate
+    /generate; an item that is not admitted gets a status 429 line with `retry_after`.
+    """
+    try:
+        if not request.is_json:
+            return jsonify({"success": False, "error": "Request must be JSON"})
+        data = request.get_json(silent=True) or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({"success": False, "error": "items must be a non-empty list"})
+        max_items = MEDIA_CONFIG.get('BATCH_MAX_ITEMS', 16)
+        if len(items) > max_items:
+            return jsonify({"success": False, "error": f"A batch can contain at most {max_items} items"})
+
+        defaults = {key: value for key, value in data.items() if key != 'items'}
+        try:
+            if str(request.args.get('inline', '')).lower() in {'1', 'true', 'yes'}:
+                defaults.setdefault('inline', True)
+        except Exception:
+            pass
+        specs = [{**defaults, **item} if isinstance(item, dict) else item for item in items]
+
+        # workers run after this request context is gone, so hand them a detached copy
+        context = RequestContext.from_request(request)
+        owner = owner_key(request)
+        executor = _batch_executor()
+        futures = [executor.submit(owner, _batch_item, index, spec, context, owner) for index, spec in enumerate(specs)]
+        return Response(
+            _batch_lines(futures),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+    except Exception as e:
+        logger.exception("Unexpected error in generate_batch_api")
+        return jsonify({"success": False, "error": f"Unexpected error: {str(e)}"})
+
+
+def _run_job(spec, token, host_url):
+    context = RequestContext(
+        headers={'Authorization': f"Bearer {token}"},
+        host=urlparse(host_url).netloc,
+        host_url=host_url,
+    )
+    return generate(spec, context)
+
+
+def _public_job(job):
+    return {key: value for key, value in job.items() if key not in ('owner', 'host_url', 'version')}
+
+
+def submit_job_api(request):
+    """Queue a generation (same JSON as /generate) to run in the background.
+    Returns 202 with { success, job: { id, status, ... } }; poll /api/jobs/<id>
+    or subscribe to /api/jobs/<id>/events for the result.
+    """
+    try:
+        token = _get_request_token(request)
+        if not token:
+            return jsonify({"success": False, "error": "Authorization required"}), 401
+        if not request.is_json:
+            return jsonify({"success": False, "error": "Request must be JSON"})
+        data = request.get_json(silent=True) or {}
+        # reject bad parameters now rather than in a failed job
+        prepare_generation_request(data, request)
+        try:
+            job = _JOBS.submit(_owner_id_from_token(token), token, data, request.host_url)
+        except jobs.QueueFull as e:
+            return jsonify({"success": False, "error": str(e)}), 429
+        return jsonify({"success": True, "job": _public_job(job)}), 202
+    except ApiError as e:
+        return jsonify(e.body), e.status
+    except Exception as e:
+        logger.exception("Error submitting generation job")
+        return jsonify({"success": False, "error": f"Error submitting job: {str(e)}"})
+
+
+def _owned_job(request, job_id):
+    """Look up `job_id` for the caller, resuming it if a restart left it without a key."""
+    token = _get_request_token(request)
+    if not token:
+        raise ApiError({"success": False, "error": "Authorization required"}, 401)
+    owner_id = _owner_id_from_token(token)
+    _JOBS.attach_token(job_id, owner_id, token)
+    job = _JOBS.get(job_id, owner_id)
+    if job is None:
+        raise ApiError({"success": False, "error": "Job not found"}, 404)
+    return job
+
+
+def job_status_api(request, job_id):
+    try:
+        job = _owned_job(request, job_id)
+        return jsonify({"success": True, "job": _public_job(job)})
+    except ApiError as e:
+        return jsonify(e.body), e.status
+    except Exception as e:
+        logger.exception("Error loading generation job")
+        return jsonify({"success": False, "error": f"Error loading job: {str(e)}"})
+
+
+def _job_events(job_id, job):
+    yield sse_event('status', _public_job(job))
+    while job is not None and job['status'] not in jobs.FINISHED_STATES:
+        changed = _JOBS.wait_for_change(job_id, job.get('version'), timeout=15)
+        if changed is None:
+            return
+        if changed.get('version') == job.get('version'):
+            yield ": keep-alive\n\n"
+            continue
+        job = changed
+        yield sse_event('status', _public_job(job))
+    yield sse_event('done', _public_job(job))
+
+
+def job_events_api(request, job_id):
+    """Server-Sent Events for one job: a `status` event per state change, then `done`."""
+    try:
+        job = _owned_job(request, job_id)
+        return Response(
+            _job_events(job_id, job),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+    except ApiError as e:
+        return jsonify(e.body), e.status
+    except Exception as e:
+        logger.exception("Error subscribing to generation job")
+        return jsonify({"success": False, "error": f"Error loading job: {str(e)}"})
+
+
 def star_media_api(request):
     try:
         if not request.is_json:
@@ -978,14 +1867,7 @@ def star_media_api(request):
             except Exception:
                 return jsonify({"success": False, "error": "Invalid base64 payload"}), 400
 
-            ext_map = {
-                'image/png': 'png',
-                'image/jpeg': 'jpg',
-                'image/jpg': 'jpg',
-                'image/webp': 'webp',
-                'image/gif': 'gif',
-            }
-            ext = ext_map.get(mime, 'png')
+            ext = _IMAGE_EXTENSIONS.get(mime, 'png')
             saved_filename = f"{uuid.uuid4().hex}.{ext}"
             saved_path = os.path.join(owner_dir, saved_filename)
             with open(saved_path, 'wb') as f:
@@ -1002,18 +1884,24 @@ def star_media_api(request):
             else:
                 media_path = media_url
 
-            if not media_path.startswith('/static/generated_videos/'):
-                return jsonify({"success": False, "error": "Only generated videos can be saved from URL"}), 400
+            if media_path.startswith('/static/generated_videos/'):
+                source_dir = _GENERATED_VIDEOS_DIR
+                media_type = 'video'
+            elif media_path.startswith('/static/generated_images/'):
+                source_dir = _GENERATED_IMAGES_DIR
+                media_type = 'image'
+            else:
+                return jsonify({"success": False, "error": "Only generated media can be saved from URL"}), 400
 
-            source_path = os.path.join(os.path.dirname(__file__), media_path.lstrip('/'))
-            if not os.path.isfile(source_path):
+            # only the file name is taken from the URL so it cannot escape the media directory
+            source_path = os.path.join(source_dir, os.path.basename(media_path))
+            if not os.path.isfile(source_path) or source_path.endswith('.part'):
                 return jsonify({"success": False, "error": "Source media not found"}), 404
 
-            ext = os.path.splitext(source_path)[1] or '.mp4'
+            ext = os.path.splitext(source_path)[1] or ('.mp4' if media_type == 'video' else '.png')
             saved_filename = f"{uuid.uuid4().hex}{ext}"
             saved_path = os.path.join(owner_dir, saved_filename)
-            shutil.copy2(source_path, saved_path)
-            media_type = 'video'
+            _link_or_copy(source_path, saved_path)
 
         host_url = request.host_url.rstrip('/')
         public_path = f"/static/starred_media/{owner_id}/{saved_filename}"
@@ -1035,9 +1923,9 @@ def star_media_api(request):
         }
         item['_file_path'] = saved_path
 
-        items = _load_starred_items(owner_id)
-        items.append(item)
-        _save_starred_items(owner_id, items)
+        _STORAGE.add_starred(owner_id, item)
+        _SEARCH.add_starred(owner_id, item)
+        _COMPLETER.add_starred(owner_id, item['prompt'], item['created_at'])
 
         return jsonify({"success": True, "item": _strip_internal_fields(item)})
     except Exception as e:
@@ -1045,16 +1933,61 @@ def star_media_api(request):
         return jsonify({"success": False, "error": f"Error saving media: {str(e)}"})
 
 
+def _encode_starred_cursor(item):
+    position = json.dumps([item.get('created_at') or '', item.get('id') or ''], separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_starred_cursor(cursor):
+    """(created_at, id) from an opaque cursor; raises ValueError when it is malformed."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    if not (isinstance(position, list) and len(position) == 2 and all(isinstance(v, str) for v in position)):
+        raise ValueError("malformed cursor")
+    return position[0], position[1]
+
+
+def _starred_date_bound(value, upper):
+    """Stored-timestamp bound for a `from`/`to` query value; a bare date covers that whole day."""
+    day_only = len(value) == 10
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00') if not day_only else value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    if upper:
+        moment += timedelta(days=1) if day_only else timedelta(microseconds=1)
+    # stored times are normalised to the same format before comparing (see storage.normalize_timestamp)
+    return moment.strftime(storage.TIMESTAMP_FORMAT)
+
+
 def list_starred_api(request):
+    """List saved items newest first, a page at a time.
+    Query parameters: `limit` (default 50, at most 200), `cursor` (the previous page's
+    `next_cursor`), equality filters `type`, `model` and `style`, and a `from`/`to`
+    date range (ISO dates or times, both inclusive).
+    """
     try:
         token = _get_request_token(request)
         if not token:
             return jsonify({"success": False, "error": "Authorization required"}), 401
 
+        args = request.args
+        try:
+            limit = max(1, min(200, int(args.get('limit', 50))))
+            after = _decode_starred_cursor(args['cursor']) if args.get('cursor') else None
+            filters = {field: args[field] for field in storage.STARRED_FILTER_FIELDS if args.get(field)}
+            if args.get('from'):
+                filters['created_from'] = _starred_date_bound(args['from'], upper=False)
+            if args.get('to'):
+                filters['created_before'] = _starred_date_bound(args['to'], upper=True)
+        except (ValueError, TypeError):
+            return jsonify({"success": False, "error": "Invalid limit, cursor or date range"}), 400
+
         owner_id = _owner_id_from_token(token)
-        items = _load_starred_items(owner_id)
-        cleaned = [_strip_internal_fields(item) for item in items]
-        return jsonify({"success": True, "items": cleaned})
+        # one extra item tells whether another page follows
+        items, total = _STORAGE.page_starred(owner_id, limit + 1, after, filters)
+        next_cursor = _encode_starred_cursor(items[limit - 1]) if len(items) > limit else None
+        cleaned = [_strip_internal_fields(item) for item in items[:limit]]
+        return jsonify({"success": True, "items": cleaned, "total": total, "next_cursor": next_cursor})
     except Exception as e:
         logger.exception("Error listing starred media")
         return jsonify({"success": False, "error": f"Error loading saved media: {str(e)}"})
@@ -1075,19 +2008,12 @@ def unstar_media_api(request):
             return jsonify({"success": False, "error": "Missing item id"}), 400
 
         owner_id = _owner_id_from_token(token)
-        items = _load_starred_items(owner_id)
-        remaining = []
-        removed = None
-        for item in items:
-            if isinstance(item, dict) and item.get('id') == item_id:
-                removed = item
-            else:
-                remaining.append(item)
-
+        removed = _STORAGE.remove_starred(owner_id, item_id)
         if removed is None:
             return jsonify({"success": False, "error": "Item not found"}), 404
-
-        _save_starred_items(owner_id, remaining)
+        _SEARCH.remove_starred(owner_id, item_id)
+        if isinstance(removed, dict) and removed.get('prompt'):
+            _COMPLETER.remove_starred(owner_id, removed['prompt'])
 
         # best-effort file cleanup
         try:
@@ -1106,31 +2032,6 @@ def unstar_media_api(request):
         return jsonify({"success": False, "error": f"Error removing saved media: {str(e)}"})
 
 
-def _prompts_meta_path(owner_id):
-    return os.path.join(_PROMPTS_META_DIR, f"{owner_id}.json")
-
-
-def _load_prompts(owner_id):
-    try:
-        path = _prompts_meta_path(owner_id)
-        if not os.path.exists(path):
-            return []
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data if isinstance(data, list) else []
-    except Exception:
-        return []
-
-
-def _save_prompts(owner_id, prompts):
-    os.makedirs(_PROMPTS_META_DIR, exist_ok=True)
-    path = _prompts_meta_path(owner_id)
-    tmp_path = f"{path}.tmp"
-    with open(tmp_path, 'w', encoding='utf-8') as f:
-        json.dump(prompts, f, ensure_ascii=True, indent=2)
-    os.replace(tmp_path, path)
-
-
 def save_prompt_api(request):
     try:
         if not request.is_json:
@@ -1147,23 +2048,15 @@ def save_prompt_api(request):
             return jsonify({"success": False, "error": "Prompt text cannot be empty"}), 400
 
         owner_id = _owner_id_from_token(token)
-        prompts = _load_prompts(owner_id)
-
-        # Check if prompt already exists and remove it (to move to top)
-        prompts = [p for p in prompts if isinstance(p, dict) and p.get('text') != prompt_text]
-
-        # Add new prompt at the beginning
         new_prompt = {
             'id': uuid.uuid4().hex,
             'text': prompt_text,
             'created_at': datetime.utcnow().isoformat() + 'Z',
         }
-        prompts.insert(0, new_prompt)
-
-        # Keep only last 50 prompts
-        prompts = prompts[:50]
-
-        _save_prompts(owner_id, prompts)
+        # moves an existing prompt with the same text to the top; keeps the last 50
+        _STORAGE.save_prompt(owner_id, new_prompt)
+        _SEARCH.add_prompt(owner_id, new_prompt, storage.PROMPT_LIMIT)
+        _COMPLETER.add_saved(owner_id, prompt_text, new_prompt['created_at'], storage.PROMPT_LIMIT)
 
         return jsonify({"success": True, "prompt": new_prompt})
     except Exception as e:
@@ -1178,7 +2071,7 @@ def list_prompts_api(request):
             return jsonify({"success": False, "error": "Authorization required"}), 401
 
         owner_id = _owner_id_from_token(token)
-        prompts = _load_prompts(owner_id)
+        prompts = _STORAGE.list_prompts(owner_id)
         return jsonify({"success": True, "prompts": prompts})
     except Exception as e:
         logger.exception("Error listing prompts")
@@ -1201,16 +2094,10 @@ def delete_prompt_api(request):
             return jsonify({"success": False, "error": "Prompt text cannot be empty"}), 400
 
         owner_id = _owner_id_from_token(token)
-        prompts = _load_prompts(owner_id)
-
-        # Remove the prompt
-        initial_count = len(prompts)
-        prompts = [p for p in prompts if not (isinstance(p, dict) and p.get('text') == prompt_text)]
-
-        if len(prompts) == initial_count:
+        if not _STORAGE.delete_prompt(owner_id, prompt_text):
             return jsonify({"success": False, "error": "Prompt not found"}), 404
-
-        _save_prompts(owner_id, prompts)
+        _SEARCH.remove_prompt(owner_id, prompt_text)
+        _COMPLETER.remove_saved(owner_id, prompt_text)
 
         return jsonify({"success": True})
     except Exception as e:
@@ -1218,6 +2105,73 @@ def delete_prompt_api(request):
         return jsonify({"success": False, "error": f"Error deleting prompt: {str(e)}"}), 500
 
 
+def suggest_prompts_api(request):
+    """Autocomplete for the prompt box: the caller's saved and starred prompts starting with `q`,
+    ranked by frequency and recency. `limit` defaults to 8 (at most 20).
+    """
+    try:
+        token = _get_request_token(request)
+        if not token:
+            return jsonify({"success": False, "error": "Authorization required"}), 401
+        try:
+            limit = max(1, min(20, int(request.args.get('limit', 8))))
+        except ValueError:
+            return jsonify({"success": False, "error": "Invalid limit"}), 400
+        owner_id = _owner_id_from_token(token)
+        suggestions = _COMPLETER.complete(owner_id, request.args.get('q') or '', limit)
+        return jsonify({"success": True, "suggestions": suggestions})
+    except Exception as e:
+        logger.exception("Error suggesting prompts")
+        return jsonify({"success": False, "error": f"Error suggesting prompts: {str(e)}"}), 500
+
+
+def search_api(request):
+    """Ranked search over the caller's starred items and saved prompts.
+    Query parameters: `q`, `limit` (default 20, at most 100), `offset`, and `kind`
+    ('starred' or 'prompt') to search only one of them.
+    """
+    try:
+        token = _get_request_token(request)
+        if not token:
+            return jsonify({"success": False, "error": "Authorization required"}), 401
+
+        args = request.args
+        query = (args.get('q') or '').strip()
+        kind = args.get('kind') or None
+        try:
+            limit = max(1, min(100, int(args.get('limit', 20))))
+            offset = max(0, int(args.get('offset', 0)))
+        except ValueError:
+            return jsonify({"success": False, "error": "Invalid limit or offset"}), 400
+        if kind not in (None, search.STARRED, search.PROMPT):
+            return jsonify({"success": False, "error": "kind must be 'starred' or 'prompt'"}), 400
+        if not query:
+            return jsonify({"success": True, "results": [], "total": 0, "next_offset": None})
+
+        started = time.perf_counter()
+        owner_id = _owner_id_from_token(token)
+        page, total = _SEARCH.search(owner_id, query, limit=limit, offset=offset, kind=kind)
+        results = []
+        for result_kind, score, record in page:
+            result = {"kind": result_kind, "score": round(score, 4)}
+            if result_kind == search.STARRED:
+                result["item"] = _strip_internal_fields(record)
+            else:
+                result["prompt"] = record
+            results.append(result)
+        next_offset = offset + len(page) if offset + len(page) < total else None
+        return jsonify({
+            "success": True,
+            "results": results,
+            "total": total,
+            "next_offset": next_offset,
+            "took_ms": round(1000 * (time.perf_counter() - started), 2),
+        })
+    except Exception as e:
+        logger.exception("Error searching saved items")
+        return jsonify({"success": False, "error": f"Error searching: {str(e)}"}), 500
+
+
 def estimate_price_api(request):
     try:
         if not request.is_json:
@@ -1298,6 +2252,84 @@ def estimate_chat_price_api(request):
         return jsonify({"success": False, "error": f"Error estimating chat price: {str(e)}"})
 
 
+def _link_or_copy(source_path, dest_path):
+    """Hard-link a generated file into the starred media dir, copying when linking fails.
+    The link keeps the starred copy alive after the blob store expires the original.
+    """
+    try:
+        os.link(source_path, dest_path)
+    except OSError:
+        shutil.copy2(source_path, dest_path)
+
+
+def metrics_api(request):
+    """Report cache and upstream-protection counters for monitoring."""
+    try:
+        return jsonify({
+            "success": True,
+            "metrics": {
+                "generation_cache": _GENERATION_CACHE.stats(),
+                "caches": cache.stats(),
+                "shared_cache": cache.backend_stats(),
+                "single_flight": singleflight.stats(),
+                "circuit_breakers": upstream.breaker_stats(),
+                "upstream_concurrency": upstream.limiter_stats(),
+                "jobs": _JOBS.stats(),
+                "model_catalogs": {
+                    'image': _IMAGE_CATALOG.stats(),
+                    'text': _TEXT_CATALOG.stats(),
+                    'chat': _CHAT_CATALOG.stats(),
+                },
+                "admission": admission.stats(),
+                "batch_pool": _BATCH_EXECUTOR.stats() if _BATCH_EXECUTOR is not None else None,
+                "search": _SEARCH.stats(),
+                "autocomplete": _COMPLETER.stats(),
+                "storage": _STORAGE.stats(),
+            },
+        })
+    except Exception as e:
+        logger.exception("Error collecting metrics")
+        return jsonify({"success": False, "error": f"Error collecting metrics: {str(e)}"}), 500
+
+
+def cleanup_image_blobs(dirpath, max_age_seconds=None, max_bytes=None):
+    """Expire generated images older than the blob TTL, then remove the oldest
+    until the directory fits the size cap. Best-effort, no exceptions leaked.
+    """
+    try:
+        if max_age_seconds is None:
+            max_age_seconds = MEDIA_CONFIG.get('IMAGE_BLOB_TTL', 86400)
+        if max_bytes is None:
+            max_bytes = MEDIA_CONFIG.get('IMAGE_BLOB_MAX_BYTES')
+        cutoff = time.time() - max_age_seconds
+        remaining = []
+        for fname in os.listdir(dirpath):
+            fpath = os.path.join(dirpath, fname)
+            try:
+                if not os.path.isfile(fpath):
+                    continue
+                stat = os.stat(fpath)
+                if stat.st_mtime < cutoff:
+                    os.remove(fpath)
+                else:
+                    remaining.append((stat.st_mtime, stat.st_size, fpath))
+            except Exception:
+                continue
+        if not max_bytes:
+            return
+        total = sum(size for _, size, _ in remaining)
+        for _, size, fpath in sorted(remaining):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(fpath)
+                total -= size
+            except Exception:
+                continue
+    except Exception:
+        pass
+
+
 def cleanup_old_videos(dirpath, max_age_days=7):
     """Remove files in `dirpath` older than `max_age_days`. Best-effort, no exceptions leaked."""
     try:
@@ -0,0 +1,357 @@
+"""Background generation jobs backed by a small on-disk queue.
+
+A job is one /generate request body run by a worker pool instead of inside the
+HTTP request, so a long video generation survives the browser connection
+dropping. Each job is a JSON file under the jobs directory; state changes are
+written atomically, so queued and finished jobs survive a restart (jobs that
+were running are queued again).
+
+Several worker processes can share the directory. A job is looked up on disk
+when this process did not submit or run it, and a worker claims a job with
+an exclusive lock file (<id>.lock) before running it, so it runs only once.
+The claiming process touches the lock while the job runs; a lock left
+untouched for STALE_LOCK_SECONDS belonged to a process that died, and its
+job is queued again.
+
+API keys are never written to disk. The key a job runs with is kept in memory
+only; after a restart a waiting job is resumed when its owner polls it again
+with the same key (see attach_token()).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED_STATES = {SUCCEEDED, FAILED}
+
+HEARTBEAT_SECONDS = 30
+STALE_LOCK_SECONDS = 3 * HEARTBEAT_SECONDS
+# seconds between disk checks while waiting on a job another process runs
+POLL_SECONDS = 1.0
+# finished jobs past their retention are removed at most this often
+PRUNE_INTERVAL = 60
+
+
+class QueueFull(Exception):
+    """The owner already has the maximum number of unfinished jobs."""
+
+
+class JobQueue:
+    def __init__(self, directory, runner, workers=2, max_pending_per_owner=5, retention_seconds=86400):
+        """`runner(spec, token, host_url)` performs one job and returns (body, status)."""
+        self.directory = directory
+        self.runner = runner
+        self.workers = workers
+        self.max_pending_per_owner = max_pending_per_owner
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._jobs = None  # id -> job dict, loaded from disk on first use
+        self._tokens = {}  # id -> API key, memory only
+        self._claimed = set()  # ids this process holds the lock file of
+        self._pending = None  # job ids waiting for a worker thread; created on first use
+        self._heartbeat = None
+        self._last_prune = 0
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _lock_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.lock")
+
+    def _save(self, job):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(job['id'])}.{uuid.uuid4().hex}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, self._path(job['id']))
+
+    def _read(self, job_id):
+        """The job as stored on disk, or None if there is no (readable) file."""
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return job if isinstance(job, dict) and job.get('id') == job_id else None
+
+    def _lock_is_stale(self, job_id):
+        try:
+            return time.time() - os.path.getmtime(self._lock_path(job_id)) > STALE_LOCK_SECONDS
+        except OSError:
+            return True
+
+    def _claim(self, job_id):
+        """Take the job's lock file; returns False if another live process holds it."""
+        path = self._lock_path(job_id)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._lock_is_stale(job_id):
+                    return False
+                # left by a process that died; remove it and try once more
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            self._claimed.add(job_id)
+            self._start_heartbeat()
+            return True
+        return False
+
+    def _unclaim(self, job_id):
+        self._claimed.discard(job_id)
+        try:
+            os.remove(self._lock_path(job_id))
+        except OSError:
+            pass
+
+    def _start_heartbeat(self):
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._touch_claims, name='generation-job-heartbeat', daemon=True)
+            self._heartbeat.start()
+
+    def _touch_claims(self):
+        """Keep this process's lock files fresh so other processes do not take them over."""
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self._lock:
+                claimed = list(self._claimed)
+            for job_id in claimed:
+                try:
+                    os.utime(self._lock_path(job_id))
+                except OSError:
+                    pass
+
+    def _expired(self, job, cutoff):
+        return job.get('status') in FINISHED_STATES and (job.get('finished_at') or 0) < cutoff
+
+    def _remove(self, job_id):
+        self._jobs.pop(job_id, None)
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+    def _prune(self):
+        """Drop finished jobs past their retention (call with the lock held)."""
+        self._last_prune = time.time()
+        cutoff = self._last_prune - self.retention_seconds
+        for job_id, job in list(self._jobs.items()):
+            if self._expired(job, cutoff):
+                self._remove(job_id)
+
+    def _load(self):
+        """Read every job from disk once; requeue jobs a dead process left running.
+        Later calls prune expired jobs every PRUNE_INTERVAL seconds.
+        """
+        if self._jobs is not None:
+            if time.time() - self._last_prune >= PRUNE_INTERVAL:
+                self._prune()
+            return
+        self._jobs = {}
+        self._last_prune = time.time()
+        if not os.path.isdir(self.directory):
+            return
+        cutoff = self._last_prune - self.retention_seconds
+        for fname in os.listdir(self.directory):
+            if not fname.endswith('.json'):
+                continue
+            job = self._read(fname[:-len('.json')])
+            if job is None:
+                logger.warning("Skipping unreadable job file %s", fname)
+                continue
+            if self._expired(job, cutoff):
+                self._remove(job['id'])
+                continue
+            self._requeue_if_orphaned(job)
+            self._jobs[job['id']] = job
+
+    def _requeue_if_orphaned(self, job):
+        """Queue a running job again if no live process holds its lock; returns whether it did."""
+        if job.get('status') != RUNNING or job['id'] in self._claimed or not self._lock_is_stale(job['id']):
+            return False
+        job['status'] = QUEUED
+        job['started_at'] = None
+        job['version'] = job.get('version', 0) + 1
+        self._save(job)
+        return True
+
+    def _current(self, job_id):
+        """The job as this process should see it (call with the lock held).
+        Jobs this process runs, and finished jobs, are served from memory; any
+        other job is read again from disk, so jobs submitted or run by other
+        worker processes are found and their progress shows.
+        """
+        job = self._jobs.get(job_id)
+        if job is not None and (job_id in self._claimed or job['status'] in FINISHED_STATES):
+            return job
+        stored = self._read(job_id)
+        if stored is None:
+            if not os.path.exists(self._path(job_id)):
+                self._jobs.pop(job_id, None)
+                return None
+            return job
+        # a process that died mid-run (or exited before its lock went stale) leaves it running
+        self._requeue_if_orphaned(stored)
+        self._jobs[job_id] = stored
+        return stored
+
+    def _submit(self, job_id):
+        if self._pending is None:
+            self._pending = queue.Queue()
+            # daemon threads, so a generation in flight does not hold up interpreter exit;
+            # the jobs they were running are handed back at exit (see _release_claims())
+            for number in range(max(1, self.workers)):
+                threading.Thread(target=self._work, name=f'generation-job-{number}', daemon=True).start()
+            atexit.register(self._release_claims)
+        self._pending.put(job_id)
+
+    def _work(self):
+        while True:
+            job_id = self._pending.get()
+            try:
+                self._run(job_id)
+            except Exception:
+                logger.exception("Generation job worker failed on %s", job_id)
+
+    def _release_claims(self):
+        """Queue the jobs this process is still running again, so a restart resumes them at once."""
+        with self._lock:
+            for job_id in list(self._claimed):
+                job = self._jobs.get(job_id)
+                try:
+                    if job is not None and job['status'] == RUNNING:
+                        self._update(job, status=QUEUED, started_at=None)
+                except OSError:
+                    logger.warning("Could not requeue generation job %s at exit", job_id)
+                self._unclaim(job_id)
+
+    def _update(self, job, **fields):
+        job.update(fields)
+        job['version'] = job.get('version', 0) + 1
+        self._save(job)
+        self._changed.notify_all()
+
+    def submit(self, owner, token, spec, host_url):
+        """Queue `spec` for `owner`; returns the new job. Raises QueueFull."""
+        with self._lock:
+            self._load()
+            pending = sum(
+                1 for job in self._jobs.values()
+                if job['owner'] == owner and job['status'] not in FINISHED_STATES
+            )
+            if pending >= self.max_pending_per_owner:
+                raise QueueFull(f"You already have {pending} unfinished jobs")
+            job = {
+                'id': uuid.uuid4().hex,
+                'owner': owner,
+                'spec': spec,
+                'host_url': host_url,
+                'status': QUEUED,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'result_status': None,
+                'version': 0,
+            }
+            self._save(job)
+            self._jobs[job['id']] = job
+            self._tokens[job['id']] = token
+            self._submit(job['id'])
+            return dict(job)
+
+    def _run(self, job_id):
+        with self._lock:
+            token = self._tokens.get(job_id)
+            if token is None or not self._claim(job_id):
+                self._tokens.pop(job_id, None)
+                return
+            # with the lock file held nobody else changes the job; check it is still waiting
+            job = self._read(job_id)
+            if job is None or job['status'] != QUEUED:
+                self._unclaim(job_id)
+                self._tokens.pop(job_id, None)
+                if job is not None:
+                    self._jobs[job_id] = job
+                return
+            self._jobs[job_id] = job
+            self._update(job, status=RUNNING, started_at=time.time())
+            spec, host_url = job['spec'], job['host_url']
+        try:
+            body, status = self.runner(spec, token, host_url)
+        except Exception as e:
+            logger.exception("Generation job %s failed", job_id)
+            body, status = {"success": False, "error": f"Unexpected error: {str(e)}"}, 200
+        with self._lock:
+            self._tokens.pop(job_id, None)
+            if job_id not in self._claimed:
+                return  # handed back by _release_claims() at exit; another process may own it now
+            state = SUCCEEDED if isinstance(body, dict) and body.get('success') else FAILED
+            try:
+                self._update(job, status=state, finished_at=time.time(), result=body, result_status=status)
+            finally:
+                self._unclaim(job_id)
+
+    def get(self, job_id, owner):
+        """Return a copy of the job if it exists and belongs to `owner`, else None."""
+        with self._lock:
+            self._load()
+            job = self._current(job_id)
+            if job is None or job['owner'] != owner:
+                return None
+            return dict(job)
+
+    def attach_token(self, job_id, owner, token):
+        """Resume a queued job left without its key by a restart, using its owner's key.
+        Several processes may do this for one job; only the one that claims it runs it.
+        """
+        with self._lock:
+            self._load()
+            job = self._current(job_id)
+            if job is None or job['owner'] != owner or job['status'] != QUEUED or job_id in self._tokens:
+                return
+            self._tokens[job_id] = token
+            self._submit(job_id)
+
+    def wait_for_change(self, job_id, version, timeout):
+        """Block until the job's version differs from `version` (or `timeout`); returns a copy."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._load()
+            while True:
+                job = self._current(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job.get('version') != version or remaining <= 0:
+                    break
+                # a job run by another process changes on disk without waking us
+                self._changed.wait(min(remaining, POLL_SECONDS))
+            return dict(job) if job is not None else None
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            counts['waiting_for_key'] = sum(
+                1 for job_id, job in self._jobs.items()
+                if job['status'] == QUEUED and job_id not in self._tokens
+            )
+            counts['claimed'] = len(self._claimed)
+            return counts
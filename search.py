@@ -0,0 +1,230 @@
+"""In-memory full-text search over an owner's starred items and saved prompts.
+
+Each owner gets an inverted index (term -> {document: term frequency}) built
+from storage on their first search, then kept current by the star, unstar and
+prompt views (add_starred(), remove_starred(), add_prompt(), remove_prompt()).
+Starred items are indexed on prompt, style, model and type; saved prompts on
+their text. Results are ranked with BM25; the last query term also matches as
+a prefix, so results appear while a word is still being typed.
+
+Indexes of owners not searched recently are evicted (LRU, MAX_OWNERS), and an
+index older than REBUILD_AFTER seconds is rebuilt from storage so changes made
+by other worker processes show up.
+"""
+import bisect
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from config import SEARCH_CONFIG
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+STARRED = 'starred'
+PROMPT = 'prompt'
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def _starred_text(item):
+    return ' '.join(str(item.get(field) or '') for field in ('prompt', 'style', 'model', 'type'))
+
+
+class _OwnerIndex:
+    def __init__(self):
+        self.built_at = time.monotonic()
+        # (kind, id) -> (record, term counts, token count)
+        self.docs = {}
+        self.postings = {}
+        self.total_length = 0
+        self._terms = None  # sorted vocabulary for prefix lookups, rebuilt lazily
+
+    def add(self, kind, doc_id, record, text):
+        key = (kind, doc_id)
+        self.remove(key)
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self.docs[key] = (record, counts, length)
+        self.total_length += length
+        for term, tf in counts.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                self._terms = None
+            postings[key] = tf
+
+    def remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return None
+        record, counts, length = doc
+        self.total_length -= length
+        for term in counts:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[term]
+                self._terms = None
+        return record
+
+    def prompts(self):
+        return [(key, doc[0]) for key, doc in self.docs.items() if key[0] == PROMPT]
+
+    def terms_with_prefix(self, prefix):
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        start = bisect.bisect_left(self._terms, prefix)
+        matches = []
+        for term in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, terms, kind=None):
+        """[(score, created_at, key)] for documents containing every term (the last one as a prefix)."""
+        n_docs = len(self.docs)
+        if not n_docs or not terms:
+            return []
+        avg_length = self.total_length / n_docs or 1.0
+        scores = None
+        for position, term in enumerate(terms):
+            if position == len(terms) - 1:
+                expansions = self.terms_with_prefix(term)
+            else:
+                expansions = [term] if term in self.postings else []
+            term_scores = {}
+            for expansion in expansions:
+                postings = self.postings[expansion]
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                # a completion counts for the share of the word already typed,
+                # so "cat" ranks documents with "cat" above ones with "catalog"
+                weight = idf if expansion == term else idf * len(term) / len(expansion)
+                for key, tf in postings.items():
+                    length = self.docs[key][2]
+                    score = weight * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * length / avg_length))
+                    term_scores[key] = max(term_scores.get(key, 0.0), score)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: scores[key] + value for key, value in term_scores.items() if key in scores}
+            if not scores:
+                return []
+        results = []
+        for key, score in scores.items():
+            if kind is not None and key[0] != kind:
+                continue
+            results.append((score, self.docs[key][0].get('created_at') or '', key))
+        return results
+
+
+class SearchIndex:
+    def __init__(self, load, config=None):
+        """`load(owner_id)` returns (starred items, saved prompts) from storage."""
+        self._load = load
+        self.config = config if config is not None else SEARCH_CONFIG
+        self._lock = threading.Lock()
+        self._owners = OrderedDict()
+        self.builds = 0
+        self.queries = 0
+        self.evictions = 0
+        self._query_seconds = 0.0
+
+    def _build(self, owner_id):
+        starred, prompts = self._load(owner_id)
+        index = _OwnerIndex()
+        for item in starred:
+            if isinstance(item, dict) and item.get('id'):
+                index.add(STARRED, item['id'], item, _starred_text(item))
+        for prompt in prompts:
+            if isinstance(prompt, dict) and prompt.get('id'):
+                index.add(PROMPT, prompt['id'], prompt, prompt.get('text'))
+        self.builds += 1
+        return index
+
+    def _index(self, owner_id):
+        """The owner's index, built (or rebuilt when too old) as needed; call with the lock held."""
+        index = self._owners.get(owner_id)
+        if index is not None and time.monotonic() - index.built_at < self.config.get('REBUILD_AFTER', 300):
+            self._owners.move_to_end(owner_id)
+            return index
+        index = self._build(owner_id)
+        self._owners[owner_id] = index
+        self._owners.move_to_end(owner_id)
+        while len(self._owners) > self.config.get('MAX_OWNERS', 1000):
+            self._owners.popitem(last=False)
+            self.evictions += 1
+        return index
+
+    def _loaded(self, owner_id):
+        """The owner's index if it is in memory; owners without one are indexed on their next search."""
+        return self._owners.get(owner_id)
+
+    def add_starred(self, owner_id, item):
+        with self._lock:
+            index = self._loaded(owner_id)
+            if index is not None:
+                index.add(STARRED, item['id'], item, _starred_text(item))
+
+    def remove_starred(self, owner_id, item_id):
+        with self._lock:
+            index = self._loaded(owner_id)
+            if index is not None:
+                index.remove((STARRED, item_id))
+
+    def add_prompt(self, owner_id, prompt, limit):
+        """Index a saved prompt, mirroring storage: same text replaced, only the newest `limit` kept."""
+        with self._lock:
+            index = self._loaded(owner_id)
+            if index is None:
+                return
+            for key, record in index.prompts():
+                if record.get('text') == prompt['text']:
+                    index.remove(key)
+            index.add(PROMPT, prompt['id'], prompt, prompt['text'])
+            prompts = sorted(index.prompts(), key=lambda entry: entry[1].get('created_at') or '', reverse=True)
+            for key, _ in prompts[limit:]:
+                index.remove(key)
+
+    def remove_prompt(self, owner_id, text):
+        with self._lock:
+            index = self._loaded(owner_id)
+            if index is None:
+                return
+            for key, record in index.prompts():
+                if record.get('text') == text:
+                    index.remove(key)
+
+    def search(self, owner_id, query, limit=20, offset=0, kind=None):
+        """Ranked ([(kind, score, record)], total) for `query`, best first, newest first on ties."""
+        started = time.perf_counter()
+        terms = tokenize(query)
+        with self._lock:
+            index = self._index(owner_id)
+            results = index.search(terms, kind)
+            results.sort(key=lambda result: (result[0], result[1]), reverse=True)
+            page = [(key[0], score, index.docs[key][0]) for score, _, key in results[offset:offset + limit]]
+            self.queries += 1
+            self._query_seconds += time.perf_counter() - started
+        return page, len(results)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'owners': len(self._owners),
+                'documents': sum(len(index.docs) for index in self._owners.values()),
+                'builds': self.builds,
+                'queries': self.queries,
+                'evictions': self.evictions,
+                'avg_query_ms': round(1000 * self._query_seconds / self.queries, 3) if self.queries else None,
+            }
@@ -0,0 +1,99 @@
+"""Single-flight coalescing of identical in-flight work.
+
+While a call for a key is running, further calls with the same key wait for
+it and receive the same result (or exception) instead of repeating the
+upstream request. Keys are released as soon as the call finishes, so this
+never serves stale data; caching is a separate concern.
+"""
+import asyncio
+import threading
+
+# every group by name, for metrics
+_GROUPS = {}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.executed = 0
+        self.merged = 0
+        _GROUPS[name] = self
+
+    def do(self, key, fn):
+        """Run `fn()` once per concurrent `key`; returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.merged += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key, coro_fn):
+        """Async counterpart of do(): awaits `coro_fn()` once per concurrent `key`."""
+        with self._lock:
+            future = self._async_calls.get(key)
+            leader = future is None
+            if leader:
+                future = asyncio.get_running_loop().create_future()
+                self._async_calls[key] = future
+                self.executed += 1
+            else:
+                self.merged += 1
+        if not leader:
+            return await asyncio.shield(future), True
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark retrieved so an unshared failure is not logged as never awaited
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._async_calls.pop(key, None)
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'merged': self.merged,
+                'in_flight': len(self._calls) + len(self._async_calls),
+            }
+
+
+def stats():
+    return {name: group.stats() for name, group in _GROUPS.items()}
@@ -340,6 +340,56 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  // Read a text/event-stream response body, calling onEvent(name, data) per event
+  async function readEventStream(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    const dispatch = (frame) => {
+      let event = "message";
+      const dataLines = [];
+      frame.split("\n").forEach((line) => {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+      });
+      if (!dataLines.length) return;
+      try {
+        onEvent(event, JSON.parse(dataLines.join("\n")));
+      } catch (err) {
+        console.debug("Ignoring malformed stream event", err);
+      }
+    };
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let idx;
+      while ((idx = buffer.indexOf("\n\n")) !== -1) {
+        dispatch(buffer.slice(0, idx));
+        buffer = buffer.slice(idx + 2);
+      }
+    }
+    if (buffer.trim()) dispatch(buffer);
+  }
+
+  function showReplyPricing(p) {
+    if (!p) return;
+    let friendly = null;
+    if (p.estimate_text) {
+      friendly = p.estimate_text.replace(/^\s*Estimated:\s*/i, "");
+    } else if (
+      typeof p.estimated_total !== "undefined" &&
+      p.estimated_total !== null
+    ) {
+      friendly = `${formatSporeValue(p.estimated_total)} ${
+        p.currency || "pollen"
+      }`.trim();
+    }
+    if (friendly) {
+      estimateEl.textContent = `Cost estimate: ${friendly}`;
+    }
+  }
+
   form.addEventListener("submit", async (e) => {
     e.preventDefault();
     const text = input.value.trim();
@@ -352,6 +402,7 @@ document.addEventListener("DOMContentLoaded", () => {
       model: modelEl.value,
       temperature: parseFloat(tempEl.value),
       max_tokens: parseInt(maxEl.value, 10),
+      stream: true,
     };
 
     appendMessage("assistant", "…");
@@ -371,33 +422,41 @@ document.addEventListener("DOMContentLoaded", () => {
         body: JSON.stringify(payload),
       });
 
+      const bubble = placeholder.querySelector("div");
+      const contentType = res.headers.get("Content-Type") || "";
+      if (contentType.includes("text/event-stream") && res.body) {
+        // Streamed reply: render tokens as they arrive
+        let reply = "";
+        let finished = false;
+        await readEventStream(res, (event, data) => {
+          if (event === "delta") {
+            reply += data.text || "";
+            bubble.innerHTML = renderAssistantText(reply);
+            windowEl.scrollTop = windowEl.scrollHeight;
+          } else if (event === "done") {
+            finished = true;
+            if (!reply) bubble.textContent = "No response returned.";
+            showReplyPricing(data.pricing);
+          } else if (event === "error") {
+            finished = true;
+            bubble.textContent = `Error: ${data.error || "Unknown error"}`;
+          }
+        });
+        if (!finished && !reply) {
+          bubble.textContent = "Error: The response ended unexpectedly.";
+        }
+        return;
+      }
+
       // If upstream returned non-200 and Flask forwarded it, handle accordingly
       const data = await res.json();
       if (!data.success) {
-        placeholder.querySelector("div").textContent = `Error: ${
-          data.error || "Unknown error"
-        }`;
+        bubble.textContent = `Error: ${data.error || "Unknown error"}`;
       } else {
-        placeholder.querySelector("div").innerHTML = renderAssistantText(
+        bubble.innerHTML = renderAssistantText(
           data.reply || "No response returned.",
         );
-        if (data.pricing) {
-          const p = data.pricing;
-          let friendly = null;
-          if (p.estimate_text) {
-            friendly = p.estimate_text.replace(/^\s*Estimated:\s*/i, "");
-          } else if (
-            typeof p.estimated_total !== "undefined" &&
-            p.estimated_total !== null
-          ) {
-            friendly = `${formatSporeValue(p.estimated_total)} ${
-              p.currency || "pollen"
-            }`.trim();
-          }
-          if (friendly) {
-            estimateEl.textContent = `Cost estimate: ${friendly}`;
-          }
-        }
+        showReplyPricing(data.pricing);
       }
     } catch (err) {
       console.error(err);
@@ -33,18 +33,151 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
-  async function loadGallery() {
-    const key = getUserApiKey();
-    if (!key) {
-      statusEl.textContent =
-        "Add your Pollinations API key in AI Settings to view your saved items.";
-      statusEl.className =
-        "text-sm text-amber-700 bg-amber-50 border border-amber-200 rounded-lg p-4 mb-4";
+  const PAGE_SIZE = 24;
+  // server-side filters can be passed through the page URL, e.g. /gallery?type=video
+  const FILTER_PARAMS = ["type", "model", "style", "from", "to"];
+  let nextCursor = null;
+  let loading = false;
+  let loadedCount = 0;
+  let sentinel = null;
+  let observer = null;
+
+  function renderItem(item) {
+    // Store item for modal access
+    galleryItemsMap[item.id] = item;
+
+    const card = document.createElement("div");
+    card.className =
+      "bg-white rounded-lg shadow-lg overflow-hidden flex flex-col gap-3";
+
+    // Media container with zoom button overlay
+    const mediaContainer = document.createElement("div");
+    mediaContainer.className = "relative";
+
+    let mediaElement;
+    if (item.type === "video") {
+      mediaElement = document.createElement("video");
+      mediaElement.src = item.url;
+      mediaElement.className = "w-full";
+      mediaElement.controls = true;
+    } else {
+      mediaElement = document.createElement("img");
+      mediaElement.src = item.url;
+      mediaElement.alt = "Saved image";
+      mediaElement.className =
+        "w-full cursor-pointer hover:opacity-90 transition-opacity";
+      // Make image clickable
+      mediaElement.addEventListener("click", (e) => {
+        e.preventDefault();
+        openGalleryItemModal(item.id);
+      });
+    }
+
+    mediaContainer.appendChild(mediaElement);
+
+    // Zoom button overlay (only for images)
+    if (item.type === "image") {
+      const zoomBtn = document.createElement("button");
+      zoomBtn.type = "button";
+      zoomBtn.className =
+        "absolute top-4 right-4 bg-black/50 hover:bg-black/70 text-white p-2 rounded-lg transition-colors";
+      zoomBtn.setAttribute("aria-label", "View image in full size");
+      zoomBtn.innerHTML = `
+        <svg class="w-6 h-6" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+          <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M21 21l-6-6m2-5a7 7 0 11-14 0 7 7 0 0114 0zM10 7v6m4-3H6" />
+        </svg>
+      `;
+      zoomBtn.addEventListener("click", (e) => {
+        e.preventDefault();
+        openGalleryItemModal(item.id);
+      });
+      mediaContainer.appendChild(zoomBtn);
+    }
+
+    card.appendChild(mediaContainer);
+
+    // Card content
+    const content = document.createElement("div");
+    content.className = "p-3 flex flex-col gap-3";
+
+    const promptText = escapeHtml(item.prompt || "");
+    const metaBits = [
+      item.model ? `Model: ${escapeHtml(item.model)}` : null,
+      item.size ? `Size: ${escapeHtml(item.size)}` : null,
+      item.quality ? `Quality: ${escapeHtml(item.quality)}` : null,
+      item.created_at ? `Saved: ${formatDate(item.created_at)}` : null,
+    ].filter(Boolean);
+
+    content.innerHTML = `
+      <div>
+        <div class="text-sm text-gray-700 font-semibold mb-1">Prompt</div>
+        <div class="text-sm text-gray-600 whitespace-pre-wrap">${promptText}</div>
+      </div>
+      <div class="text-xs text-gray-500">${metaBits.join(" • ")}</div>
+    `;
+
+    card.appendChild(content);
+    gridEl.appendChild(card);
+  }
+
+  function pageUrl(cursor) {
+    const params = new URLSearchParams();
+    params.set("limit", String(PAGE_SIZE));
+    if (cursor) params.set("cursor", cursor);
+    const pageParams = new URLSearchParams(window.location.search);
+    FILTER_PARAMS.forEach((name) => {
+      const value = pageParams.get(name);
+      if (value) params.set(name, value);
+    });
+    return `/api/starred?${params.toString()}`;
+  }
+
+  function stopPaging() {
+    if (observer) observer.disconnect();
+    if (sentinel) sentinel.remove();
+    observer = null;
+    sentinel = null;
+  }
+
+  function watchForMore() {
+    if (!nextCursor) {
+      stopPaging();
       return;
     }
+    if (!sentinel) {
+      sentinel = document.createElement("div");
+      sentinel.className = "h-8";
+      sentinel.setAttribute("aria-hidden", "true");
+      gridEl.after(sentinel);
+    }
+    if (!observer && "IntersectionObserver" in window) {
+      // start loading the next page a little before the user reaches the end
+      observer = new IntersectionObserver(
+        (entries) => {
+          if (entries.some((entry) => entry.isIntersecting)) loadPage();
+        },
+        { rootMargin: "600px" },
+      );
+    }
+    if (observer) {
+      // observing again reports the current state, so a sentinel that is still
+      // in view after a short page loads the next one too
+      observer.unobserve(sentinel);
+      observer.observe(sentinel);
+    } else {
+      loadPage();
+    }
+  }
+
+  async function loadPage() {
+    const key = getUserApiKey();
+    if (loading || !key) return;
+    const firstPage = loadedCount === 0;
+    if (!firstPage && !nextCursor) return;
+    loading = true;
 
     try {
-      const res = await fetch("/api/starred", {
+      const res = await fetch(pageUrl(firstPage ? null : nextCursor), {
         method: "GET",
         headers: {
           Authorization: `Bearer ${key}`,
@@ -56,10 +189,12 @@ document.addEventListener("DOMContentLoaded", () => {
       }
 
       const items = Array.isArray(data.items) ? data.items : [];
-      gridEl.innerHTML = "";
-      galleryItemsMap = {};
+      if (firstPage) {
+        gridEl.innerHTML = "";
+        galleryItemsMap = {};
+      }
 
-      if (!items.length) {
+      if (firstPage && !items.length) {
         statusEl.textContent =
           "No saved items yet. Star something from the image page.";
         statusEl.className =
@@ -67,92 +202,35 @@ document.addEventListener("DOMContentLoaded", () => {
         return;
       }
 
-      statusEl.textContent = `Saved items: ${items.length}`;
+      items.forEach(renderItem);
+      loadedCount += items.length;
+      nextCursor = data.next_cursor || null;
+
+      const total = typeof data.total === "number" ? data.total : loadedCount;
+      statusEl.textContent = `Saved items: ${total}`;
       statusEl.className =
         "text-sm text-gray-700 bg-white border rounded-lg p-4 mb-4";
-
-      items.reverse().forEach((item) => {
-        // Store item for modal access
-        galleryItemsMap[item.id] = item;
-
-        const card = document.createElement("div");
-        card.className =
-          "bg-white rounded-lg shadow-lg overflow-hidden flex flex-col gap-3";
-
-        // Media container with zoom button overlay
-        const mediaContainer = document.createElement("div");
-        mediaContainer.className = "relative";
-
-        let mediaElement;
-        if (item.type === "video") {
-          mediaElement = document.createElement("video");
-          mediaElement.src = item.url;
-          mediaElement.className = "w-full";
-          mediaElement.controls = true;
-        } else {
-          mediaElement = document.createElement("img");
-          mediaElement.src = item.url;
-          mediaElement.alt = "Saved image";
-          mediaElement.className =
-            "w-full cursor-pointer hover:opacity-90 transition-opacity";
-          // Make image clickable
-          mediaElement.addEventListener("click", (e) => {
-            e.preventDefault();
-            openGalleryItemModal(item.id);
-          });
-        }
-
-        mediaContainer.appendChild(mediaElement);
-
-        // Zoom button overlay (only for images)
-        if (item.type === "image") {
-          const zoomBtn = document.createElement("button");
-          zoomBtn.type = "button";
-          zoomBtn.className =
-            "absolute top-4 right-4 bg-black/50 hover:bg-black/70 text-white p-2 rounded-lg transition-colors";
-          zoomBtn.setAttribute("aria-label", "View image in full size");
-          zoomBtn.innerHTML = `
-            <svg class="w-6 h-6" fill="none" stroke="currentColor" viewBox="0 0 24 24">
-              <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M21 21l-6-6m2-5a7 7 0 11-14 0 7 7 0 0114 0zM10 7v6m4-3H6" />
-            </svg>
-          `;
-          zoomBtn.addEventListener("click", (e) => {
-            e.preventDefault();
-            openGalleryItemModal(item.id);
-          });
-          mediaContainer.appendChild(zoomBtn);
-        }
-
-        card.appendChild(mediaContainer);
-
-        // Card content
-        const content = document.createElement("div");
-        content.className = "p-3 flex flex-col gap-3";
-
-        const promptText = escapeHtml(item.prompt || "");
-        const metaBits = [
-          item.model ? `Model: ${escapeHtml(item.model)}` : null,
-          item.size ? `Size: ${escapeHtml(item.size)}` : null,
-          item.quality ? `Quality: ${escapeHtml(item.quality)}` : null,
-          item.created_at ? `Saved: ${formatDate(item.created_at)}` : null,
-        ].filter(Boolean);
-
-        content.innerHTML = `
-          <div>
-            <div class="text-sm text-gray-700 font-semibold mb-1">Prompt</div>
-            <div class="text-sm text-gray-600 whitespace-pre-wrap">${promptText}</div>
-          </div>
-          <div class="text-xs text-gray-500">${metaBits.join(" • ")}</div>
-        `;
-
-        card.appendChild(content);
-        gridEl.appendChild(card);
-      });
     } catch (err) {
+      nextCursor = null;
       statusEl.textContent = err.message || "Failed to load saved items";
       statusEl.className =
         "text-sm text-red-700 bg-red-50 border border-red-200 rounded-lg p-4 mb-4";
+    } finally {
+      loading = false;
+      watchForMore();
+    }
+  }
+
+  function loadGallery() {
+    const key = getUserApiKey();
+    if (!key) {
+      statusEl.textContent =
+        "Add your Pollinations API key in AI Settings to view your saved items.";
+      statusEl.className =
+        "text-sm text-amber-700 bg-amber-50 border border-amber-200 rounded-lg p-4 mb-4";
+      return;
     }
+    loadPage();
   }
 
   loadGallery();
@@ -364,6 +364,7 @@ document.addEventListener("DOMContentLoaded", () => {
     updateHistoryDisplay();
   });
   checkAndUpdateApiKeyStatus();
+  setupPromptSuggestions();
 
   // Set up warning button to open settings
   const openSettingsBtn = document.getElementById("openSettingsFromWarning");
@@ -378,6 +379,132 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 });
 
+/**
+ * Autocomplete for the prompt box from the user's saved and starred prompts.
+ * Suggestions are fetched (debounced) while typing; arrow keys move through
+ * them, Enter or Tab picks one and Escape closes the list.
+ */
+function setupPromptSuggestions() {
+  const promptEl = document.getElementById("prompt");
+  const listEl = document.getElementById("prompt-suggestions");
+  if (!promptEl || !listEl) return;
+
+  let suggestions = [];
+  let active = -1;
+  let timer = null;
+  let requestSeq = 0;
+
+  function close() {
+    suggestions = [];
+    active = -1;
+    listEl.innerHTML = "";
+    listEl.classList.add("hidden");
+    promptEl.setAttribute("aria-expanded", "false");
+    promptEl.removeAttribute("aria-activedescendant");
+  }
+
+  function highlight(index) {
+    active = index;
+    Array.from(listEl.children).forEach((option, i) => {
+      const selected = i === active;
+      option.setAttribute("aria-selected", selected.toString());
+      option.classList.toggle("bg-blue-100", selected);
+      if (selected) option.scrollIntoView({ block: "nearest" });
+    });
+    if (active >= 0) {
+      promptEl.setAttribute("aria-activedescendant", `prompt-suggestion-${active}`);
+    } else {
+      promptEl.removeAttribute("aria-activedescendant");
+    }
+  }
+
+  function pick(index) {
+    const suggestion = suggestions[index];
+    if (!suggestion) return;
+    promptEl.value = suggestion.text;
+    close();
+    promptEl.focus();
+  }
+
+  function render() {
+    listEl.innerHTML = "";
+    if (!suggestions.length) {
+      close();
+      return;
+    }
+    suggestions.forEach((suggestion, index) => {
+      const option = document.createElement("li");
+      option.id = `prompt-suggestion-${index}`;
+      option.setAttribute("role", "option");
+      option.setAttribute("aria-selected", "false");
+      option.className = "px-3 py-2 cursor-pointer hover:bg-gray-100 truncate";
+      option.textContent = suggestion.text;
+      // mousedown keeps focus in the textarea
+      option.addEventListener("mousedown", (e) => {
+        e.preventDefault();
+        pick(index);
+      });
+      listEl.appendChild(option);
+    });
+    active = -1;
+    listEl.classList.remove("hidden");
+    promptEl.setAttribute("aria-expanded", "true");
+  }
+
+  async function fetchSuggestions(query) {
+    const key = getUserApiKey();
+    if (!key || !query.trim()) {
+      close();
+      return;
+    }
+    const seq = ++requestSeq;
+    try {
+      const params = new URLSearchParams({ q: query, limit: "8" });
+      const res = await fetch(`/api/prompts/suggest?${params.toString()}`, {
+        headers: { Authorization: `Bearer ${key}` },
+      });
+      const data = await res.json();
+      // ignore responses that arrive after a newer request was sent
+      if (seq !== requestSeq) return;
+      suggestions =
+        data.success && Array.isArray(data.suggestions)
+          ? data.suggestions.filter((s) => s.text !== query)
+          : [];
+      render();
+    } catch (e) {
+      if (seq === requestSeq) close();
+    }
+  }
+
+  promptEl.addEventListener("input", () => {
+    clearTimeout(timer);
+    timer = setTimeout(() => fetchSuggestions(promptEl.value), 150);
+  });
+
+  promptEl.addEventListener("keydown", (e) => {
+    if (!suggestions.length) return;
+    if (e.key === "ArrowDown") {
+      e.preventDefault();
+      highlight((active + 1) % suggestions.length);
+    } else if (e.key === "ArrowUp") {
+      e.preventDefault();
+      highlight(active <= 0 ? suggestions.length - 1 : active - 1);
+    } else if ((e.key === "Enter" || e.key === "Tab") && active >= 0) {
+      e.preventDefault();
+      pick(active);
+    } else if (e.key === "Escape") {
+      e.preventDefault();
+      close();
+    }
+  });
+
+  promptEl.addEventListener("blur", () => {
+    clearTimeout(timer);
+    requestSeq++;
+    close();
+  });
+}
+
 /**
  * Toggles the visibility of the prompt history panel
  * Updates ARIA states and chevron rotation
@@ -541,6 +668,7 @@ async function fetchModels() {
         items.forEach((it) => {
           const opt = document.createElement("option");
           opt.value = it.name;
+          if (it.isVideo) opt.dataset.video = "1";
           const value = getPricingValue(it.pricing);
           const glyph = priceGlyphFromValue(value);
           let text = it.label || it.name;
@@ -1016,15 +1144,22 @@ async function generateImage() {
 
     const headers = { "Content-Type": "application/json" };
     if (userKey) headers["Authorization"] = `Bearer ${userKey}`;
-    const response = await fetch("/generate", {
-      method: "POST",
-      headers,
-      body: JSON.stringify(requestBody),
-    });
-
-    const data = await response.json();
-    console.debug &&
-      console.debug("Generation response:", { status: response.status, data });
+    const modelSelect = document.getElementById("model");
+    const selectedOption = modelSelect && modelSelect.selectedOptions[0];
+    let data;
+    if (selectedOption && selectedOption.dataset.video) {
+      // Videos run as background jobs so a dropped connection does not lose the result
+      data = await runGenerationJob(requestBody, headers);
+    } else {
+      const response = await fetch("/generate", {
+        method: "POST",
+        headers,
+        body: JSON.stringify(requestBody),
+      });
+      data = await response.json();
+      console.debug &&
+        console.debug("Generation response:", { status: response.status, data });
+    }
 
     if (!data.success) {
       throw new Error(data.error || "Failed to generate media");
@@ -1091,6 +1226,62 @@ async function generateImage() {
   }
 }
 
+// polling for /api/jobs results: interval and the longest a generation is waited for
+const JOB_POLL_INTERVAL_MS = 3000;
+const JOB_MAX_WAIT_MS = 15 * 60 * 1000;
+
+/**
+ * Submits a generation as a background job and polls until it finishes
+ * @param {Object} requestBody - Same body as POST /generate
+ * @param {Object} headers - Request headers (including Authorization)
+ * @returns {Promise<Object>} The job's /generate-style result
+ */
+async function runGenerationJob(requestBody, headers) {
+  const submitRes = await fetch("/api/jobs", {
+    method: "POST",
+    headers,
+    body: JSON.stringify(requestBody),
+  });
+  const submitted = await submitRes.json();
+  if (!submitted.success) return submitted;
+
+  const jobId = submitted.job.id;
+  const deadline = Date.now() + JOB_MAX_WAIT_MS;
+  while (Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    let job;
+    try {
+      const res = await fetch(`/api/jobs/${encodeURIComponent(jobId)}`, {
+        headers: { Authorization: headers["Authorization"] },
+      });
+      if (res.status === 404) {
+        return {
+          success: false,
+          error: "The generation job is no longer available. Please try again.",
+        };
+      }
+      const body = await res.json();
+      if (!body.success) {
+        // server-side hiccup: the job keeps running, so keep polling
+        if (res.status >= 500) continue;
+        return body;
+      }
+      job = body.job;
+    } catch (e) {
+      // transient network error: the job keeps running on the server, so keep polling
+      console.debug && console.debug("Job poll failed, retrying", e);
+      continue;
+    }
+    if (job.status === "succeeded" || job.status === "failed") {
+      return job.result || { success: false, error: "Generation failed" };
+    }
+  }
+  return {
+    success: false,
+    error: "Timed out waiting for the generation to finish. Please try again later.",
+  };
+}
+
 /**
  * Saves the last generated media to the private gallery
  * @returns {Promise<void>}
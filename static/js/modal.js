@@ -80,13 +80,21 @@ async function downloadImage() {
     "";
   const sanitizedPrompt = sanitizeFilename(prompt);
   const timestamp = new Date().toISOString().slice(0, 19).replace(/[:T]/g, "-");
-  const filename = sanitizedPrompt
-    ? `ai-image-${sanitizedPrompt}-${timestamp}.png`
-    : `ai-generated-image-${timestamp}.png`;
 
   try {
     const response = await fetch(imageUrl);
     const blob = await response.blob();
+    // Images may arrive as PNG, JPEG or WebP; name the file after the real type
+    const extensions = {
+      "image/jpeg": "jpg",
+      "image/webp": "webp",
+      "image/gif": "gif",
+      "image/avif": "avif",
+    };
+    const ext = extensions[blob.type] || "png";
+    const filename = sanitizedPrompt
+      ? `ai-image-${sanitizedPrompt}-${timestamp}.${ext}`
+      : `ai-generated-image-${timestamp}.${ext}`;
     const url = window.URL.createObjectURL(blob);
     const a = document.createElement("a");
     a.href = url;
@@ -0,0 +1,637 @@
+"""Storage engines for starred media and saved prompts.
+
+Both engines keep the same per-owner records: starred items (oldest first)
+and saved prompts (newest first, unique by text, at most `limit` kept).
+Starred items can also be read a page at a time, newest first, with keyset
+pagination on (created_at, id) and optional filters.
+
+JsonStorage is the original layout, one JSON file per owner under
+data/starred and data/prompts, cached in memory with per-owner locks and
+rewritten behind the requests, a batch of changes at a time. SQLiteStorage keeps
+one row per record in a WAL-mode database indexed on owner, id and created
+time, so a star, unstar or prompt save touches a single row and concurrent
+writers do not overwrite each other.
+
+Existing JSON files are copied into the database once with:
+
+    python storage.py migrate [--db PATH] [--starred-dir DIR] [--prompts-dir DIR]
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import signal
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from config import STORAGE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STARRED_DIR = os.path.join(_BASE_DIR, 'data', 'starred')
+DEFAULT_PROMPTS_DIR = os.path.join(_BASE_DIR, 'data', 'prompts')
+
+PROMPT_LIMIT = 50
+# the one format created_at values are compared and ordered in (naive UTC)
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# item fields page_starred() filters on by equality
+STARRED_FILTER_FIELDS = ('type', 'model', 'style')
+
+
+class Storage:
+    """Interface shared by the storage engines."""
+
+    name = None
+
+    def list_starred(self, owner_id):
+        """All starred items of `owner_id`, oldest first."""
+        raise NotImplementedError
+
+    def add_starred(self, owner_id, item):
+        raise NotImplementedError
+
+    def remove_starred(self, owner_id, item_id):
+        """Delete one starred item; returns it, or None if it did not exist."""
+        raise NotImplementedError
+
+    def page_starred(self, owner_id, limit, after=None, filters=None):
+        """One page of starred items, newest first; returns (items, total).
+
+        `after` is the (created_at, id) of the last item of the previous page.
+        `filters` may hold equality filters on STARRED_FILTER_FIELDS plus
+        'created_from' (inclusive) and 'created_before' (exclusive) ISO bounds.
+        `total` counts every item matching the filters.
+        """
+        filters = filters or {}
+        matching = [
+            item for item in self.list_starred(owner_id)
+            if isinstance(item, dict) and _matches(item, filters)
+        ]
+        matching.sort(key=_position, reverse=True)
+        if after is not None:
+            after = (normalize_timestamp(after[0]), after[1])
+            matching_after = [item for item in matching if _position(item) < after]
+        else:
+            matching_after = matching
+        return matching_after[:limit], len(matching)
+
+    def list_prompts(self, owner_id):
+        """Saved prompts of `owner_id`, newest first."""
+        raise NotImplementedError
+
+    def save_prompt(self, owner_id, prompt, limit=PROMPT_LIMIT):
+        """Put `prompt` first, replacing one with the same text, and keep the newest `limit`."""
+        raise NotImplementedError
+
+    def delete_prompt(self, owner_id, text):
+        """Delete the prompt with `text`; returns whether one existed."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Write out any changes not yet on disk; returns how many files were written."""
+        return 0
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+def normalize_timestamp(value):
+    """An ISO time as TIMESTAMP_FORMAT, so times compare correctly as strings.
+    Stored created_at values carry a 'Z' and drop the fraction when it is zero.
+    """
+    if not value:
+        return ''
+    if len(value) == 27 and value[19] == '.' and value.endswith('Z'):
+        return value[:26]
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return value
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+def _position(item):
+    return (normalize_timestamp(item.get('created_at')), item.get('id') or '')
+
+
+def _matches(item, filters):
+    for field in STARRED_FILTER_FIELDS:
+        if filters.get(field) is not None and item.get(field) != filters[field]:
+            return False
+    created_at = normalize_timestamp(item.get('created_at'))
+    if filters.get('created_from') and created_at < filters['created_from']:
+        return False
+    if filters.get('created_before') and created_at >= filters['created_before']:
+        return False
+    return True
+
+
+class _OwnerFile:
+    """In-memory copy of one owner's JSON file."""
+
+    __slots__ = ('lock', 'records', 'stat', 'dirty', 'pending')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = None  # loaded on first use
+        self.stat = None  # (mtime_ns, size) of the file when last read or written
+        self.dirty = False
+        self.pending = 0  # mutations not yet on disk
+
+
+class JsonStorage(Storage):
+    """One JSON file per owner, cached in memory and written behind.
+
+    Each owner's records are read once and then served from memory; every
+    mutation holds that owner's lock, so concurrent changes for one owner
+    cannot lose each other's updates. Changed files are rewritten (temp file,
+    fsync, atomic replace) by a background flusher every `flush_interval`
+    seconds, so a burst of mutations costs one write. Pending changes are
+    flushed at interpreter exit. A flush_interval of 0 writes synchronously
+    on every change.
+
+    A clean cached file is re-read when its mtime or size changes on disk, so
+    writes from other worker processes show up; concurrent writers in several
+    processes still overwrite each other, use SQLiteStorage for that.
+    """
+
+    name = 'json'
+
+    def __init__(self, starred_dir=DEFAULT_STARRED_DIR, prompts_dir=DEFAULT_PROMPTS_DIR, flush_interval=None,
+                 max_owners=None):
+        self.starred_dir = starred_dir
+        self.prompts_dir = prompts_dir
+        self.flush_interval = (
+            flush_interval if flush_interval is not None else STORAGE_CONFIG.get('FLUSH_INTERVAL', 1.0)
+        )
+        self.max_owners = max_owners if max_owners is not None else STORAGE_CONFIG.get('MAX_OWNERS', 1000)
+        self._files_lock = threading.Lock()
+        # (directory, owner) -> _OwnerFile, least recently used first
+        self._files = OrderedDict()
+        self._flusher = None
+        self._wake = threading.Event()
+        self.mutations = 0
+        self.writes = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.flush_errors = 0
+        self._last_flush_ms = None
+        if self.flush_interval > 0:
+            self._flush_on_sigterm()
+
+    @staticmethod
+    def _path(directory, owner_id):
+        return os.path.join(directory, f"{owner_id}.json")
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _read(directory, owner_id):
+        try:
+            path = JsonStorage._path(directory, owner_id)
+            if not os.path.exists(path):
+                return []
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, list) else []
+        except Exception:
+            return []
+
+    @staticmethod
+    def _write(directory, owner_id, records):
+        os.makedirs(directory, exist_ok=True)
+        path = JsonStorage._path(directory, owner_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=True, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _file(self, directory, owner_id):
+        """The owner's cached file, loaded (or reloaded if changed on disk and clean); returns it locked."""
+        key = (directory, owner_id)
+        while True:
+            with self._files_lock:
+                entry = self._files.get(key)
+                if entry is None:
+                    entry = self._files[key] = _OwnerFile()
+                self._files.move_to_end(key)
+                self._evict(keep=key)
+            entry.lock.acquire()
+            if self._files.get(key) is entry:
+                break
+            # evicted before we got the lock; changes to it would never be flushed
+            entry.lock.release()
+        try:
+            if not entry.dirty:
+                stat = self._stat(self._path(directory, owner_id))
+                if entry.records is None or stat != entry.stat:
+                    if entry.records is not None:
+                        self.reloads += 1
+                    entry.records = self._read(directory, owner_id)
+                    entry.stat = stat
+        except BaseException:
+            entry.lock.release()
+            raise
+        return entry
+
+    def _evict(self, keep):
+        """Drop least recently used clean files (other than `keep`) beyond max_owners; call with _files_lock held."""
+        excess = len(self._files) - self.max_owners
+        if excess <= 0:
+            return
+        for key in list(self._files):
+            if excess <= 0:
+                break
+            if key == keep:
+                continue
+            entry = self._files[key]
+            # a file being read or changed, or with unflushed changes, stays
+            if not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                if entry.dirty:
+                    continue
+                del self._files[key]
+            finally:
+                entry.lock.release()
+            self.evictions += 1
+            excess -= 1
+
+    def _changed(self, directory, owner_id, entry):
+        """Record a mutation of `entry` (locked by the caller) and schedule or perform its write."""
+        entry.dirty = True
+        entry.pending += 1
+        self.mutations += 1
+        if self.flush_interval <= 0:
+            self._flush_locked(directory, owner_id, entry)
+        else:
+            self._start_flusher()
+
+    def _flush_locked(self, directory, owner_id, entry):
+        try:
+            self._write(directory, owner_id, entry.records)
+        except Exception:
+            self.flush_errors += 1
+            logger.exception("Failed to write %s", self._path(directory, owner_id))
+            return False
+        entry.stat = self._stat(self._path(directory, owner_id))
+        entry.dirty = False
+        entry.pending = 0
+        self.writes += 1
+        return True
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._files_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='json-storage-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _flush_on_sigterm(self):
+        """Flush before a SIGTERM ends the process. Python's default action skips atexit;
+        servers that install their own handler (gunicorn, uvicorn) exit normally and are left alone.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        try:
+            if signal.getsignal(signal.SIGTERM) is not signal.SIG_DFL:
+                return
+        except (AttributeError, ValueError):
+            return
+
+        def handle(signum, frame):
+            try:
+                self.flush()
+            finally:
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+
+        signal.signal(signal.SIGTERM, handle)
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("JSON storage flush failed")
+
+    def flush(self):
+        """Write every file with pending changes; returns the number written."""
+        started = time.perf_counter()
+        with self._files_lock:
+            pending = [(key, entry) for key, entry in self._files.items() if entry.dirty]
+        written = 0
+        for (directory, owner_id), entry in pending:
+            with entry.lock:
+                if entry.dirty and self._flush_locked(directory, owner_id, entry):
+                    written += 1
+        if pending:
+            self._last_flush_ms = round(1000 * (time.perf_counter() - started), 3)
+        return written
+
+    def list_starred(self, owner_id):
+        entry = self._file(self.starred_dir, owner_id)
+        try:
+            return list(entry.records)
+        finally:
+            entry.lock.release()
+
+    def add_starred(self, owner_id, item):
+        entry = self._file(self.starred_dir, owner_id)
+        try:
+            entry.records.append(item)
+            self._changed(self.starred_dir, owner_id, entry)
+        finally:
+            entry.lock.release()
+
+    def remove_starred(self, owner_id, item_id):
+        entry = self._file(self.starred_dir, owner_id)
+        try:
+            for position, item in enumerate(entry.records):
+                if isinstance(item, dict) and item.get('id') == item_id:
+                    del entry.records[position]
+                    self._changed(self.starred_dir, owner_id, entry)
+                    return item
+            return None
+        finally:
+            entry.lock.release()
+
+    def list_prompts(self, owner_id):
+        entry = self._file(self.prompts_dir, owner_id)
+        try:
+            return list(entry.records)
+        finally:
+            entry.lock.release()
+
+    def save_prompt(self, owner_id, prompt, limit=PROMPT_LIMIT):
+        entry = self._file(self.prompts_dir, owner_id)
+        try:
+            prompts = [p for p in entry.records if isinstance(p, dict) and p.get('text') != prompt['text']]
+            prompts.insert(0, prompt)
+            entry.records = prompts[:limit]
+            self._changed(self.prompts_dir, owner_id, entry)
+        finally:
+            entry.lock.release()
+
+    def delete_prompt(self, owner_id, text):
+        entry = self._file(self.prompts_dir, owner_id)
+        try:
+            remaining = [p for p in entry.records if not (isinstance(p, dict) and p.get('text') == text)]
+            if len(remaining) == len(entry.records):
+                return False
+            entry.records = remaining
+            self._changed(self.prompts_dir, owner_id, entry)
+            return True
+        finally:
+            entry.lock.release()
+
+    def stats(self):
+        with self._files_lock:
+            entries = list(self._files.values())
+        dirty = [entry for entry in entries if entry.dirty]
+        return {
+            'backend': self.name,
+            'cached_files': len(entries),
+            'dirty_files': len(dirty),
+            'pending_mutations': sum(entry.pending for entry in dirty),
+            'mutations': self.mutations,
+            'writes': self.writes,
+            'coalesced': max(0, self.mutations - self.writes - sum(entry.pending for entry in dirty)),
+            'flush_errors': self.flush_errors,
+            'last_flush_ms': self._last_flush_ms,
+            'reloads': self.reloads,
+            'evictions': self.evictions,
+            'flush_interval': self.flush_interval,
+        }
+
+
+_SCHEMA = (
+    # starred.created_at is kept in TIMESTAMP_FORMAT for ordering and filtering; the item has the original
+    'CREATE TABLE IF NOT EXISTS starred ('
+    ' owner TEXT NOT NULL, id TEXT NOT NULL, created_at TEXT NOT NULL, item TEXT NOT NULL,'
+    ' PRIMARY KEY (owner, id))',
+    'DROP INDEX IF EXISTS starred_owner_created',
+    'CREATE INDEX IF NOT EXISTS starred_owner_created_id ON starred (owner, created_at, id)',
+    'CREATE TABLE IF NOT EXISTS prompts ('
+    ' owner TEXT NOT NULL, id TEXT NOT NULL, text TEXT NOT NULL, created_at TEXT NOT NULL,'
+    ' PRIMARY KEY (owner, id))',
+    'CREATE INDEX IF NOT EXISTS prompts_owner_created ON prompts (owner, created_at)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS prompts_owner_text ON prompts (owner, text)',
+)
+
+
+class SQLiteStorage(Storage):
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._timestamps_checked = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # autocommit; writes that touch several rows open their own transaction
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            if not self._timestamps_checked:
+                self._normalize_timestamps(conn)
+                self._timestamps_checked = True
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _normalize_timestamps(conn):
+        """Rewrite starred.created_at values stored before they were kept in TIMESTAMP_FORMAT."""
+        rows = conn.execute(
+            "SELECT rowid, created_at FROM starred WHERE length(created_at) != 26 OR created_at LIKE '%Z'"
+        ).fetchall()
+        if not rows:
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'UPDATE starred SET created_at = ? WHERE rowid = ?',
+                [(normalize_timestamp(created_at), rowid) for rowid, created_at in rows],
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def list_starred(self, owner_id):
+        rows = self._connection().execute(
+            'SELECT item FROM starred WHERE owner = ? ORDER BY created_at, rowid', (owner_id,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add_starred(self, owner_id, item):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO starred (owner, id, created_at, item) VALUES (?, ?, ?, ?)',
+            (owner_id, item['id'], normalize_timestamp(item.get('created_at')), json.dumps(item, ensure_ascii=True)),
+        )
+
+    def remove_starred(self, owner_id, item_id):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT item FROM starred WHERE owner = ? AND id = ?', (owner_id, item_id)
+            ).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM starred WHERE owner = ? AND id = ?', (owner_id, item_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return json.loads(row[0]) if row is not None else None
+
+    def page_starred(self, owner_id, limit, after=None, filters=None):
+        filters = filters or {}
+        where = ['owner = ?']
+        params = [owner_id]
+        for field in STARRED_FILTER_FIELDS:
+            if filters.get(field) is not None:
+                where.append(f"json_extract(item, '$.{field}') = ?")
+                params.append(filters[field])
+        if filters.get('created_from'):
+            where.append('created_at >= ?')
+            params.append(filters['created_from'])
+        if filters.get('created_before'):
+            where.append('created_at < ?')
+            params.append(filters['created_before'])
+        conn = self._connection()
+        total = conn.execute(f"SELECT COUNT(*) FROM starred WHERE {' AND '.join(where)}", params).fetchone()[0]
+        if after is not None:
+            where.append('(created_at, id) < (?, ?)')
+            params.extend((normalize_timestamp(after[0]), after[1]))
+        rows = conn.execute(
+            f"SELECT item FROM starred WHERE {' AND '.join(where)} ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + [limit],
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows], total
+
+    def list_prompts(self, owner_id):
+        rows = self._connection().execute(
+            'SELECT id, text, created_at FROM prompts WHERE owner = ? ORDER BY created_at DESC, rowid DESC',
+            (owner_id,),
+        ).fetchall()
+        return [{'id': row[0], 'text': row[1], 'created_at': row[2]} for row in rows]
+
+    def save_prompt(self, owner_id, prompt, limit=PROMPT_LIMIT):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM prompts WHERE owner = ? AND text = ?', (owner_id, prompt['text']))
+            conn.execute(
+                'INSERT INTO prompts (owner, id, text, created_at) VALUES (?, ?, ?, ?)',
+                (owner_id, prompt['id'], prompt['text'], prompt.get('created_at') or ''),
+            )
+            conn.execute(
+                'DELETE FROM prompts WHERE owner = ? AND rowid NOT IN ('
+                ' SELECT rowid FROM prompts WHERE owner = ? ORDER BY created_at DESC, rowid DESC LIMIT ?)',
+                (owner_id, owner_id, limit),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete_prompt(self, owner_id, text):
+        cursor = self._connection().execute(
+            'DELETE FROM prompts WHERE owner = ? AND text = ?', (owner_id, text)
+        )
+        return cursor.rowcount > 0
+
+
+def create_storage(config=None):
+    """The storage engine selected by STORAGE_CONFIG['BACKEND'] ('json' or 'sqlite')."""
+    config = config if config is not None else STORAGE_CONFIG
+    kind = (config.get('BACKEND') or 'json').lower()
+    if kind == 'sqlite':
+        return SQLiteStorage(config['PATH'])
+    if kind != 'json':
+        logger.warning("Unknown STORAGE_BACKEND %r, using json", kind)
+    return JsonStorage()
+
+
+def migrate(source, target):
+    """Copy every owner's records from `source` (a JsonStorage) into `target`.
+    Records already present in the target are kept, so running it twice is harmless.
+    Returns (starred items, prompts) copied.
+    """
+    conn = target._connection()
+    starred = prompts = 0
+    for directory, kind in ((source.starred_dir, 'starred'), (source.prompts_dir, 'prompts')):
+        if not os.path.isdir(directory):
+            continue
+        for fname in sorted(os.listdir(directory)):
+            if not fname.endswith('.json'):
+                continue
+            owner_id = fname[:-len('.json')]
+            records = source._read(directory, owner_id)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for record in records:
+                    if not isinstance(record, dict) or not record.get('id'):
+                        continue
+                    if kind == 'starred':
+                        cursor = conn.execute(
+                            'INSERT OR IGNORE INTO starred (owner, id, created_at, item) VALUES (?, ?, ?, ?)',
+                            (owner_id, record['id'], normalize_timestamp(record.get('created_at')),
+                             json.dumps(record, ensure_ascii=True)),
+                        )
+                        starred += cursor.rowcount
+                    elif record.get('text'):
+                        cursor = conn.execute(
+                            'INSERT OR IGNORE INTO prompts (owner, id, text, created_at) VALUES (?, ?, ?, ?)',
+                            (owner_id, record['id'], record['text'], record.get('created_at') or ''),
+                        )
+                        prompts += cursor.rowcount
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    return starred, prompts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = commands.add_parser('migrate', help='copy data/starred and data/prompts into the SQLite database')
+    migrate_parser.add_argument('--db', default=STORAGE_CONFIG['PATH'], help='SQLite database (default: %(default)s)')
+    migrate_parser.add_argument('--starred-dir', default=DEFAULT_STARRED_DIR)
+    migrate_parser.add_argument('--prompts-dir', default=DEFAULT_PROMPTS_DIR)
+    args = parser.parse_args(argv)
+
+    starred, prompts = migrate(JsonStorage(args.starred_dir, args.prompts_dir), SQLiteStorage(args.db))
+    print(f"Copied {starred} starred items and {prompts} prompts into {args.db}")
+    print("Set STORAGE_BACKEND=sqlite to use it.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+"""Shared HTTP client for calls to the Pollinations API.
+
+Every upstream request from generators.py goes through this module so that
+connections are pooled and kept alive per host instead of paying a fresh
+TCP+TLS handshake on each call.
+
+Calls also pass through a small resilience policy: idempotent GETs are retried
+with jittered backoff (honoring Retry-After) on connection failures and, for
+endpoints in RETRY['STATUS_RETRY_ENDPOINTS'], on retryable statuses; endpoints
+that bill per call (image, video, enhance) only retry when the request never
+reached upstream or a 429 says when to come back. Each named endpoint has a
+circuit breaker that fails fast with UpstreamUnavailable while upstream is
+unhealthy, and an adaptive limit on concurrent calls sheds load (Overloaded)
+when upstream latency or errors climb.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import Timeout, ConnectTimeout, ConnectionError, RequestException
+from urllib3.exceptions import NewConnectionError
+
+from config import API_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# one pooled session per upstream host: { "https://gen.pollinations.ai": Session }
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+# shared asyncio client for the async entry point (asgi.py); created on first use
+_ASYNC_CLIENT = None
+# circuit breaker per endpoint name: { "image": CircuitBreaker }
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+_IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class UpstreamUnavailable(RequestException):
+    """Upstream is not being called right now; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ConnectFailed(ConnectionError):
+    """The connection to upstream could not be established (async client), so nothing was sent."""
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+class Overloaded(UpstreamUnavailable):
+    """Raised instead of calling upstream while the adaptive concurrency limit is reached."""
+
+
+class AdaptiveLimiter:
+    """AIMD limit on concurrent upstream calls across all endpoints.
+
+    Each call that finishes quickly and successfully while the limit is in use
+    adds about one slot per `limit` calls; a call that is slower than its
+    endpoint's latency target, or fails, cuts the limit by BACKOFF (at most once
+    per DECREASE_INTERVAL). A slot covers one attempt up to the upstream
+    response headers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        settings = API_CONFIG.get('CONCURRENCY_LIMIT') or {}
+        self.limit = float(settings.get('INITIAL', 32))
+        self.in_flight = 0
+        self.rejected = 0
+        self.decreases = 0
+        self._last_decrease = 0
+
+    def acquire(self):
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                retry_after = (API_CONFIG.get('CONCURRENCY_LIMIT') or {}).get('RETRY_AFTER', 2)
+                raise Overloaded("Too many upstream requests in flight", retry_after=retry_after)
+            self.in_flight += 1
+
+    def release(self, endpoint, latency, healthy):
+        """Free a slot; `healthy=None` frees it without adjusting the limit."""
+        settings = API_CONFIG.get('CONCURRENCY_LIMIT') or {}
+        with self._lock:
+            self.in_flight -= 1
+            if healthy is None:
+                return
+            targets = settings.get('LATENCY_TARGETS') or {}
+            target = targets[endpoint] if endpoint in targets else timeout_for(endpoint)
+            if healthy and (target is None or latency <= target):
+                # only grow while the limit is actually being used
+                if self.in_flight + 1 >= self.limit / 2:
+                    self.limit = min(settings.get('MAX', 256), self.limit + 1 / self.limit)
+                return
+            now = time.monotonic()
+            if now - self._last_decrease >= settings.get('DECREASE_INTERVAL', 1.0):
+                self._last_decrease = now
+                self.decreases += 1
+                self.limit = max(settings.get('MIN', 4), self.limit * settings.get('BACKOFF', 0.75))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'rejected': self.rejected,
+                'decreases': self.decreases,
+            }
+
+
+_LIMITER = AdaptiveLimiter()
+
+
+def limiter_stats():
+    return _LIMITER.stats()
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one upstream endpoint.
+
+    closed: calls pass; FAILURE_THRESHOLD failures in a row open the circuit.
+    open: calls fail fast with CircuitOpen until RESET_TIMEOUT (or a longer
+    upstream Retry-After) has passed.
+    half_open: a single trial call is let through; its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.open_until = 0
+        self._trial_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+        self.retries = 0
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may be made now."""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            now = time.monotonic()
+            if self.state == 'open' and now >= self.open_until:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+            retry_after = max(1.0, self.open_until - now)
+        raise CircuitOpen(f"Upstream '{self.name}' is unavailable (circuit open)", retry_after=retry_after)
+
+    def record(self, healthy, retry_after=None):
+        """Record a call outcome; `healthy=None` only releases the half-open trial slot."""
+        settings = API_CONFIG.get('CIRCUIT_BREAKER') or {}
+        with self._lock:
+            self._trial_in_flight = False
+            if healthy is None:
+                return
+            if healthy:
+                self.failures = 0
+                self.state = 'closed'
+                return
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= settings.get('FAILURE_THRESHOLD', 5):
+                if self.state != 'open':
+                    self.times_opened += 1
+                    logger.warning("Circuit for upstream '%s' opened after %s failures", self.name, self.failures)
+                self.state = 'open'
+                reset = max(settings.get('RESET_TIMEOUT', 30), retry_after or 0)
+                self.open_until = time.monotonic() + reset
+
+    def note_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            state = self.state
+            if state == 'open' and now >= self.open_until:
+                state = 'half_open'
+            return {
+                'state': state,
+                'consecutive_failures': self.failures,
+                'retry_after': round(self.open_until - now, 1) if state == 'open' else None,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+                'retries': self.retries,
+            }
+
+
+def breaker_for(endpoint):
+    breaker = _BREAKERS.get(endpoint)
+    if breaker is None:
+        with _BREAKERS_LOCK:
+            breaker = _BREAKERS.setdefault(endpoint, CircuitBreaker(endpoint))
+    return breaker
+
+
+def breaker_stats():
+    return {name: breaker.stats() for name, breaker in sorted(_BREAKERS.items())}
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def _retry_delay(method, attempt, retry_after=None):
+    """Seconds to wait before retrying after try number `attempt`, or None to give up."""
+    policy = API_CONFIG.get('RETRY') or {}
+    if method.upper() not in _IDEMPOTENT_METHODS or attempt >= policy.get('MAX_ATTEMPTS', 1):
+        return None
+    cap = min(policy.get('BACKOFF_MAX', 8), policy.get('BACKOFF_BASE', 0.5) * 2 ** (attempt - 1))
+    delay = random.uniform(0, cap)
+    if retry_after is not None:
+        if retry_after > policy.get('MAX_RETRY_AFTER', 10):
+            return None
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _after_response(breaker, method, attempt, response, latency):
+    """Record `response` on the breaker and limiter; returns the delay before a retry, or None to return it."""
+    status = response.status_code
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    failure_statuses = (API_CONFIG.get('CIRCUIT_BREAKER') or {}).get('FAILURE_STATUSES', ())
+    breaker.record(status not in failure_statuses, retry_after)
+    _LIMITER.release(breaker.name, latency, status != 429 and status not in failure_statuses)
+    policy = API_CONFIG.get('RETRY') or {}
+    if breaker.name in policy.get('STATUS_RETRY_ENDPOINTS', ()):
+        retryable = status in policy.get('STATUSES', ())
+    else:
+        # a 502/504 may come from a gateway after upstream started (and billed) the work;
+        # only a 429 with Retry-After says the request was turned away
+        retryable = status == 429 and retry_after is not None
+    if not retryable:
+        return None
+    return _retry_delay(method, attempt, retry_after)
+
+
+def _never_sent(exc):
+    """Whether `exc` means the connection was never established, so upstream never saw the request."""
+    if isinstance(exc, (ConnectTimeout, ConnectFailed)):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _after_error(breaker, method, attempt, exc, latency):
+    """Record a transport error on the breaker and limiter; returns the delay before a retry, or None to re-raise."""
+    if not isinstance(exc, (Timeout, ConnectionError)):
+        breaker.record(None)
+        _LIMITER.release(breaker.name, latency, None)
+        return None
+    breaker.record(False)
+    _LIMITER.release(breaker.name, latency, False)
+    # after a read timeout upstream may still be working on the request, so only
+    # failures to connect (or, for endpoints opted in, dropped connections) are retried
+    if not isinstance(exc, ConnectionError):
+        return None
+    if breaker.name not in (API_CONFIG.get('RETRY') or {}).get('STATUS_RETRY_ENDPOINTS', ()) and not _never_sent(exc):
+        return None
+    return _retry_delay(method, attempt)
+
+
+def _host_key(url):
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def _new_session():
+    pool_size = max(1, int(API_CONFIG.get('POOL_SIZE', 20)))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # sessions are shared by every user of the app, so never keep upstream cookies
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session(url):
+    """Return the pooled session for the host of `url`, creating it on first use."""
+    key = _host_key(url)
+    session = _SESSIONS.get(key)
+    if session is None:
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.get(key)
+            if session is None:
+                session = _new_session()
+                _SESSIONS[key] = session
+    return session
+
+
+def timeout_for(endpoint):
+    """Look up the timeout for a named endpoint in API_CONFIG['TIMEOUTS']."""
+    timeouts = API_CONFIG.get('TIMEOUTS') or {}
+    return timeouts.get(endpoint, API_CONFIG.get('TIMEOUT', 30))
+
+
+def _acquire(breaker):
+    """Take a concurrency slot and pass the endpoint's breaker, or raise UpstreamUnavailable."""
+    _LIMITER.acquire()
+    try:
+        breaker.before_call()
+    except CircuitOpen:
+        _LIMITER.release(breaker.name, 0, None)
+        raise
+
+
+def request(method, url, endpoint='default', timeout=None, **kwargs):
+    """Send a request through the pooled session for `url`'s host.
+    `endpoint` selects the timeout from API_CONFIG['TIMEOUTS'] unless `timeout` is given,
+    and names the circuit breaker the call is counted against.
+    Raises CircuitOpen instead of calling an endpoint that is failing, and
+    Overloaded while the adaptive concurrency limit is reached.
+    """
+    if timeout is None:
+        timeout = timeout_for(endpoint)
+    session = get_session(url)
+    breaker = breaker_for(endpoint)
+    attempt = 0
+    while True:
+        attempt += 1
+        _acquire(breaker)
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except RequestException as e:
+            delay = _after_error(breaker, method, attempt, e, time.monotonic() - started)
+            if delay is None:
+                raise
+        except BaseException:
+            breaker.record(None)
+            _LIMITER.release(endpoint, 0, None)
+            raise
+        else:
+            delay = _after_response(breaker, method, attempt, response, time.monotonic() - started)
+            if delay is None:
+                return response
+            response.close()
+        breaker.note_retry()
+        logger.debug("Retrying upstream '%s' in %.2fs (attempt %s)", endpoint, delay, attempt + 1)
+        time.sleep(delay)
+
+
+def get(url, endpoint='default', **kwargs):
+    return request('GET', url, endpoint=endpoint, **kwargs)
+
+
+def post(url, endpoint='default', **kwargs):
+    return request('POST', url, endpoint=endpoint, **kwargs)
+
+
+def get_async_client():
+    """Return the shared httpx.AsyncClient used by the async entry point.
+    httpx pools keep-alive connections per host, so one client covers every endpoint.
+    """
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        import httpx
+
+        pool_size = max(1, int(API_CONFIG.get('POOL_SIZE', 20)))
+        max_connections = max(pool_size, int(API_CONFIG.get('ASYNC_MAX_CONNECTIONS', 1000)))
+        _ASYNC_CLIENT = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=pool_size),
+            # shared by every user of the app, so never keep upstream cookies
+            cookies=httpx.Cookies(CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))),
+        )
+    return _ASYNC_CLIENT
+
+
+async def close_async_client():
+    global _ASYNC_CLIENT
+    client, _ASYNC_CLIENT = _ASYNC_CLIENT, None
+    if client is not None:
+        await client.aclose()
+
+
+@contextmanager
+def requests_errors():
+    """Re-raise httpx errors as the matching requests exceptions so sync and
+    async callers can share one error-mapping path.
+    """
+    import httpx
+
+    try:
+        yield
+    except httpx.ConnectTimeout as e:
+        raise ConnectTimeout(str(e)) from e
+    except httpx.TimeoutException as e:
+        raise Timeout(str(e)) from e
+    except httpx.ConnectError as e:
+        raise ConnectFailed(str(e)) from e
+    except httpx.NetworkError as e:
+        raise ConnectionError(str(e)) from e
+    except httpx.HTTPError as e:
+        raise RequestException(str(e)) from e
+
+
+async def async_request(method, url, endpoint='default', timeout=None, stream=False, **kwargs):
+    """Async counterpart of request(). With `stream=True` the body is not read;
+    iterate it with aiter_lines() and close it with `await response.aclose()`.
+    """
+    if timeout is None:
+        timeout = timeout_for(endpoint)
+    client = get_async_client()
+    breaker = breaker_for(endpoint)
+    attempt = 0
+    while True:
+        attempt += 1
+        _acquire(breaker)
+        started = time.monotonic()
+        try:
+            with requests_errors():
+                if stream:
+                    upstream_request = client.build_request(method, url, timeout=timeout, **kwargs)
+                    response = await client.send(upstream_request, stream=True)
+                else:
+                    response = await client.request(method, url, timeout=timeout, **kwargs)
+        except RequestException as e:
+            delay = _after_error(breaker, method, attempt, e, time.monotonic() - started)
+            if delay is None:
+                raise
+        except BaseException:
+            breaker.record(None)
+            _LIMITER.release(endpoint, 0, None)
+            raise
+        else:
+            delay = _after_response(breaker, method, attempt, response, time.monotonic() - started)
+            if delay is None:
+                return response
+            await response.aclose()
+        breaker.note_retry()
+        logger.debug("Retrying upstream '%s' in %.2fs (attempt %s)", endpoint, delay, attempt + 1)
+        await asyncio.sleep(delay)
+
+
+async def aiter_lines(response):
+    """Iterate the lines of a streamed async response with requests-style errors."""
+    with requests_errors():
+        async for line in response.aiter_lines():
+            yield line
+
+
+async def async_get(url, endpoint='default', **kwargs):
+    return await async_request('GET', url, endpoint=endpoint, **kwargs)
+
+
+async def async_post(url, endpoint='default', **kwargs):
+    return await async_request('POST', url, endpoint=endpoint, **kwargs)
+
+
+def _upstream_hosts():
+    hosts = []
+    for value in API_CONFIG.values():
+        if isinstance(value, str) and value.startswith(('http://', 'https://')):
+            key = _host_key(value)
+            if key not in hosts:
+                hosts.append(key)
+    return hosts
+
+
+def warm_up():
+    """Open a keep-alive connection to each configured upstream host in the background.
+    Best-effort: failures are logged and ignored.
+    """
+    if not API_CONFIG.get('WARM_UP', True):
+        return None
+
+    def _run():
+        for host in _upstream_hosts():
+            try:
+                get_session(host).head(f"{host}/", timeout=timeout_for('warm_up'))
+                logger.debug("Warmed up upstream connection to %s", host)
+            except Exception as e:
+                logger.debug("Upstream warm-up failed for %s: %s", host, str(e))
+
+    thread = threading.Thread(target=_run, name='upstream-warm-up', daemon=True)
+    thread.start()
+    return thread